@@ -0,0 +1,167 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# An inverted file (IVF) index for approximate nearest neighbour search
+# over an embedding matrix. The rows are clustered with spherical
+# k-means, and a query is only compared against the rows of the few
+# clusters whose centroids are closest to it. The index only stores the
+# clustering, the rows themselves stay within the embedding matrix.
+
+import pathlib
+
+import numpy as np
+
+from assistance._similarity import normalise_rows
+
+# Matrices with fewer rows than this are searched exactly
+MIN_ROWS_FOR_INDEX = 4096
+
+DEFAULT_NUM_PROBES = 8
+
+TRAINING_ROWS_PER_LIST = 64
+TRAINING_ITERATIONS = 10
+
+# Rows are assigned to their centroids this many at a time, to bound
+# the memory used for the similarity block.
+ASSIGNMENT_BLOCK_ROWS = 8192
+
+
+class IVFIndex:
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        order: np.ndarray,
+        offsets: np.ndarray,
+        norms: np.ndarray,
+    ):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.norms = norms
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, num_lists: int | None = None, seed=0):
+        if num_lists is None:
+            num_lists = max(1, int(np.sqrt(len(matrix))))
+
+        rng = np.random.default_rng(seed)
+
+        num_training_rows = min(len(matrix), num_lists * TRAINING_ROWS_PER_LIST)
+        training_rows = np.sort(
+            rng.choice(len(matrix), size=num_training_rows, replace=False)
+        )
+        training = normalise_rows(matrix[training_rows])
+
+        centroids = training[rng.choice(len(training), size=num_lists, replace=False)]
+
+        for _ in range(TRAINING_ITERATIONS):
+            assignments = np.argmax(training @ centroids.T, axis=1)
+
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, training)
+
+            # Empty lists keep their previous centroid
+            empty = np.bincount(assignments, minlength=num_lists) == 0
+            sums[empty] = centroids[empty]
+
+            centroids = normalise_rows(sums)
+
+        norms = np.empty(len(matrix), dtype=np.float32)
+        assignments = np.empty(len(matrix), dtype=np.int64)
+
+        for start in range(0, len(matrix), ASSIGNMENT_BLOCK_ROWS):
+            block = np.asarray(
+                matrix[start : start + ASSIGNMENT_BLOCK_ROWS], dtype=np.float32
+            )
+            block_norms = np.linalg.norm(block, axis=1)
+            block_norms[block_norms == 0] = 1
+
+            norms[start : start + len(block)] = block_norms
+            assignments[start : start + len(block)] = np.argmax(
+                block @ centroids.T, axis=1
+            )
+
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(assignments, minlength=num_lists))]
+        )
+
+        return cls(centroids=centroids, order=order, offsets=offsets, norms=norms)
+
+    def search(
+        self,
+        matrix: np.ndarray,
+        queries: np.ndarray,
+        k: int,
+        num_probes: int = DEFAULT_NUM_PROBES,
+    ) -> tuple[list[list[int]], list[list[float]]]:
+        normalised_queries = normalise_rows(queries)
+        num_probes = min(num_probes, len(self.centroids))
+
+        centroid_scores = normalised_queries @ self.centroids.T
+        all_probes = np.argpartition(-centroid_scores, num_probes - 1, axis=1)[
+            :, :num_probes
+        ]
+
+        all_indices = []
+        all_scores = []
+
+        for query, probes in zip(normalised_queries, all_probes):
+            rows = np.sort(
+                np.concatenate(
+                    [self.order[self.offsets[p] : self.offsets[p + 1]] for p in probes]
+                )
+            )
+
+            if len(rows) < k:
+                # Too few rows within the probed lists, search them all
+                rows = np.arange(len(matrix))
+
+            scores = (matrix[rows] @ query) / self.norms[rows]
+
+            if k < len(rows):
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(rows))
+
+            top = top[np.argsort(-scores[top], kind="stable")]
+
+            all_indices.append(rows[top].tolist())
+            all_scores.append(scores[top].astype(float).tolist())
+
+        return all_indices, all_scores
+
+    def save(self, path: pathlib.Path):
+        temp_path = path.with_name(f"{path.name}.tmp")
+
+        with open(temp_path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                order=self.order,
+                offsets=self.offsets,
+                norms=self.norms,
+            )
+
+        temp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: pathlib.Path):
+        with np.load(path) as data:
+            return cls(
+                centroids=data["centroids"],
+                order=data["order"],
+                offsets=data["offsets"],
+                norms=data["norms"],
+            )
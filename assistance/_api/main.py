@@ -12,11 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from assistance import _ctx, _logging
+from assistance import _cpu, _ctx, _logging, _tokens
 from assistance._config import ROOT_DOMAIN
 
 from .routers import contact_form, email, postal, stripe
@@ -51,11 +53,13 @@ app.include_router(contact_form.router)
 @app.on_event("startup")
 async def startup_event():
     _ctx.open_session()
+    await asyncio.to_thread(_tokens.load_encodings)
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     await _ctx.close_session()
+    _cpu.shutdown()
 
 
 def main():
@@ -0,0 +1,404 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Downloaded articles are kept alongside the metadata of the response
+# they came from: its status, ETag, Last-Modified, and when it was
+# fetched. Once an article is older than `ARTICLE_TTL_SECONDS` it is
+# revalidated with a conditional request, so an unchanged article costs
+# a 304 rather than its whole body. Failed downloads are recorded too,
+# and the url is not tried again until a backoff, which doubles with
+# each consecutive failure, has passed. A stale article is still served
+# when its revalidation fails.
+#
+# The text extracted from an article is cached as well, keyed by the
+# hash of the article's HTML and the parser that extracted it, so that an
+# article shared by many subscriptions is only parsed the once. A bounded
+# in-memory tier sits in front of the extracted-article-text records.
+# Only the page's main content is kept where it can be found, see
+# `_readability`.
+
+import asyncio
+import functools
+import importlib.util
+import json
+import logging
+import os
+import time
+from typing import Literal, TypedDict
+
+import aiofiles
+import aiohttp
+from cachetools import LRUCache
+
+from assistance import _paths
+from assistance._config import get_html_parser
+from assistance._cpu import run_cpu_bound
+from assistance._metrics import increment
+from assistance._readability import get_main_content
+from assistance._scraper import fetch
+from assistance._singleflight import SingleFlight
+from assistance._utilities import get_hash_digest
+from assistance._vendor.stackoverflow.web_scraping import HTMLParserName, extract_text
+
+ARTICLE_TTL_SECONDS = 24 * 60 * 60
+
+FAILURE_BACKOFF_SECONDS = 60 * 60
+MAX_FAILURE_BACKOFF_SECONDS = 7 * 24 * 60 * 60
+
+NOT_FOUND_STATUSES = frozenset({404, 410})
+
+# Within the body of pages that are missing but served with a 200 status
+SOFT_NOT_FOUND_MARKER = b"Error 404"
+
+NOT_RELEVANT = b"NOT_RELEVANT"
+
+# Bumped whenever `extract_text` changes what it returns, so that text
+# extracted by an older version is not served.
+TEXT_EXTRACTION_VERSION = 2
+
+MAIN_CONTENT_ONLY = True
+
+# Entries are sized by their number of characters
+TEXT_MEMORY_TIER_MAX_CHARACTERS = 64 * 2**20
+
+# Tried in order when no parser is configured
+PREFERRED_HTML_PARSERS: list[HTMLParserName] = ["selectolax", "lxml", "html.parser"]
+HTML_PARSER_MODULES = {"selectolax": "selectolax", "lxml": "lxml"}
+
+FailureKind = Literal["not_found", "blocked", "timeout", "error"]
+
+
+class Failure(TypedDict):
+    kind: FailureKind
+    message: str
+    count: int
+    retry_at: float
+
+
+class ArticleMetadata(TypedDict):
+    url: str
+    status: int | None
+    etag: str | None
+    last_modified: str | None
+    fetched_at: float | None
+    failure: Failure | None
+
+
+_article_single_flight = SingleFlight("article_download")
+_text_single_flight = SingleFlight("article_text")
+_text_memory_tier: LRUCache[str, str] = LRUCache(
+    maxsize=TEXT_MEMORY_TIER_MAX_CHARACTERS, getsizeof=len
+)
+
+
+async def scrape(url: str) -> str:
+    """The text of the article at the url, downloaded and parsed as needed."""
+    html = await get_article(url)
+
+    try:
+        html.decode(encoding="utf8")
+    except UnicodeDecodeError:
+        return "NOT_RELEVANT"
+
+    return await get_article_text(html)
+
+
+async def get_article_text(html: bytes, parser: HTMLParserName | None = None) -> str:
+    if parser is None:
+        parser = get_html_parser_name()
+
+    main_content_only = MAIN_CONTENT_ONLY
+
+    hash_digest = get_hash_digest(
+        f"{TEXT_EXTRACTION_VERSION}\n{parser}\n{main_content_only}\n"
+        f"{html.decode(encoding='utf8')}"
+    )
+
+    try:
+        text = _text_memory_tier[hash_digest]
+    except KeyError:
+        pass
+    else:
+        increment("article_text.memory.hits")
+        return text
+
+    text = await _text_single_flight.run(
+        hash_digest,
+        lambda: _get_article_text(html, parser, main_content_only, hash_digest),
+    )
+    _text_memory_tier[hash_digest] = text
+
+    return text
+
+
+@functools.cache
+def get_html_parser_name() -> HTMLParserName:
+    configured = get_html_parser()
+    if configured is not None:
+        return configured
+
+    for name in PREFERRED_HTML_PARSERS:
+        module = HTML_PARSER_MODULES.get(name)
+        if module is None or importlib.util.find_spec(module) is not None:
+            return name
+
+    return "html.parser"
+
+
+async def _get_article_text(
+    html: bytes, parser: HTMLParserName, main_content_only: bool, hash_digest: str
+) -> str:
+    path = _paths.get_extracted_article_text_path(hash_digest, create_parent=True)
+
+    try:
+        async with aiofiles.open(path, encoding="utf8") as f:
+            text = json.loads(await f.read())["text"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+    else:
+        increment("article_text.disk.hits")
+        return text
+
+    increment("article_text.misses")
+    text, found_main_content = await run_cpu_bound(
+        _extract_text, html, parser, main_content_only
+    )
+
+    if main_content_only:
+        increment(
+            "article_text.main_content"
+            if found_main_content
+            else "article_text.whole_page"
+        )
+
+    await _write_atomically(
+        path, json.dumps({"parser": parser, "text": text}).encode(encoding="utf8")
+    )
+
+    return text
+
+
+async def get_article(url: str) -> bytes:
+    """The article's body, downloading it only when the cache cannot serve it.
+
+    Articles that cannot be found give `NOT_RELEVANT`. Other failures are
+    raised, a timeout as `asyncio.TimeoutError` and anything else as a
+    `ValueError`, including while the url is backing off.
+    """
+    url_hash_digest = get_hash_digest(url)
+
+    return await _article_single_flight.run(
+        url_hash_digest, lambda: _get_article(url, url_hash_digest)
+    )
+
+
+async def _get_article(url: str, url_hash_digest: str) -> bytes:
+    body_path = _paths.get_downloaded_article_path(url_hash_digest, create_parent=True)
+    metadata_path = _paths.get_downloaded_article_metadata_path(
+        url_hash_digest, create_parent=True
+    )
+
+    # TODO: Remove this
+    meta_data_path = _paths.get_article_metadata_path(url_hash_digest)
+
+    if meta_data_path.exists():
+        meta_data_path.rename(body_path)
+    # Down to here
+
+    metadata = _load_metadata(url, body_path, metadata_path)
+    body = await _read_body(body_path) if metadata["fetched_at"] else None
+
+    now = time.time()
+    failure = metadata["failure"]
+
+    if failure is not None and now < failure["retry_at"]:
+        if body is not None:
+            increment("articles.stale_hit")
+            return body
+
+        increment("articles.backing_off")
+        return _handle_failure(url, failure)
+
+    if body is not None and now - (metadata["fetched_at"] or 0) < ARTICLE_TTL_SECONDS:
+        logging.info(f"Using cached version of {url}")
+        increment("articles.cache_hit")
+        return body
+
+    headers = {}
+    if body is not None:
+        if metadata["etag"]:
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata["last_modified"]:
+            headers["If-Modified-Since"] = metadata["last_modified"]
+
+    logging.info(f"Downloading {url}")
+
+    try:
+        page = await fetch(url, headers=headers)
+    except asyncio.TimeoutError as e:
+        page_failure = _record_failure(metadata, "timeout", repr(e))
+    except (aiohttp.ClientError, ValueError) as e:
+        page_failure = _record_failure(metadata, "error", repr(e))
+    else:
+        page_failure = None
+
+        if page["status"] == 304 and body is not None:
+            increment("articles.not_modified")
+            _record_success(metadata, page["status"], page["headers"])
+        elif page["status"] in NOT_FOUND_STATUSES:
+            page_failure = _record_failure(
+                metadata, "not_found", f"Status {page['status']}"
+            )
+        elif SOFT_NOT_FOUND_MARKER in page["body"]:
+            page_failure = _record_failure(metadata, "not_found", "Error page")
+        elif b"Our systems have detected unusual traffic" in page["body"]:
+            page_failure = _record_failure(metadata, "blocked", "Unusual traffic")
+        elif page["status"] >= 400:
+            page_failure = _record_failure(
+                metadata, "error", f"Status {page['status']}"
+            )
+        else:
+            increment("articles.downloaded")
+            _record_success(metadata, page["status"], page["headers"])
+
+            body = page["body"]
+            await _write_atomically(body_path, body)
+
+    await _write_atomically(metadata_path, json.dumps(metadata, indent=2).encode())
+
+    if page_failure is None:
+        assert body is not None
+        return body
+
+    if body is not None:
+        increment("articles.stale_hit")
+        return body
+
+    return _handle_failure(url, page_failure)
+
+
+def _extract_text(
+    html: bytes, parser: HTMLParserName, main_content_only: bool
+) -> tuple[str, bool]:
+    """Runs on the CPU pool, returns whether the main content was found."""
+    if main_content_only:
+        # Readability works over a BeautifulSoup tree
+        features = parser
+        if parser == "selectolax":
+            features = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+        main_content = get_main_content(html, features)
+        if main_content is not None:
+            return extract_text(main_content.encode(encoding="utf8"), parser), True
+
+    return extract_text(html, parser), False
+
+
+def _load_metadata(url, body_path, metadata_path) -> ArticleMetadata:
+    try:
+        with open(metadata_path, encoding="utf8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    metadata: ArticleMetadata = {
+        "url": url,
+        "status": None,
+        "etag": None,
+        "last_modified": None,
+        "fetched_at": None,
+        "failure": None,
+    }
+
+    # Articles downloaded before metadata was kept count as fetched when
+    # their file was written, apart from the error pages that were saved.
+    try:
+        with open(body_path, "rb") as f:
+            legacy_body = f.read()
+    except FileNotFoundError:
+        return metadata
+
+    if SOFT_NOT_FOUND_MARKER not in legacy_body:
+        metadata["status"] = 200
+        metadata["fetched_at"] = body_path.stat().st_mtime
+
+    return metadata
+
+
+async def _read_body(body_path) -> bytes | None:
+    try:
+        async with aiofiles.open(body_path, "rb") as f:
+            return await f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _record_success(metadata: ArticleMetadata, status: int, headers):
+    metadata["fetched_at"] = time.time()
+    metadata["failure"] = None
+
+    # A 304 only repeats the validators, the article is unchanged
+    if status != 304:
+        metadata["status"] = status
+        metadata["etag"] = headers.get("ETag")
+        metadata["last_modified"] = headers.get("Last-Modified")
+    else:
+        metadata["etag"] = headers.get("ETag", metadata["etag"])
+
+
+def _record_failure(
+    metadata: ArticleMetadata, kind: FailureKind, message: str
+) -> Failure:
+    increment(f"articles.failed.{kind}")
+
+    previous = metadata["failure"]
+    count = 1 if previous is None else previous["count"] + 1
+
+    backoff = min(
+        FAILURE_BACKOFF_SECONDS * 2 ** (count - 1), MAX_FAILURE_BACKOFF_SECONDS
+    )
+
+    failure: Failure = {
+        "kind": kind,
+        "message": message,
+        "count": count,
+        "retry_at": time.time() + backoff,
+    }
+    metadata["failure"] = failure
+
+    return failure
+
+
+def _handle_failure(url: str, failure: Failure) -> bytes:
+    if failure["kind"] == "not_found":
+        return NOT_RELEVANT
+
+    message = (
+        f"{url} failed {failure['count']} times in a row, "
+        f"most recently with {failure['message']}"
+    )
+
+    if failure["kind"] == "timeout":
+        raise asyncio.TimeoutError(message)
+
+    raise ValueError(message)
+
+
+async def _write_atomically(path, data: bytes):
+    temp_path = path.with_name(f"{path.name}.tmp")
+
+    async with aiofiles.open(temp_path, "wb") as f:
+        await f.write(data)
+
+    os.replace(temp_path, path)
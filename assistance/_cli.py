@@ -51,3 +51,22 @@ def tasker():
     from assistance._tasker import main as _main
 
     _main()
+
+
+@app.command()
+def migrate_completion_cache():
+    """Import the completion-cache files tree into the SQLite store."""
+    from assistance._completion_cache import SQLiteDiskStore, migrate_files_to_sqlite
+    from assistance._paths import COMPLETION_CACHE, COMPLETION_CACHE_DATABASE
+
+    sqlite_store = SQLiteDiskStore(COMPLETION_CACHE_DATABASE)
+
+    try:
+        number_imported = migrate_files_to_sqlite(COMPLETION_CACHE, sqlite_store)
+    finally:
+        sqlite_store.close()
+
+    logging.info(
+        f"Imported {number_imported} entries into {COMPLETION_CACHE_DATABASE}. "
+        "Write `sqlite` to the `completion-cache-backend` config item to use it."
+    )
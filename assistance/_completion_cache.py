@@ -0,0 +1,376 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# The completion cache stores every OpenAI completion and embedding
+# response by the hash of its request. A bounded in-memory tier sits in
+# front of an on-disk store so that repeated requests skip the disk read.
+# The tier holds each entry in its serialised form, and every hit decodes
+# a fresh copy, so that a caller altering its response cannot alter the
+# response served to anyone else.
+#
+# Two on-disk stores are available. "files" writes one file per hash
+# within the sharded completion-cache records directory, `.json` for
+# responses and `.bin` for binary embeddings. "sqlite"
+# packs every entry into a single SQLite database, which avoids the
+# inode and directory overhead of millions of small files. The store in
+# use is chosen by the `completion-cache-backend` config item, and the
+# `migrate-completion-cache` CLI command imports the files tree into
+# the SQLite database.
+#
+# Embeddings are stored as raw little-endian float32 values behind a
+# small header rather than as the JSON response from OpenAI, so that
+# they can be read with `numpy.frombuffer` without being parsed. Older
+# JSON embedding entries are still read, and are rewritten in the binary
+# format when they are.
+
+import asyncio
+import functools
+import itertools
+import json
+import logging
+import pathlib
+import sqlite3
+import struct
+import sys
+import threading
+from typing import Any, Literal, Protocol
+
+import aiofiles
+import numpy as np
+from cachetools import FIFOCache, LFUCache, LRUCache
+
+from assistance import _paths
+from assistance._config import get_completion_cache_backend
+from assistance._metrics import increment
+
+EvictionPolicy = Literal["lru", "lfu", "fifo"]
+DiskStoreName = Literal["files", "sqlite"]
+
+# Entries are sized by the memory that their serialised bytes take up
+MEMORY_TIER_MAX_BYTES = 256 * 2**20
+MEMORY_TIER_EVICTION_POLICY: EvictionPolicy = "lru"
+
+EVICTION_POLICIES = {
+    "lru": LRUCache,
+    "lfu": LFUCache,
+    "fifo": FIFOCache,
+}
+
+MIGRATION_BATCH_SIZE = 1000
+
+JSON_SUFFIX = ".json"
+BINARY_SUFFIX = ".bin"
+FILE_SUFFIXES = (JSON_SUFFIX, BINARY_SUFFIX)
+
+# Magic, format version, bytes per value, number of values, reserved
+EMBEDDING_HEADER = struct.Struct("<4sHHI4x")
+EMBEDDING_MAGIC = b"AEMB"
+EMBEDDING_FORMAT_VERSION = 1
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+
+class DiskStore(Protocol):
+    async def get(self, hash_digest: str) -> bytes | None:
+        ...
+
+    async def put(self, hash_digest: str, data: bytes):
+        ...
+
+
+class FilesDiskStore:
+    def __init__(self, root: pathlib.Path | None = None):
+        self.root = root
+
+    async def get(self, hash_digest: str) -> bytes | None:
+        for suffix in FILE_SUFFIXES:
+            try:
+                async with aiofiles.open(
+                    self._get_path(hash_digest, suffix=suffix), "rb"
+                ) as f:
+                    return await f.read()
+            except FileNotFoundError:
+                continue
+
+        return None
+
+    async def put(self, hash_digest: str, data: bytes):
+        suffix = BINARY_SUFFIX if data.startswith(EMBEDDING_MAGIC) else JSON_SUFFIX
+        path = self._get_path(hash_digest, create_parent=True, suffix=suffix)
+
+        async with aiofiles.open(path, "wb") as f:
+            await f.write(data)
+
+        # A legacy JSON embedding that has been rewritten as binary
+        for other_suffix in FILE_SUFFIXES:
+            if other_suffix != suffix:
+                self._get_path(hash_digest, suffix=other_suffix).unlink(missing_ok=True)
+
+    def _get_path(
+        self, hash_digest: str, create_parent: bool = False, suffix=JSON_SUFFIX
+    ):
+        if self.root is None:
+            return _paths.get_completion_cache_path(hash_digest, create_parent, suffix)
+
+        return _paths._get_record_path(self.root, hash_digest, create_parent, suffix)
+
+
+class SQLiteDiskStore:
+    def __init__(self, path: pathlib.Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS completion_cache "
+                "(hash TEXT PRIMARY KEY, data BLOB NOT NULL) WITHOUT ROWID"
+            )
+
+    async def get(self, hash_digest: str) -> bytes | None:
+        return await asyncio.to_thread(self.get_sync, hash_digest)
+
+    async def put(self, hash_digest: str, data: bytes):
+        await asyncio.to_thread(self.put_many_sync, [(hash_digest, data)])
+
+    def get_sync(self, hash_digest: str) -> bytes | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM completion_cache WHERE hash = ?", (hash_digest,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return row[0]
+
+    def put_many_sync(self, items: list[tuple[str, bytes]]):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO completion_cache (hash, data) VALUES (?, ?)",
+                items,
+            )
+
+    def contains_sync(self, hash_digest: str) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM completion_cache WHERE hash = ?", (hash_digest,)
+            ).fetchone()
+
+        return row is not None
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def create_disk_store(name: DiskStoreName) -> DiskStore:
+    if name == "files":
+        return FilesDiskStore()
+
+    if name == "sqlite":
+        return SQLiteDiskStore(_paths.COMPLETION_CACHE_DATABASE)
+
+    raise ValueError(f"Unknown completion cache backend: {name}")
+
+
+@functools.cache
+def _get_disk_store() -> DiskStore:
+    return create_disk_store(get_completion_cache_backend())
+
+
+def create_memory_tier(eviction_policy: EvictionPolicy, max_bytes: int):
+    cache_class = EVICTION_POLICIES[eviction_policy]
+
+    class MemoryTier(cache_class):
+        def popitem(self):
+            item = super().popitem()
+            increment("completion_cache.memory.evictions")
+
+            return item
+
+    # Values are the serialised entries, as bytes
+    return MemoryTier(maxsize=max_bytes, getsizeof=sys.getsizeof)
+
+
+_memory_tier = create_memory_tier(
+    MEMORY_TIER_EVICTION_POLICY, max_bytes=MEMORY_TIER_MAX_BYTES
+)
+
+
+async def get_cached_response(hash_digest: str) -> Any | None:
+    try:
+        serialised_response = _memory_tier[hash_digest]
+    except KeyError:
+        increment("completion_cache.memory.misses")
+    else:
+        increment("completion_cache.memory.hits")
+        return json.loads(serialised_response)
+
+    serialised_response = await _get_disk_store().get(hash_digest)
+
+    try:
+        if serialised_response is None:
+            raise ValueError("Not within the cache")
+
+        response = json.loads(serialised_response)
+    except ValueError:
+        increment("completion_cache.disk.misses")
+        return None
+
+    increment("completion_cache.disk.hits")
+    _remember(hash_digest, serialised_response)
+
+    return response
+
+
+async def store_cached_response(hash_digest: str, response):
+    serialised_response = json.dumps(response, separators=(",", ":")).encode()
+    _remember(hash_digest, serialised_response)
+
+    await _get_disk_store().put(hash_digest, serialised_response)
+
+
+async def get_cached_embedding(hash_digest: str) -> np.ndarray | None:
+    try:
+        data = _memory_tier[hash_digest]
+    except KeyError:
+        increment("completion_cache.memory.misses")
+    else:
+        increment("completion_cache.memory.hits")
+        return decode_embedding(data)
+
+    data = await _get_disk_store().get(hash_digest)
+
+    try:
+        if data is None:
+            raise ValueError("Not within the cache")
+
+        if data.startswith(EMBEDDING_MAGIC):
+            embedding = decode_embedding(data)
+            _remember(hash_digest, data)
+        else:
+            embedding = np.array(
+                json.loads(data)["data"][0]["embedding"], dtype=EMBEDDING_DTYPE
+            )
+            await store_cached_embedding(hash_digest, embedding)
+    except (ValueError, KeyError, IndexError, TypeError):
+        increment("completion_cache.disk.misses")
+        return None
+
+    increment("completion_cache.disk.hits")
+
+    return embedding
+
+
+async def store_cached_embedding(hash_digest: str, embedding: np.ndarray):
+    data = encode_embedding(embedding)
+    _remember(hash_digest, data)
+
+    await _get_disk_store().put(hash_digest, data)
+
+
+def encode_embedding(embedding) -> bytes:
+    values = np.ascontiguousarray(embedding, dtype=EMBEDDING_DTYPE)
+    if values.ndim != 1:
+        raise ValueError("Only a single embedding vector can be encoded")
+
+    header = EMBEDDING_HEADER.pack(
+        EMBEDDING_MAGIC, EMBEDDING_FORMAT_VERSION, values.itemsize, len(values)
+    )
+
+    return header + values.tobytes()
+
+
+def decode_embedding(data: bytes) -> np.ndarray:
+    magic, version, itemsize, length = EMBEDDING_HEADER.unpack_from(data)
+
+    if magic != EMBEDDING_MAGIC or version != EMBEDDING_FORMAT_VERSION:
+        raise ValueError("Not a supported binary embedding")
+
+    if itemsize != EMBEDDING_DTYPE.itemsize:
+        raise ValueError(f"Unexpected embedding value size: {itemsize}")
+
+    # A read-only view onto the bytes, no copy is made
+    return np.frombuffer(
+        data, dtype=EMBEDDING_DTYPE, count=length, offset=EMBEDDING_HEADER.size
+    )
+
+
+def _remember(hash_digest: str, data: bytes):
+    try:
+        _memory_tier[hash_digest] = data
+    except ValueError:
+        # Larger than the whole memory tier
+        pass
+
+
+def migrate_files_to_sqlite(
+    files_root: pathlib.Path, sqlite_store: SQLiteDiskStore
+) -> int:
+    """Import every entry of a files store into a SQLite store.
+
+    Entries that are already within the SQLite store are skipped, so the
+    migration can be resumed. Returns the number of imported entries.
+    """
+    number_imported = 0
+    batch: list[tuple[str, bytes]] = []
+
+    paths = itertools.chain.from_iterable(
+        files_root.glob(f"*/*/*{suffix}") for suffix in FILE_SUFFIXES
+    )
+
+    for path in paths:
+        hash_digest = path.stem
+        if sqlite_store.contains_sync(hash_digest):
+            continue
+
+        data = path.read_bytes()
+
+        try:
+            data = _compact_entry(data)
+        except ValueError:
+            logging.warning(f"Skipping unreadable completion cache entry: {path}")
+            continue
+
+        batch.append((hash_digest, data))
+
+        if len(batch) >= MIGRATION_BATCH_SIZE:
+            sqlite_store.put_many_sync(batch)
+            number_imported += len(batch)
+            batch = []
+
+            logging.info(f"Imported {number_imported} completion cache entries")
+
+    sqlite_store.put_many_sync(batch)
+    number_imported += len(batch)
+
+    return number_imported
+
+
+def _compact_entry(data: bytes) -> bytes:
+    if data.startswith(EMBEDDING_MAGIC):
+        return data
+
+    response = json.loads(data)
+
+    try:
+        embedding = response["data"][0]["embedding"]
+    except (KeyError, IndexError, TypeError):
+        # Re-serialised compactly, the files store used to indent
+        return json.dumps(response, separators=(",", ":")).encode()
+
+    return encode_embedding(embedding)
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import json
+import os
 import pathlib
 import tomllib
 from typing import Any, Literal, TypedDict, cast
@@ -28,6 +29,7 @@ from assistance._paths import (
     FORM_TEMPLATES,
     USER_DETAILS,
 )
+from assistance._utilities import get_hash_digest
 
 SIMPLER_OPENAI_MODEL = "gpt-3.5-turbo"
 SOTA_OPENAI_MODEL = "gpt-4"
@@ -38,6 +40,9 @@ ROOT_DOMAIN = "assistance.chat"
 PAYMENT_LINK = "https://buy.stripe.com/bIYeXF2s1d0E4wg9AB"
 EMAIL_PRODUCT_ID = "prod_NLuYISl8KZ6fUX"
 
+# Used when the `cpu-workers` config item is not set
+DEFAULT_MAX_CPU_WORKERS = 4
+
 TargetedNewsFormats = Literal["digest", "discourse"]
 
 
@@ -74,6 +79,34 @@ def get_google_oauth_client_id():
     return _load_config_item("google-oauth-client-id")
 
 
+def get_completion_cache_backend():
+    try:
+        return _load_config_item("completion-cache-backend")
+    except FileNotFoundError:
+        return "files"
+
+
+def get_embedding_store_dtype():
+    try:
+        return _load_config_item("embedding-store-dtype")
+    except FileNotFoundError:
+        return "float32"
+
+
+def get_html_parser():
+    try:
+        return _load_config_item("html-parser")
+    except FileNotFoundError:
+        return None
+
+
+def get_cpu_workers():
+    try:
+        return int(_load_config_item("cpu-workers"))
+    except FileNotFoundError:
+        return min(DEFAULT_MAX_CPU_WORKERS, os.cpu_count() or 1)
+
+
 def _load_config_item(name: str):
     path = CONFIG / name
 
@@ -147,9 +180,29 @@ async def load_form_config(name: str) -> FormConfig:
     return form_template
 
 
-async def load_faq_data(name: str):
-    async with aiofiles.open(FAQ_DATA / f"{name}.toml", encoding="utf8") as f:
-        data = cast(FormConfig, tomllib.loads(await f.read()))
+class FAQItem(TypedDict):
+    question: str
+    answer: str
+
+
+class FAQData(TypedDict):
+    name: str
+    hash: str
+    items: list[FAQItem]
+
+
+def get_faq_data_path(name: str) -> pathlib.Path:
+    return FAQ_DATA / f"{name}.toml"
+
+
+async def load_faq_data(name: str) -> FAQData:
+    async with aiofiles.open(get_faq_data_path(name), encoding="utf8") as f:
+        contents = await f.read()
+
+    data = cast(FAQData, tomllib.loads(contents))
+
+    data["name"] = name
+    data["hash"] = get_hash_digest(contents)
 
     return data
 
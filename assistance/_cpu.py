@@ -0,0 +1,75 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# CPU bound work, such as parsing HTML, is run on a pool of worker
+# processes so that it does not stall the event loop, and with it every
+# other webhook and completion that the server is handling. The number
+# of workers comes from the `cpu-workers` config item, where 0 runs the
+# work inline on the event loop instead. Workers are spawned rather than
+# forked, as the parent process already has threads and open sockets.
+
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, TypeVar
+
+from assistance._config import get_cpu_workers
+from assistance._metrics import increment
+
+T = TypeVar("T")
+
+_executor: ProcessPoolExecutor | None = None
+
+
+async def run_cpu_bound(function: Callable[..., T], *args: Any) -> T:
+    """Run the function on the worker pool, it and its arguments must pickle."""
+    executor = _get_executor()
+    if executor is None:
+        return function(*args)
+
+    loop = asyncio.get_running_loop()
+
+    try:
+        return await loop.run_in_executor(executor, functools.partial(function, *args))
+    except BrokenProcessPool:
+        # A worker died, such as from running out of memory. The next
+        # call gets a new pool rather than failing forever.
+        increment("cpu_pool.broken")
+        shutdown()
+        raise
+
+
+def shutdown():
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _get_executor() -> ProcessPoolExecutor | None:
+    global _executor
+
+    if _executor is None:
+        num_workers = get_cpu_workers()
+        if num_workers == 0:
+            return None
+
+        _executor = ProcessPoolExecutor(
+            max_workers=num_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    return _executor
@@ -16,6 +16,8 @@ import pprint
 
 import aiohttp
 
+from assistance import _scraper
+
 session: aiohttp.ClientSession
 
 pp = pprint.PrettyPrinter(indent=2)
@@ -28,3 +30,4 @@ def open_session():
 
 async def close_session():
     await session.close()
+    await _scraper.close_session()
@@ -0,0 +1,277 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# A persistent embedding matrix per dataset. Each store is a directory
+# containing a `.npy` matrix alongside an `index.json` which names the
+# matrix file and lists the hash of the block that each row was created
+# from. Rows are normalised to unit length when they are stored, so that
+# a search is a single matmul, and can be stored as float16 to halve
+# their memory. Only blocks that are not yet within the store are
+# embedded, and the matrix is memory-mapped so that loading it does not
+# copy it into memory. Large stores also get an approximate nearest
+# neighbour index, which is saved next to the matrix it was built from.
+
+import asyncio
+import collections
+import json
+import logging
+import os
+import pathlib
+
+import numpy as np
+
+from assistance._ann import MIN_ROWS_FOR_INDEX, IVFIndex
+from assistance._config import get_embedding_store_dtype
+from assistance._openai import get_embedding
+from assistance._paths import EMBEDDING_STORE
+from assistance._similarity import normalise_rows
+from assistance._utilities import get_hash_digest
+
+INDEX_FILENAME = "index.json"
+
+STORE_DTYPES = {"float32": np.float32, "float16": np.float16}
+
+# Rows checked when deciding whether a stored matrix is normalised
+NORMALISED_CHECK_ROWS = 16
+
+StoreContents = tuple[tuple[str, ...], np.ndarray]
+
+_loaded_stores: dict[str, StoreContents] = {}
+_loaded_indexes: dict[str, tuple[str, IVFIndex]] = {}
+_store_locks: collections.defaultdict[str, asyncio.Lock] = collections.defaultdict(
+    asyncio.Lock
+)
+
+
+async def get_stored_embeddings(
+    openai_api_key: str, store_name: str, blocks: tuple[str, ...]
+) -> np.ndarray:
+    """Get the unit-normalised embeddings of the blocks, a row per block."""
+    hashes = tuple(get_hash_digest(block) for block in blocks)
+
+    return await _get_matrix(openai_api_key, store_name, blocks, hashes)
+
+
+async def get_stored_embeddings_and_index(
+    openai_api_key: str, store_name: str, blocks: tuple[str, ...]
+) -> tuple[np.ndarray, IVFIndex | None]:
+    """Get the embeddings of the blocks along with an ANN index over them.
+
+    The index is always that of the returned matrix, even if the store
+    is rebuilt for other blocks in the meantime. Stores too small to
+    benefit from an index return None, and are to be searched exactly.
+    """
+    hashes = tuple(get_hash_digest(block) for block in blocks)
+    matrix = await _get_matrix(openai_api_key, store_name, blocks, hashes)
+
+    if len(matrix) < MIN_ROWS_FOR_INDEX:
+        return matrix, None
+
+    return matrix, await _get_index(store_name, hashes, matrix)
+
+
+async def _get_matrix(
+    openai_api_key: str,
+    store_name: str,
+    blocks: tuple[str, ...],
+    hashes: tuple[str, ...],
+) -> np.ndarray:
+    loaded = _loaded_stores.get(store_name)
+    if loaded is not None and loaded[0] == hashes:
+        return loaded[1]
+
+    async with _store_locks[store_name]:
+        loaded = _loaded_stores.get(store_name)
+        if loaded is None:
+            loaded = _load_store(store_name)
+
+        # Stores from before rows were normalised, or stored with another
+        # dtype, are rebuilt from their existing rows.
+        if (
+            loaded is not None
+            and loaded[0] == hashes
+            and _is_in_store_format(loaded[1])
+        ):
+            _loaded_stores[store_name] = loaded
+            return loaded[1]
+
+        matrix = await _build_matrix(openai_api_key, store_name, loaded, blocks, hashes)
+        await asyncio.to_thread(_save_store, store_name, hashes, matrix)
+
+        loaded = _load_store(store_name)
+        assert loaded is not None
+
+        _loaded_stores[store_name] = loaded
+
+    return loaded[1]
+
+
+async def _get_index(
+    store_name: str, hashes: tuple[str, ...], matrix: np.ndarray
+) -> IVFIndex:
+    matrix_key = _get_matrix_key(hashes)
+
+    cached = _loaded_indexes.get(store_name)
+    if cached is not None and cached[0] == matrix_key:
+        return cached[1]
+
+    async with _store_locks[store_name]:
+        cached = _loaded_indexes.get(store_name)
+        if cached is not None and cached[0] == matrix_key:
+            return cached[1]
+
+        index_path = _get_store_dir(store_name) / f"ivf-{matrix_key}.npz"
+
+        try:
+            index = IVFIndex.load(index_path)
+        except (FileNotFoundError, KeyError, ValueError):
+            logging.info(
+                f"Embedding store `{store_name}`: building an index of "
+                f"{len(matrix)} rows"
+            )
+            index = await asyncio.to_thread(IVFIndex.build, matrix)
+            await asyncio.to_thread(_save_index, store_name, index_path, index)
+
+        _loaded_indexes[store_name] = (matrix_key, index)
+
+    return index
+
+
+async def _build_matrix(
+    openai_api_key: str,
+    store_name: str,
+    loaded: StoreContents | None,
+    blocks: tuple[str, ...],
+    hashes: tuple[str, ...],
+):
+    if loaded is None:
+        stored_rows = {}
+        stored_matrix = None
+    else:
+        stored_rows = {block_hash: row for row, block_hash in enumerate(loaded[0])}
+        stored_matrix = loaded[1]
+
+    blocks_to_embed = {
+        block_hash: block
+        for block, block_hash in zip(blocks, hashes)
+        if block_hash not in stored_rows
+    }
+
+    logging.info(
+        f"Embedding store `{store_name}`: reusing "
+        f"{len(hashes) - len(blocks_to_embed)} rows, embedding "
+        f"{len(blocks_to_embed)} new blocks"
+    )
+
+    new_embeddings = await asyncio.gather(
+        *[
+            get_embedding(block=block, api_key=openai_api_key)
+            for block in blocks_to_embed.values()
+        ]
+    )
+    new_embeddings_by_hash = dict(zip(blocks_to_embed.keys(), new_embeddings))
+
+    rows = []
+    for block_hash in hashes:
+        try:
+            rows.append(new_embeddings_by_hash[block_hash])
+        except KeyError:
+            assert stored_matrix is not None
+            rows.append(stored_matrix[stored_rows[block_hash]])
+
+    store_dtype = _get_store_dtype()
+
+    if len(rows) == 0:
+        return np.empty((0, 0), dtype=store_dtype)
+
+    return normalise_rows(np.array(rows, dtype=np.float32)).astype(store_dtype)
+
+
+def _get_store_dtype():
+    return STORE_DTYPES[get_embedding_store_dtype()]
+
+
+def _is_in_store_format(matrix: np.ndarray) -> bool:
+    if matrix.dtype != _get_store_dtype():
+        return False
+
+    norms = np.linalg.norm(
+        np.asarray(matrix[:NORMALISED_CHECK_ROWS], dtype=np.float32), axis=1
+    )
+
+    # Rows of all zeros stay as they are when normalised
+    return bool(np.all((np.abs(norms - 1) < 1e-2) | (norms == 0)))
+
+
+def _get_store_dir(store_name: str) -> pathlib.Path:
+    return EMBEDDING_STORE / store_name
+
+
+def _load_store(store_name: str) -> StoreContents | None:
+    store_dir = _get_store_dir(store_name)
+
+    try:
+        with open(store_dir / INDEX_FILENAME, encoding="utf8") as f:
+            index = json.load(f)
+
+        matrix = np.load(store_dir / index["matrix"], mmap_mode="r")
+    except (FileNotFoundError, KeyError, json.JSONDecodeError, ValueError):
+        return None
+
+    hashes = tuple(index["hashes"])
+    if len(hashes) != len(matrix):
+        return None
+
+    return hashes, matrix
+
+
+def _save_store(store_name: str, hashes: tuple[str, ...], matrix: np.ndarray):
+    store_dir = _get_store_dir(store_name)
+    store_dir.mkdir(parents=True, exist_ok=True)
+
+    try:
+        with open(store_dir / INDEX_FILENAME, encoding="utf8") as f:
+            previous_matrix_filename = json.load(f)["matrix"]
+    except (FileNotFoundError, KeyError, json.JSONDecodeError):
+        previous_matrix_filename = None
+
+    # Each build gets its own matrix file, and the index is swapped in
+    # atomically afterwards. That way another process never sees an
+    # index that does not match its matrix.
+    matrix_filename = f"embeddings-{_get_matrix_key(hashes)}.npy"
+
+    temp_matrix_path = store_dir / f"{matrix_filename}.tmp"
+    with open(temp_matrix_path, "wb") as f:
+        np.save(f, matrix)
+    os.replace(temp_matrix_path, store_dir / matrix_filename)
+
+    temp_index_path = store_dir / f"{INDEX_FILENAME}.tmp"
+    with open(temp_index_path, "w", encoding="utf8") as f:
+        json.dump({"matrix": matrix_filename, "hashes": list(hashes)}, f)
+    os.replace(temp_index_path, store_dir / INDEX_FILENAME)
+
+    if previous_matrix_filename not in (None, matrix_filename):
+        (store_dir / previous_matrix_filename).unlink(missing_ok=True)
+
+
+def _save_index(store_name: str, index_path: pathlib.Path, index: IVFIndex):
+    index.save(index_path)
+
+    for path in _get_store_dir(store_name).glob("ivf-*.npz"):
+        if path != index_path:
+            path.unlink(missing_ok=True)
+
+
+def _get_matrix_key(hashes: tuple[str, ...]) -> str:
+    return get_hash_digest("".join(hashes))[:16]
@@ -14,19 +14,30 @@
 
 import asyncio
 import collections
+import logging
 
 import aiofiles
-import torch
+import numpy as np
 from asyncache import cached
 from cachetools import LRUCache
 from cachetools.keys import hashkey
 
+from assistance._embedding_store import get_stored_embeddings_and_index
+from assistance._faq.registry import get_faq_embeddings, get_faq_lexical_index
+from assistance._lexical import BM25Index
+from assistance._metrics import increment
 from assistance._openai import get_embedding
 from assistance._paths import AI_REGISTRY_DIR
+from assistance._similarity import top_k_embeddings
+
+REGISTRY_STORE_NAME = "ai-registry-docstrings"
+
+# Seconds to wait on the embeddings before falling back to BM25
+EMBEDDING_TIMEOUT = 3
 
 
 async def get_closest_functions(openai_api_key, docstring, k=3) -> list[str]:
-    docstring_embedding = await _get_cuda_embeddings(
+    docstring_embedding = await _get_embeddings(
         blocks=(docstring,), openai_api_key=openai_api_key
     )
 
@@ -35,12 +46,18 @@ async def get_closest_functions(openai_api_key, docstring, k=3) -> list[str]:
     if len(all_docstrings) <= k:
         return all_docstrings
 
-    registry_embeddings = await _get_cuda_embeddings(
-        tuple(all_docstrings), openai_api_key=openai_api_key
+    registry_embeddings, registry_index = await get_stored_embeddings_and_index(
+        openai_api_key=openai_api_key,
+        store_name=REGISTRY_STORE_NAME,
+        blocks=tuple(all_docstrings),
     )
 
     all_indices, _all_scores = top_k_embeddings(
-        docstring_embedding, registry_embeddings, k
+        docstring_embedding,
+        registry_embeddings,
+        k,
+        index=registry_index,
+        normalised=True,
     )
 
     top_docstrings: list[str] = []
@@ -69,17 +86,21 @@ async def _get_file_contents(path):
 
 
 async def get_top_questions_and_answers(openai_api_key, faq_data, queries, k=3):
-    all_most_relevant_results = await _get_top_questions_and_answers(
+    all_most_relevant_results = await get_top_faq_items(
         openai_api_key, faq_data, queries, k=k
     )
 
     collected_q_and_a_strings_with_score = collections.defaultdict(list)
 
     for most_relevant_results in all_most_relevant_results:
-        for item in most_relevant_results:
+        for rank, item in enumerate(most_relevant_results):
             q_and_a_string = f"Question: {item['question'].strip()}\nAnswer: {item['answer'].strip()}"
 
-            collected_q_and_a_strings_with_score[q_and_a_string].append(item["score"])
+            # Items found by BM25 alone have no similarity, so their
+            # importance comes from their rank instead.
+            score = item["score"] if "score" in item else 1 / (rank + 1)
+
+            collected_q_and_a_strings_with_score[q_and_a_string].append(score)
 
     strings_and_scores = []
     for q_and_a_string, scores in collected_q_and_a_strings_with_score.items():
@@ -95,65 +116,76 @@ async def get_top_questions_and_answers(openai_api_key, faq_data, queries, k=3):
     return responses_with_score
 
 
-async def _get_top_questions_and_answers(openai_api_key, faq_data, queries, k=3):
+async def get_top_faq_items(openai_api_key, faq_data, queries, k=3):
+    """The k closest FAQ items to each query, with their cosine similarity.
+
+    The FAQ items are searched by embedding, through the ANN index when
+    the FAQ is large enough to have one. If the embeddings are not ready
+    within `EMBEDDING_TIMEOUT`, the items are instead ranked by BM25 and
+    returned without a "score", while the embeddings carry on loading in
+    the background for next time.
+    """
     queries = tuple(queries)
-    queries_embedding = await _get_cuda_embeddings(
-        queries, openai_api_key=openai_api_key
-    )
+    k = min(k, len(faq_data["items"]))
 
-    all_questions: tuple[str, ...] = tuple(
-        [item["question"] for item in faq_data["items"]]
+    queries_embedding_task = asyncio.create_task(
+        _get_embeddings(queries, openai_api_key=openai_api_key)
     )
-    embeddings = await _get_cuda_embeddings(
-        all_questions, openai_api_key=openai_api_key
+    faq_embeddings_task = asyncio.create_task(
+        get_faq_embeddings(openai_api_key, faq_data)
     )
+    tasks = [queries_embedding_task, faq_embeddings_task]
+
+    _done, pending = await asyncio.wait(tasks, timeout=EMBEDDING_TIMEOUT)
+
+    if pending:
+        logging.warning("Embeddings are slow, ranking FAQ items by BM25 instead")
+        increment("faq.retrieval.lexical_only")
+
+        for task in tasks:
+            task.add_done_callback(_log_background_exception)
+
+        lexical_index = await get_faq_lexical_index(faq_data)
+
+        return [
+            [faq_data["items"][i] for i in indices]
+            for indices in _lexical_top_k(lexical_index, queries, k)
+        ]
+
+    embeddings, index = faq_embeddings_task.result()
+
     all_queries_indices, all_queries_scores = top_k_embeddings(
-        queries_embedding, embeddings, k
+        queries_embedding_task.result(), embeddings, k, index=index, normalised=True
     )
 
     all_most_relevant_results = []
 
     for indices, scores in zip(all_queries_indices, all_queries_scores):
-        most_relevant_results = [faq_data["items"][i] for i in indices]
-        for item, score in zip(most_relevant_results, scores):
-            item["score"] = score
+        most_relevant_results = [
+            {**faq_data["items"][i], "score": score}
+            for i, score in zip(indices, scores)
+        ]
 
         all_most_relevant_results.append(most_relevant_results)
 
     return all_most_relevant_results
 
 
-def top_k_embeddings(queries, embeddings, k):
-    k = torch.tensor(k, device="cuda")
-    cosine_similarity, index = _top_k_embeddings(queries, embeddings, k)
-
-    index = index.tolist()
-    cosine_similarity = cosine_similarity.tolist()
-
-    return index, cosine_similarity
-
-
-@torch.jit.script  # type: ignore
-def _top_k_embeddings(queries, embeddings, k):
-    transpose_queries = queries.T
-    embeddings_norm = torch.linalg.norm(embeddings, dim=1, keepdim=True)
-    query_norm = torch.linalg.norm(transpose_queries, dim=0, keepdim=True)
+def _lexical_top_k(lexical_index: BM25Index, queries, k) -> list[list[int]]:
+    return [lexical_index.search(query, k)[0] for query in queries]
 
-    cosine_similarity = (
-        (embeddings @ transpose_queries) / (embeddings_norm @ query_norm)
-    ).T
 
-    return torch.topk(cosine_similarity, k)
+def _log_background_exception(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.warning(f"Background embedding lookup failed: {task.exception()}")
 
 
 @cached(
     cache=LRUCache(maxsize=32),
     key=lambda blocks, openai_api_key: hashkey(blocks),
 )
-async def _get_cuda_embeddings(
-    blocks: tuple[str, ...], openai_api_key: str
-) -> torch.Tensor:
+async def _get_embeddings(blocks: tuple[str, ...], openai_api_key: str) -> np.ndarray:
     embeddings = await asyncio.gather(
         *[get_embedding(block=block, api_key=openai_api_key) for block in blocks]
     )
-    return torch.tensor(embeddings, device="cuda")
+    return np.array(embeddings, dtype=np.float32)
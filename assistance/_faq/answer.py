@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import asyncio
+import contextlib
 import json
 import random
 import textwrap
@@ -21,8 +22,10 @@ from assistance._config import SIMPLER_OPENAI_MODEL
 from assistance._embeddings import get_top_questions_and_answers
 from assistance._keys import get_openai_api_key, get_serp_api_key
 from assistance._logging import log_info
-from assistance._openai import get_completion_only
+from assistance._metrics import increment, observe
+from assistance._openai import get_completion_only, stream_completion_only
 
+from .answer_cache import get_cached_answer, store_validated_answer
 from .extract_questions import QuestionAndContext
 from .sub_questions import get_sub_questions
 
@@ -157,8 +160,23 @@ RANK = textwrap.dedent(
 ).strip()
 
 
+# The value each validation check within the rank response needs for
+# the selected answer to be used.
+VALIDATION_CHECKS = {
+    "does the selected answer completely answer the user's question?": True,
+    "does the selected answer get its information from the FAQ responses?": True,
+    "does the selected answer answer the question in a way that is consistent with the FAQ responses?": True,
+    "does the selected answer suggest following up the question with someone else?": False,
+}
+
 MAX_NUM_FAQ_RESPONSES = 15
 
+# Candidate answers are only added when the ranker rejects all of the
+# current ones.
+INITIAL_NUM_CANDIDATES = 2
+ADDITIONAL_NUM_CANDIDATES = 2
+MAX_NUM_CANDIDATES = 5
+
 
 async def write_answer(
     scope: str,
@@ -168,7 +186,21 @@ async def write_answer(
     question = question_and_context["question"]
     context = question_and_context["context"]
 
-    questions = await get_sub_questions(scope=scope, question=question, context=context)
+    cached_answer = await get_cached_answer(
+        scope=scope,
+        openai_api_key=OPEN_AI_API_KEY,
+        faq_data=faq_data,
+        question=question,
+    )
+    if cached_answer is not None:
+        return cached_answer
+
+    questions = await get_sub_questions(
+        scope=scope,
+        openai_api_key=OPEN_AI_API_KEY,
+        question=question,
+        context=context,
+    )
 
     # Don't need to batch the questions for this use case
     # questions_by_batch = await get_questions_by_batch(scope=scope, questions=questions)
@@ -179,80 +211,147 @@ async def write_answer(
 
     sorted_faq_responses = faq_responses.copy()[0:MAX_NUM_FAQ_RESPONSES]
 
-    coroutines = []
-    for _ in range(5):
-        random.shuffle(faq_responses)
-        coroutines.append(
-            get_completion_only(
+    candidates: list[str] = []
+
+    try:
+        while len(candidates) < MAX_NUM_CANDIDATES:
+            num_new_candidates = min(
+                INITIAL_NUM_CANDIDATES if not candidates else ADDITIONAL_NUM_CANDIDATES,
+                MAX_NUM_CANDIDATES - len(candidates),
+            )
+
+            new_candidates = await _write_candidates(
+                scope=scope,
+                question=question,
+                context=context,
+                faq_responses=faq_responses,
+                num_candidates=num_new_candidates,
+            )
+            if new_candidates is None:
+                return ""
+
+            candidates += new_candidates
+
+            best_answer = await _select_best_candidate(
                 scope=scope,
-                prompt=PROMPT.format(
+                question=question,
+                context=context,
+                faq_responses=sorted_faq_responses,
+                candidates=candidates,
+            )
+            if best_answer is not None:
+                await store_validated_answer(
+                    openai_api_key=OPEN_AI_API_KEY,
+                    faq_data=faq_data,
                     question=question,
-                    context=context,
-                    faq_responses="\n\n".join(faq_responses),
-                ),
-                api_key=OPEN_AI_API_KEY,
-                **MODEL_KWARGS,
+                    answer=best_answer,
+                )
+
+                return best_answer
+
+        return ""
+    finally:
+        observe("faq.answer.candidates_per_question", len(candidates))
+
+
+async def _write_candidates(
+    scope: str,
+    question: str,
+    context: str,
+    faq_responses: list[str],
+    num_candidates: int,
+) -> list[str] | None:
+    """Write candidate answers, each seeing the FAQ responses shuffled.
+
+    Each candidate is streamed. Returns None as soon as any candidate
+    comes back empty, as then no answer is to be given, and the streams
+    of the other candidates are closed there and then, ending their
+    generation.
+    """
+    tasks = []
+    for _ in range(num_candidates):
+        shuffled_faq_responses = random.sample(faq_responses, len(faq_responses))
+        tasks.append(
+            asyncio.create_task(
+                _stream_candidate(
+                    scope=scope,
+                    prompt=PROMPT.format(
+                        question=question,
+                        context=context,
+                        faq_responses="\n\n".join(shuffled_faq_responses),
+                    ),
+                )
             )
         )
 
-    # coroutines.append(
-    #     get_completion_only(
-    #         scope=scope,
-    #         prompt=PROMPT.format(
-    #             question=question,
-    #             context=context,
-    #             faq_responses="\n\n".join(sorted_faq_responses),
-    #         ),
-    #         api_key=OPEN_AI_API_KEY,
-    #         **MODEL_KWARGS_WITH_GPT_4,
-    #     )
-    # )
+    try:
+        for next_completed in asyncio.as_completed(tasks):
+            if await next_completed == "":
+                log_info(scope, "A candidate answer was empty")
+                increment("faq.answer.empty_candidate")
 
-    question_responses = await asyncio.gather(*coroutines)
+                return None
+    finally:
+        for task in tasks:
+            task.cancel()
 
-    log_info(scope, json.dumps(question_responses, indent=2))
+    candidates = [task.result() for task in tasks]
+    log_info(scope, json.dumps(candidates, indent=2))
+
+    return candidates
 
-    if "" in question_responses:
-        return ""
 
-    question_responses_with_id = []
-    for i, response in enumerate(question_responses):
-        question_responses_with_id.append({"id": i, "answer": response})
+async def _stream_candidate(scope: str, prompt: str) -> str:
+    content_parts = []
 
+    # Cancelling the task closes the stream, which ends the request
+    async with contextlib.aclosing(
+        stream_completion_only(
+            scope=scope, prompt=prompt, api_key=OPEN_AI_API_KEY, **MODEL_KWARGS
+        )
+    ) as deltas:
+        async for delta in deltas:
+            content_parts.append(delta)
+
+    return "".join(content_parts).strip()
+
+
+async def _select_best_candidate(
+    scope: str,
+    question: str,
+    context: str,
+    faq_responses: list[str],
+    candidates: list[str],
+) -> str | None:
+    """Rank the candidates, returning None if they all fail validation."""
+    candidates_with_id = []
+    for i, candidate in enumerate(candidates):
+        candidates_with_id.append({"id": i, "answer": candidate})
+
+    # Not streamed, so that the rank is cached and shared between
+    # identical concurrent requests like every other completion.
     response = await get_completion_only(
         scope=scope,
         prompt=RANK.format(
             question=question,
             context=context,
-            faq_responses="\n\n".join(sorted_faq_responses),
-            answers=json.dumps(question_responses_with_id, indent=2),
+            faq_responses="\n\n".join(faq_responses),
+            answers=json.dumps(candidates_with_id, indent=2),
         ),
         api_key=OPEN_AI_API_KEY,
-        # **MODEL_KWARGS_WITH_GPT_4,
         **MODEL_KWARGS,
     )
 
     response_data = json.loads(response)
-    best_answer_id = response_data["id of the best answer"]
+    log_info(scope, f"Response: {json.dumps(response_data, indent=2)}")
 
-    all_test_results = [
-        response_data[
-            "does the selected answer completely answer the user's question?"
-        ],
-        response_data[
-            "does the selected answer get its information from the FAQ responses?"
-        ],
-        response_data[
-            "does the selected answer answer the question in a way that is consistent with the FAQ responses?"
-        ],
-        not response_data[
-            "does the selected answer suggest following up the question with someone else?"
-        ],
-    ]
-
-    if not all(all_test_results):
-        return ""
+    for key, expected in VALIDATION_CHECKS.items():
+        if response_data[key] != expected:
+            log_info(scope, f"Answer failed the validation check: {key}")
+            increment("faq.answer.failed_validation")
+
+            return None
 
     best_answer_id = response_data["id of the best answer"]
 
-    return question_responses[int(best_answer_id)]
+    return candidates[int(best_answer_id)]
@@ -0,0 +1,167 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Answers that passed the automatic checks, either the ranker's
+# validation or the batch prompt reporting the answer as complete, are
+# kept per FAQ dataset. A later question that is close enough in meaning,
+# from any email, reuses the answer instead of going through the whole
+# answering pipeline. Only the question is kept, not the context it was
+# asked within, and only the question is matched on. Every entry records the hash of the `faqs.toml` that it was answered
+# from, so that editing the FAQ invalidates the cache.
+
+import asyncio
+import collections
+import json
+import os
+
+import aiofiles
+import numpy as np
+
+from assistance import _paths
+from assistance._config import FAQData
+from assistance._embedding_store import get_stored_embeddings
+from assistance._logging import log_info
+from assistance._metrics import increment
+from assistance._openai import get_embedding
+from assistance._similarity import normalise_rows, top_k_embeddings
+
+# Cosine similarity above which two questions are taken to be the same
+ANSWER_SIMILARITY_THRESHOLD = 0.96
+
+# The embedding store is rebuilt once per this many new entries rather
+# than on every insert. Entries beyond the last rebuild are embedded on
+# lookup, which the completion cache makes cheap.
+STORE_BATCH_SIZE = 64
+
+_entries_locks: collections.defaultdict[str, asyncio.Lock] = collections.defaultdict(
+    asyncio.Lock
+)
+
+
+async def get_cached_answer(
+    scope: str, openai_api_key: str, faq_data: FAQData, question: str
+) -> str | None:
+    entries = await _load_entries(faq_data)
+
+    if not entries:
+        increment("faq.answer_cache.miss")
+        log_info(scope, "Answer cache miss, the cache is empty")
+
+        return None
+
+    query = await get_embedding(block=question, api_key=openai_api_key)
+    cached_questions = await _get_question_embeddings(openai_api_key, faq_data, entries)
+
+    indices, scores = top_k_embeddings(
+        np.asarray(query)[np.newaxis], cached_questions, 1, normalised=True
+    )
+    index, score = indices[0][0], scores[0][0]
+
+    if score < ANSWER_SIMILARITY_THRESHOLD:
+        increment("faq.answer_cache.miss")
+        log_info(
+            scope,
+            f"Answer cache miss for: {question}\n"
+            f"Closest was ({score:.3f}): {entries[index]['question']}",
+        )
+
+        return None
+
+    increment("faq.answer_cache.hit")
+    log_info(
+        scope,
+        f"Answer cache hit ({score:.3f}) for: {question}\n"
+        f"Answered as: {entries[index]['question']}",
+    )
+
+    return entries[index]["answer"]
+
+
+async def store_validated_answer(
+    openai_api_key: str, faq_data: FAQData, question: str, answer: str
+):
+    async with _entries_locks[faq_data["name"]]:
+        entries = await _load_entries(faq_data)
+
+        if any(entry["question"] == question for entry in entries):
+            return
+
+        entries.append({"question": question, "answer": answer})
+        await _save_entries(faq_data, entries)
+
+    # Embedded now, so that the next lookup does not have to
+    await get_embedding(block=question, api_key=openai_api_key)
+
+
+async def _get_question_embeddings(
+    openai_api_key: str, faq_data: FAQData, entries: list[dict[str, str]]
+) -> np.ndarray:
+    stored_count = len(entries) - len(entries) % STORE_BATCH_SIZE
+    questions = [entry["question"] for entry in entries]
+
+    unstored = await asyncio.gather(
+        *[
+            get_embedding(block=question, api_key=openai_api_key)
+            for question in questions[stored_count:]
+        ]
+    )
+    if not stored_count:
+        return normalise_rows(np.array(unstored, dtype=np.float32))
+
+    stored = await get_stored_embeddings(
+        openai_api_key=openai_api_key,
+        store_name=_get_store_name(faq_data),
+        blocks=tuple(questions[:stored_count]),
+    )
+    if not unstored:
+        return stored
+
+    return np.vstack(
+        [
+            np.asarray(stored, dtype=np.float32),
+            normalise_rows(np.array(unstored, dtype=np.float32)),
+        ]
+    )
+
+
+def _get_store_name(faq_data: FAQData):
+    return f"answer-cache-{faq_data['name']}"
+
+
+def _get_entries_path(faq_data: FAQData):
+    return _paths.ANSWER_CACHE / f"{faq_data['name']}.json"
+
+
+async def _load_entries(faq_data: FAQData) -> list[dict[str, str]]:
+    try:
+        async with aiofiles.open(_get_entries_path(faq_data), "r") as f:
+            contents = json.loads(await f.read())
+    except FileNotFoundError:
+        return []
+
+    if contents["faq_hash"] != faq_data["hash"]:
+        return []
+
+    return contents["entries"]
+
+
+async def _save_entries(faq_data: FAQData, entries: list[dict[str, str]]):
+    path = _get_entries_path(faq_data)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    temp_path = path.with_suffix(".json.tmp")
+    async with aiofiles.open(temp_path, "w") as f:
+        await f.write(json.dumps({"faq_hash": faq_data["hash"], "entries": entries}))
+
+    os.replace(temp_path, path)
@@ -0,0 +1,307 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Answers every question within an email together. FAQ items are
+# retrieved for all of the questions with the one similarity query, each
+# FAQ item is only included once within a prompt, and several questions
+# are answered per completion. Any question that a batch does not
+# confidently answer goes through `write_answer` instead.
+
+import asyncio
+import json
+import textwrap
+
+from assistance._config import SIMPLER_OPENAI_MODEL, FAQData
+from assistance._embeddings import get_top_faq_items
+from assistance._keys import get_openai_api_key
+from assistance._logging import log_info
+from assistance._metrics import increment
+from assistance._openai import get_completion_only
+from assistance._tokens import get_remaining_tokens
+
+from .answer import write_answer
+from .answer_cache import get_cached_answer, store_validated_answer
+from .extract_questions import QuestionAndContext
+
+OPEN_AI_API_KEY = get_openai_api_key()
+
+MODEL_KWARGS = {
+    "engine": SIMPLER_OPENAI_MODEL,
+    "max_tokens": 1536,
+    "temperature": 0.7,
+}
+
+QUESTIONS_PER_PROMPT = 4
+FAQ_ITEMS_PER_QUESTION = 5
+
+ANSWERED_KEY = "is the question completely answered by the FAQ responses?"
+
+PROMPT = textwrap.dedent(
+    """
+        # Answering a prospective student's questions
+
+        You have been forwarded an email from Alex Carpenter. A
+        prospective student is asking him questions about Jim's
+        International Pathway Program. You are happy to help answer any
+        questions that the prospective student may have about the Jim's
+        International Pathway Program.
+
+        Within their email the prospective student has asked the
+        questions below. You are to draft Alex's answer to each of the
+        questions. Below are a range of previous FAQ responses that Alex
+        has provided to other students. Use these FAQ responses as a
+        guide to help you draft your own responses.
+
+        Do not use any of your outside knowledge to help you draft your
+        responses. Only use the information provided to you within the
+        previous FAQ responses. If the FAQ responses do not completely
+        answer a question then set "{answered_key}" to false for that
+        question.
+
+        Make sure to focus on the FAQ responses that are listed as
+        relevant to each question.
+
+        ## Your traits
+
+        - Show genuine empathy and interest in their situation
+        - You are trying to find ways to help them be successful in
+          their application
+        - You are helpful and friendly
+
+        ## Previous responses to OTHER prospective students
+
+        These questions are not necessarily the same as the questions
+        asked by this prospective student.
+
+        {faq_responses}
+
+        ## Questions asked by THIS applicant
+
+        {questions}
+
+        ## Required JSON format
+
+        [
+            {{
+                "id": <question id>,
+                "think step by step": "<step by step reasoning>",
+                "answer": "<your answer>",
+                "{answered_key}": <true or false>
+            }},
+            ...
+        ]
+
+        ## Your JSON response (ONLY respond with JSON, nothing else)
+    """
+).strip()
+
+
+async def write_answers(
+    scope: str,
+    faq_data: FAQData,
+    questions_and_contexts: list[QuestionAndContext],
+) -> list[str]:
+    if len(questions_and_contexts) == 0:
+        return []
+
+    cached_answers = await asyncio.gather(
+        *[
+            get_cached_answer(
+                scope=scope,
+                openai_api_key=OPEN_AI_API_KEY,
+                faq_data=faq_data,
+                question=item["question"],
+            )
+            for item in questions_and_contexts
+        ]
+    )
+    uncached_indices = [i for i, answer in enumerate(cached_answers) if answer is None]
+
+    answers: list[str | None] = list(cached_answers)
+
+    if uncached_indices:
+        uncached_answers = await _write_uncached_answers(
+            scope=scope,
+            faq_data=faq_data,
+            questions_and_contexts=[
+                questions_and_contexts[i] for i in uncached_indices
+            ],
+        )
+
+        for i, answer in zip(uncached_indices, uncached_answers):
+            answers[i] = answer
+
+    fallback_indices = [i for i, answer in enumerate(answers) if answer is None]
+
+    increment("faq.batch_answer.answered", len(answers) - len(fallback_indices))
+    increment("faq.batch_answer.fallback", len(fallback_indices))
+    log_info(
+        scope,
+        f"Batch answered {len(answers) - len(fallback_indices)} of "
+        f"{len(answers)} questions, falling back for the rest",
+    )
+
+    fallback_answers = await asyncio.gather(
+        *[
+            write_answer(
+                scope=scope,
+                faq_data=faq_data,
+                question_and_context=questions_and_contexts[i],
+            )
+            for i in fallback_indices
+        ]
+    )
+
+    for i, answer in zip(fallback_indices, fallback_answers):
+        answers[i] = answer
+
+    return [answer or "" for answer in answers]
+
+
+async def _write_uncached_answers(
+    scope: str,
+    faq_data: FAQData,
+    questions_and_contexts: list[QuestionAndContext],
+) -> list[str | None]:
+    all_faq_items = await get_top_faq_items(
+        openai_api_key=OPEN_AI_API_KEY,
+        faq_data=faq_data,
+        queries=[item["question"] for item in questions_and_contexts],
+        k=FAQ_ITEMS_PER_QUESTION,
+    )
+
+    batches = [
+        list(range(i, min(i + QUESTIONS_PER_PROMPT, len(questions_and_contexts))))
+        for i in range(0, len(questions_and_contexts), QUESTIONS_PER_PROMPT)
+    ]
+
+    batch_answers = await asyncio.gather(
+        *[
+            _write_batch_of_answers(
+                scope=scope,
+                questions_and_contexts=[questions_and_contexts[i] for i in batch],
+                faq_items=[all_faq_items[i] for i in batch],
+            )
+            for batch in batches
+        ]
+    )
+
+    answers: list[str | None] = []
+    for batch_answer in batch_answers:
+        answers += batch_answer
+
+    await asyncio.gather(
+        *[
+            store_validated_answer(
+                openai_api_key=OPEN_AI_API_KEY,
+                faq_data=faq_data,
+                question=question_and_context["question"],
+                answer=answer,
+            )
+            for question_and_context, answer in zip(questions_and_contexts, answers)
+            if answer is not None
+        ]
+    )
+
+    return answers
+
+
+async def _write_batch_of_answers(
+    scope: str,
+    questions_and_contexts: list[QuestionAndContext],
+    faq_items: list[list[dict]],
+) -> list[str | None]:
+    """Answer the questions within one prompt.
+
+    A question gets None when it could not be confidently answered.
+    """
+    faq_responses, questions = _get_prompt_sections(questions_and_contexts, faq_items)
+    prompt = PROMPT.format(
+        answered_key=ANSWERED_KEY, faq_responses=faq_responses, questions=questions
+    )
+
+    no_answers: list[str | None] = [None] * len(questions_and_contexts)
+
+    remaining_tokens = get_remaining_tokens(
+        prompt=prompt,
+        max_tokens=MODEL_KWARGS["max_tokens"],
+        model=MODEL_KWARGS["engine"],
+    )
+    if remaining_tokens < 0:
+        return no_answers
+
+    response = await get_completion_only(
+        scope=scope,
+        prompt=prompt,
+        api_key=OPEN_AI_API_KEY,
+        **MODEL_KWARGS,
+    )
+
+    log_info(scope, f"Batch answers: {response}")
+
+    try:
+        response_items = json.loads(response)
+        answers = no_answers.copy()
+
+        for item in response_items:
+            question_id = int(item["id"])
+            if not 0 <= question_id < len(answers):
+                raise ValueError(f"Unknown question id {question_id}")
+
+            answer = item["answer"]
+            if (
+                item[ANSWERED_KEY] is True
+                and isinstance(answer, str)
+                and answer.strip()
+            ):
+                answers[question_id] = answer.strip()
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+        log_info(scope, "Batch answers were not in the required format")
+        return no_answers
+
+    return answers
+
+
+def _get_prompt_sections(
+    questions_and_contexts: list[QuestionAndContext], faq_items: list[list[dict]]
+) -> tuple[str, str]:
+    """Number each FAQ item once, and point each question at its items."""
+    faq_ids: dict[tuple[str, str], int] = {}
+    faq_strings = []
+    question_strings = []
+
+    for question_id, (question_and_context, items) in enumerate(
+        zip(questions_and_contexts, faq_items)
+    ):
+        relevant_ids = []
+
+        for item in items:
+            key = (item["question"].strip(), item["answer"].strip())
+
+            if key not in faq_ids:
+                faq_ids[key] = len(faq_ids)
+                faq_strings.append(
+                    f"FAQ {faq_ids[key]}\nQuestion: {key[0]}\nAnswer: {key[1]}"
+                )
+
+            relevant_ids.append(faq_ids[key])
+
+        question_strings.append(
+            f"Question id: {question_id}\n"
+            f"Question: {question_and_context['question']}\n"
+            f"Context: {question_and_context['context']}\n"
+            f"Relevant FAQ responses: {', '.join(str(i) for i in relevant_ids)}"
+        )
+
+    return "\n\n".join(faq_strings), "\n\n".join(question_strings)
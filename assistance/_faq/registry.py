@@ -0,0 +1,147 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The FAQ datasets of every client, each parsed once per process and
+# shared by all of the requests that use it. A dataset is reloaded when
+# its file changes on disk, and the new version is swapped in only once
+# it has been fully parsed. Requests that are part way through keep
+# using the version they started with, which is never mutated.
+
+import asyncio
+import collections
+import logging
+import tomllib
+
+import numpy as np
+
+from assistance._ann import IVFIndex
+from assistance._config import FAQData, get_faq_data_path, load_faq_data
+from assistance._embedding_store import get_stored_embeddings_and_index
+from assistance._lexical import BM25Index
+
+FileVersion = tuple[int, int]
+
+
+class FAQDataset:
+    def __init__(self, data: FAQData, file_version: FileVersion):
+        self.data = data
+        self.file_version = file_version
+
+        self.embeddings: np.ndarray | None = None
+        self.index: IVFIndex | None = None
+        self.lexical_index: BM25Index | None = None
+
+
+_datasets: dict[str, FAQDataset] = {}
+_locks: collections.defaultdict[str, asyncio.Lock] = collections.defaultdict(
+    asyncio.Lock
+)
+
+
+async def get_faq_data(name: str) -> FAQData:
+    dataset = await _get_dataset(name)
+
+    return dataset.data
+
+
+async def get_faq_embeddings(
+    openai_api_key: str, faq_data: FAQData
+) -> tuple[np.ndarray, IVFIndex | None]:
+    """The embeddings of the FAQ questions, and their index if large enough.
+
+    These are held by the dataset within the registry, so that they are
+    only looked up once for each version of the FAQ.
+    """
+    dataset = _datasets.get(faq_data["name"])
+    if dataset is None or dataset.data["hash"] != faq_data["hash"]:
+        # Not the registry's current version, so nothing to hold them on
+        return await _load_embeddings(openai_api_key, faq_data)
+
+    if dataset.embeddings is None:
+        embeddings, index = await _load_embeddings(openai_api_key, faq_data)
+        dataset.embeddings, dataset.index = embeddings, index
+
+        return embeddings, index
+
+    return dataset.embeddings, dataset.index
+
+
+async def get_faq_lexical_index(faq_data: FAQData) -> BM25Index:
+    dataset = _datasets.get(faq_data["name"])
+    if dataset is None or dataset.data["hash"] != faq_data["hash"]:
+        return await asyncio.to_thread(_build_lexical_index, faq_data)
+
+    if dataset.lexical_index is None:
+        dataset.lexical_index = await asyncio.to_thread(_build_lexical_index, faq_data)
+
+    return dataset.lexical_index
+
+
+async def _get_dataset(name: str) -> FAQDataset:
+    file_version = _get_file_version(name)
+
+    dataset = _datasets.get(name)
+    if dataset is not None and dataset.file_version == file_version:
+        return dataset
+
+    async with _locks[name]:
+        dataset = _datasets.get(name)
+        if dataset is not None and dataset.file_version == file_version:
+            return dataset
+
+        try:
+            data = await load_faq_data(name)
+        except tomllib.TOMLDecodeError as e:
+            if dataset is None:
+                raise
+
+            # Most likely caught part way through being rewritten
+            logging.warning(f"Keeping the previous FAQ `{name}`, unable to parse: {e}")
+            return dataset
+
+        if dataset is not None and dataset.data["hash"] == data["hash"]:
+            # Only the file's timestamp changed
+            dataset.file_version = file_version
+            return dataset
+
+        logging.info(f"Loaded FAQ `{name}` with {len(data['items'])} items")
+
+        dataset = FAQDataset(data=data, file_version=file_version)
+        _datasets[name] = dataset
+
+    return dataset
+
+
+def _get_file_version(name: str) -> FileVersion:
+    stat = get_faq_data_path(name).stat()
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+async def _load_embeddings(openai_api_key: str, faq_data: FAQData):
+    store_name = f"faq-{faq_data['name']}"
+
+    embeddings, index = await get_stored_embeddings_and_index(
+        openai_api_key=openai_api_key,
+        store_name=store_name,
+        blocks=tuple(item["question"] for item in faq_data["items"]),
+    )
+
+    return embeddings, index
+
+
+def _build_lexical_index(faq_data: FAQData) -> BM25Index:
+    return BM25Index(
+        [f"{item['question']}\n{item['answer']}" for item in faq_data["items"]]
+    )
@@ -15,12 +15,7 @@
 import asyncio
 import textwrap
 
-from assistance._config import (
-    ROOT_DOMAIN,
-    SOTA_OPENAI_MODEL,
-    SUPERVISION_SUBJECT_FLAG,
-    load_faq_data,
-)
+from assistance._config import ROOT_DOMAIN, SOTA_OPENAI_MODEL, SUPERVISION_SUBJECT_FLAG
 from assistance._email.reply import create_reply
 from assistance._email.thread import get_email_thread
 from assistance._keys import get_openai_api_key, get_serp_api_key
@@ -31,12 +26,18 @@ from assistance._types import Email
 from assistance._utilities import get_cleaned_email
 
 from .answer import write_answer
+from .batch_answer import write_answers
 from .correspondent import get_first_name
 from .extract_questions import extract_questions
+from .registry import get_faq_data
 
 OPEN_AI_API_KEY = get_openai_api_key()
 SERP_API_KEY = get_serp_api_key()
 
+# Answer all of an email's questions together, only falling back to
+# answering each question on its own when the batch cannot.
+ANSWER_IN_BATCHES = True
+
 MODEL_KWARGS = {
     "engine": SOTA_OPENAI_MODEL,
     "max_tokens": 1500,
@@ -195,19 +196,24 @@ async def _handle_questions(
     if len(questions) == 0:
         return "No questions were found that require answering"
 
-    faq_data = await load_faq_data(faq_name)
+    faq_data = await get_faq_data(faq_name)
 
-    coroutines = []
-    for question_and_context in questions:
-        coroutines.append(
-            write_answer(
-                scope=scope,
-                faq_data=faq_data,
-                question_and_context=question_and_context,
-            )
+    if ANSWER_IN_BATCHES:
+        answers = await write_answers(
+            scope=scope, faq_data=faq_data, questions_and_contexts=questions
         )
+    else:
+        coroutines = []
+        for question_and_context in questions:
+            coroutines.append(
+                write_answer(
+                    scope=scope,
+                    faq_data=faq_data,
+                    question_and_context=question_and_context,
+                )
+            )
 
-    answers = await asyncio.gather(*coroutines)
+        answers = await asyncio.gather(*coroutines)
 
     question_and_answers_string = ""
     for question_and_context, answer in zip(questions, answers):
@@ -15,29 +15,49 @@
 import asyncio
 import json
 import textwrap
+import time
+
+import numpy as np
 
 from assistance._config import SIMPLER_OPENAI_MODEL
-from assistance._keys import get_openai_api_key
 from assistance._logging import log_info
-from assistance._openai import get_completion_only
-
-OPEN_AI_API_KEY = get_openai_api_key()
+from assistance._metrics import increment
+from assistance._openai import get_completion_only, get_embedding
+from assistance._similarity import normalise_rows
+from assistance._tokens import count_tokens
 
 MODEL_KWARGS = {
     "engine": SIMPLER_OPENAI_MODEL,
-    "max_tokens": 1024,
+    "max_tokens": 1536,
     "temperature": 0.7,
     "top_p": 1,
     "frequency_penalty": 0,
     "presence_penalty": 0,
 }
 
+# The budget for the whole tree of one question
+MAX_DEPTH = 3
+MAX_NODES = 30
+MAX_TOKENS = 16_000
+MAX_SECONDS = 60
+
+MAX_SUB_QUESTIONS_PER_QUESTION = 4
+
+# Questions expanded by a single prompt, so that a reply with every one
+# of their sub-questions fits within the `max_tokens` of MODEL_KWARGS.
+# Larger levels are split across several prompts.
+MAX_QUESTIONS_PER_PROMPT = 4
+
+# Sub-questions this cosine similar to one already within the tree are
+# treated as duplicates and are not expanded.
+DUPLICATE_SIMILARITY = 0.95
+
 
 PROMPT = textwrap.dedent(
     """
         # Overview
 
-        You have been provided with a question from a prospective
+        You have been provided with questions from a prospective
         student who is enquiring about Jim's International Pathway
         Program within an email.
 
@@ -45,7 +65,7 @@ PROMPT = textwrap.dedent(
         questions that other prospective students have asked. You are
         aiming to search through these questions to find the most
         relevant questions that can be used to answer the provided
-        question.
+        questions.
 
         However, to have the best chance at extracting the relevant
         information it is helpful to split a question into a series of
@@ -54,25 +74,26 @@ PROMPT = textwrap.dedent(
         These questions are required to be written from the perspective
         of the prospective student who has sent you this email.
 
-        It is your job to take the provided question and create a series
-        of sub-questions that can be to the tool to then aid you in the
-        answering of the question.
+        It is your job to take each of the provided questions and create
+        a series of sub-questions that can be to the tool to then aid
+        you in the answering of the original question.
 
         Include each of the following types of questions within your
         sub-questions:
 
-        - Creative rewording questions of the original question
+        - Creative rewording questions of the question
         - Precursor questions that help provide further information and
           context
         - Sub-set questions that try to take different parts of the
-          original question and answer them separately
+          question and answer them separately
 
         Use the "think-step-by-step" key to describe the thought process
         that you went through to determine each of the required
         sub-questions.
 
-        If there are no sub-questions required to answer the question,
-        then respond with an empty list.
+        Provide at most {max_sub_questions} sub-questions for each
+        question. If there are no sub-questions required to answer a
+        question, then respond with an empty list for that question.
 
         Make sure that any sub-questions that you provide are relevant
         to the original question.
@@ -81,29 +102,25 @@ PROMPT = textwrap.dedent(
 
         ## Required JSON format
 
-        [
-            {{
-                "think step by step": "<step by step reasoning>",
-                "question": "<first sub-question>"
-            }},
-            {{
-                "think step by step": "<step by step reasoning>",
-                "question": "<second sub-question>"
-            }},
+        {{
+            "<id of the first question>": [
+                {{
+                    "think step by step": "<step by step reasoning>",
+                    "question": "<first sub-question>"
+                }},
+                ...
+            ],
             ...
-            {{
-                "think step by step": "<step by step reasoning>",
-                "question": "<nth sub-question>"
-            }}
-        ]
+            "<id of the last question>": [...]
+        }}
 
         ## The original question
 
         {original_question}
 
-        ## The current question
+        ## The current questions, by id
 
-        {question}
+        {questions}
 
         ## Context around the question
 
@@ -116,64 +133,147 @@ PROMPT = textwrap.dedent(
 
 async def get_sub_questions(
     scope: str,
+    openai_api_key: str,
     question: str,
     context: str,
-    collected_questions: set | None = None,
-    original_question: str | None = None,
-    max_depth=3,
-    current_depth=0,
+    max_depth=MAX_DEPTH,
+    max_nodes=MAX_NODES,
+    max_tokens=MAX_TOKENS,
+    max_seconds=MAX_SECONDS,
 ) -> list[str]:
-    if current_depth >= max_depth:
-        return []
+    """Expand the question into a tree of sub-questions, breadth first.
 
-    if collected_questions is None:
-        collected_questions = set()
-
-    if original_question is None:
-        original_question = question
+    The questions within a level are expanded a few to a prompt, and the
+    expansion stops once the depth, node, token, or time budget runs out,
+    or once none of the replies can be parsed. Returns the sub-questions
+    followed by the question itself.
+    """
+    start = time.monotonic()
+    tokens_used = 0
 
     question_tree = [question]
+    tree_embeddings = await _get_embeddings([question], openai_api_key)
 
-    response = await get_completion_only(
-        scope=scope,
-        prompt=PROMPT.format(
-            question=question, original_question=original_question, context=context
-        ),
-        api_key=OPEN_AI_API_KEY,
-        **MODEL_KWARGS,
-    )
+    level = [question]
+    depth = 0
+
+    while level and depth < max_depth:
+        remaining_seconds = max_seconds - (time.monotonic() - start)
+        remaining_nodes = max_nodes - len(question_tree)
+
+        if remaining_seconds <= 0 or remaining_nodes <= 0 or tokens_used >= max_tokens:
+            log_info(scope, "Sub-question budget exhausted")
+            increment("sub_questions.budget_exhausted")
+            break
+
+        batches = [
+            level[i : i + MAX_QUESTIONS_PER_PROMPT]
+            for i in range(0, len(level), MAX_QUESTIONS_PER_PROMPT)
+        ]
+        prompts = [
+            PROMPT.format(
+                max_sub_questions=MAX_SUB_QUESTIONS_PER_QUESTION,
+                original_question=question,
+                questions=json.dumps(dict(enumerate(batch, start=1)), indent=2),
+                context=context,
+            )
+            for batch in batches
+        ]
 
-    log_info(scope, response)
-
-    sub_questions_response = json.loads(response)
-    sub_questions = [item["question"] for item in sub_questions_response]
-
-    # relevant_sub_questions = await get_relevant_sub_questions(
-    #     scope, original_question, sub_questions
-    # )
-
-    coroutines = []
-    for sub_question in sub_questions:
-        if sub_question not in collected_questions and sub_question:
-            collected_questions.add(sub_question)
-
-            coroutines.append(
-                get_sub_questions(
-                    scope,
-                    question=sub_question,
-                    context=context,
-                    collected_questions=collected_questions,
-                    original_question=original_question,
-                    max_depth=max_depth,
-                    current_depth=current_depth + 1,
-                )
+        try:
+            responses = await asyncio.wait_for(
+                asyncio.gather(
+                    *[
+                        get_completion_only(
+                            scope=scope,
+                            prompt=prompt,
+                            api_key=openai_api_key,
+                            **MODEL_KWARGS,
+                        )
+                        for prompt in prompts
+                    ]
+                ),
+                timeout=remaining_seconds,
             )
+        except asyncio.TimeoutError:
+            log_info(scope, "Sub-question expansion ran out of time")
+            increment("sub_questions.budget_exhausted")
+            break
+
+        tokens_used += sum(
+            count_tokens(prompt) + count_tokens(response)
+            for prompt, response in zip(prompts, responses)
+        )
+        depth += 1
+
+        candidates = []
+        for response in responses:
+            try:
+                sub_questions = _parse_sub_questions(response)
+            except (json.JSONDecodeError, AttributeError, KeyError, TypeError):
+                # Such as a response cut off by the token limit, the
+                # questions of this prompt are left unexpanded.
+                log_info(scope, f"Unable to parse sub-questions: {response}")
+                increment("sub_questions.unparseable")
+                continue
+
+            candidates += [item for item in sub_questions if item not in candidates]
+
+        if not candidates:
+            break
+
+        candidate_embeddings = await _get_embeddings(candidates, openai_api_key)
+
+        level = []
+        for candidate, embedding in zip(candidates, candidate_embeddings):
+            if len(question_tree) >= max_nodes:
+                break
+
+            if _is_duplicate(embedding, tree_embeddings):
+                increment("sub_questions.duplicates")
+                continue
+
+            level.append(candidate)
+            question_tree.append(candidate)
+            tree_embeddings = np.vstack([tree_embeddings, embedding])
+
+    log_info(
+        scope,
+        f"Sub-question tree: {len(question_tree)} questions, {depth} levels, "
+        f"~{tokens_used} tokens, {time.monotonic() - start:.1f} s\n"
+        + json.dumps(question_tree, indent=2),
+    )
+    increment("sub_questions.trees")
+    increment("sub_questions.nodes", len(question_tree))
+    increment("sub_questions.levels", depth)
+
+    return [*question_tree[1:], question]
+
+
+def _parse_sub_questions(response: str) -> list[str]:
+    sub_questions_by_id = json.loads(response)
 
-    sub_question_trees = await asyncio.gather(*coroutines)
+    sub_questions = []
+    for items in sub_questions_by_id.values():
+        for item in items[:MAX_SUB_QUESTIONS_PER_QUESTION]:
+            sub_question = item["question"].strip()
+
+            if sub_question and sub_question not in sub_questions:
+                sub_questions.append(sub_question)
+
+    return sub_questions
+
+
+async def _get_embeddings(questions: list[str], openai_api_key: str) -> np.ndarray:
+    embeddings = await asyncio.gather(
+        *[
+            get_embedding(block=question, api_key=openai_api_key)
+            for question in questions
+        ]
+    )
 
-    for sub_question_tree in sub_question_trees:
-        question_tree = [*sub_question_tree, *question_tree]
+    return normalise_rows(np.array(embeddings, dtype=np.float32))
 
-    log_info(scope, json.dumps(question_tree, indent=2))
 
-    return question_tree
+def _is_duplicate(embedding: np.ndarray, tree_embeddings: np.ndarray) -> bool:
+    return bool(np.max(tree_embeddings @ embedding) >= DUPLICATE_SIMILARITY)
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import logging
+import os
 
 import aiocron
 import tomlkit
@@ -89,9 +90,13 @@ async def _update_faq():
         ]
     }
 
-    with open(faq_path, "w") as f:
+    # Replaced atomically, the FAQ registry may be reading it at any time
+    temp_faq_path = faq_path.with_name(f"{faq_path.name}.tmp")
+    with open(temp_faq_path, "w") as f:
         tomlkit.dump(data_for_saving, f)
 
+    os.replace(temp_faq_path, faq_path)
+
 
 def _append_qna_to_collected_questions(collected_questions, current_qna):
     for item in current_qna:
@@ -0,0 +1,94 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# BM25 ranking over an inverted index. FAQ items are ranked with it
+# locally when the embedding API is too slow to answer within
+# `_embeddings.EMBEDDING_TIMEOUT`.
+
+import collections
+import re
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOP_WORDS = frozenset(
+    """
+    a an and are as at be by can do does for from how i if in is it me my
+    of on or so that the this to what when where which who why will with
+    you your
+    """.split()
+)
+
+K1 = 1.5
+B = 0.75
+
+
+def tokenise(text: str) -> list[str]:
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOP_WORDS
+    ]
+
+
+class BM25Index:
+    def __init__(self, documents: list[str]):
+        self.num_documents = len(documents)
+
+        tokenised = [tokenise(document) for document in documents]
+        lengths = np.array([len(tokens) for tokens in tokenised], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) and lengths.any() else 1
+
+        postings: collections.defaultdict[
+            str, dict[int, int]
+        ] = collections.defaultdict(dict)
+        for document_id, tokens in enumerate(tokenised):
+            for token, count in collections.Counter(tokens).items():
+                postings[token][document_id] = count
+
+        # The whole BM25 term weight of each posting is worked out up
+        # front, so that a search only has to add them up.
+        self.postings: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        for token, counts in postings.items():
+            document_ids = np.fromiter(counts.keys(), dtype=np.int64)
+            frequencies = np.fromiter(counts.values(), dtype=np.float32)
+
+            idf = np.log(
+                1 + (self.num_documents - len(counts) + 0.5) / (len(counts) + 0.5)
+            )
+            length_norm = 1 - B + B * lengths[document_ids] / average_length
+            weights = idf * frequencies * (K1 + 1) / (frequencies + K1 * length_norm)
+
+            self.postings[token] = (document_ids, weights.astype(np.float32))
+
+    def search(self, query: str, n: int) -> tuple[list[int], list[float]]:
+        """The top n documents for the query, leaving out any with no terms."""
+        scores = np.zeros(self.num_documents, dtype=np.float32)
+
+        for token in set(tokenise(query)):
+            try:
+                document_ids, weights = self.postings[token]
+            except KeyError:
+                continue
+
+            scores[document_ids] += weights
+
+        matches = np.flatnonzero(scores)
+        if len(matches) > n:
+            matches = matches[np.argpartition(-scores[matches], n - 1)[:n]]
+
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+
+        return matches.tolist(), scores[matches].astype(float).tolist()
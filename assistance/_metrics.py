@@ -0,0 +1,53 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import collections
+from typing import TypedDict
+
+
+class Observations(TypedDict):
+    count: int
+    total: float
+    min: float
+    max: float
+
+
+_counters: collections.Counter[str] = collections.Counter()
+_observations: dict[str, Observations] = {}
+
+
+def increment(name: str, amount: int = 1):
+    _counters[name] += amount
+
+
+def get_counters() -> dict[str, int]:
+    return dict(_counters)
+
+
+def observe(name: str, value: float):
+    try:
+        observations = _observations[name]
+    except KeyError:
+        _observations[name] = {"count": 1, "total": value, "min": value, "max": value}
+        return
+
+    observations["count"] += 1
+    observations["total"] += value
+    observations["min"] = min(observations["min"], value)
+    observations["max"] = max(observations["max"], value)
+
+
+def get_observations() -> dict[str, Observations]:
+    return {name: Observations(**item) for name, item in _observations.items()}
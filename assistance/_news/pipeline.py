@@ -12,22 +12,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import asyncio
 import json
 import random
 
 import aiofiles
 
-from assistance import _ctx
+from assistance._article_cache import scrape
+from assistance._cpu import run_cpu_bound
 from assistance._parsing.googlealerts import parse_alerts
 from assistance._paths import NEW_GOOGLE_ALERTS, get_article_metadata_path
+from assistance._scraper import CrawlQueue
 from assistance._types import Article, Email
 from assistance._utilities import get_cleaned_url, get_hash_digest
-from assistance._vendor.stackoverflow.web_scraping import scrape
+
+# Articles are downloaded ahead of being summarised, a few at a time
+_pre_cache_queue = CrawlQueue("pre_cache_articles", scrape)
 
 
 async def add_to_google_alerts_pipeline(email: Email):
-    article_details = parse_alerts(email["html_body"])
+    article_details = await run_cpu_bound(parse_alerts, email["html_body"])
 
     for item in article_details:
         details_for_saving = {"subject": email["subject"], **item}
@@ -46,14 +49,9 @@ async def add_to_google_alerts_pipeline(email: Email):
         async with aiofiles.open(pipeline_path, "w") as f:
             pass
 
-    asyncio.create_task(_pre_cache_articles(article_details))
-
+    _pre_cache_articles(article_details)
 
-async def _pre_cache_articles(article_details: list[Article]):
-    coroutines = []
 
+def _pre_cache_articles(article_details: list[Article]):
     for article in article_details:
-        url = get_cleaned_url(article["url"])
-        coroutines.append(scrape(_ctx.session, url))
-
-    await asyncio.gather(*coroutines)
+        _pre_cache_queue.put(get_cleaned_url(article["url"]))
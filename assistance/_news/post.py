@@ -141,7 +141,11 @@ async def write_news_post(
     )
 
     response = await get_completion_only(
-        scope=scope, prompt=prompt, api_key=openai_api_key, **MODEL_KWARGS
+        scope=scope,
+        priority="background",
+        prompt=prompt,
+        api_key=openai_api_key,
+        **MODEL_KWARGS,
     )
 
     return summary, response
@@ -14,13 +14,13 @@
 
 import asyncio
 import json
-import math
 import textwrap
 
 from assistance import _ctx
 from assistance._config import SIMPLER_OPENAI_MODEL
 from assistance._logging import log_info
 from assistance._openai import get_completion_only
+from assistance._tokens import count_tokens, get_remaining_tokens
 from assistance._utilities import items_to_list_string
 
 MAX_ARTICLES_PER_SCORING = 20
@@ -129,19 +129,12 @@ async def article_scoring(
 
     log_info(scope, _ctx.pp.pformat(articles_with_ids))
 
-    # TODO: Adjust max articles per scoring based on the number of words
-    # within each article.
-    num_articles = len(articles_with_ids)
-    num_chunks = math.ceil(num_articles / MAX_ARTICLES_PER_SCORING)
-    num_articles_per_chunk = math.ceil(num_articles / num_chunks)
-
-    # Consistent article grouping so that cache is used more often.
-    # num_articles_per_chunk = MAX_ARTICLES_PER_SCORING
-
-    chunks = [
-        articles_with_ids[i : i + num_articles_per_chunk]
-        for i in range(0, num_articles, num_articles_per_chunk)
-    ]
+    chunks = _pack_articles_into_chunks(
+        tasks=tasks,
+        goals=goals,
+        target_audience=target_audience,
+        articles_with_ids=articles_with_ids,
+    )
 
     coroutines = []
     for chunk in chunks:
@@ -164,6 +157,50 @@ async def article_scoring(
     return article_scores
 
 
+def _pack_articles_into_chunks(
+    tasks: list[str],
+    goals: list[str],
+    target_audience: str,
+    articles_with_ids: list[dict],
+):
+    """Fill each scoring prompt up to the model's token limit.
+
+    Articles keep their order, so that the same articles tend to be
+    grouped together and the completion cache is used more often.
+    """
+    model = MODEL_KWARGS["engine"]
+
+    empty_prompt = PROMPT.format(
+        tasks=items_to_list_string(tasks),
+        goals=items_to_list_string(goals),
+        target_audience=target_audience,
+        num_of_articles=MAX_ARTICLES_PER_SCORING,
+        articles="[]",
+    )
+    remaining_tokens = get_remaining_tokens(
+        prompt=empty_prompt, max_tokens=MODEL_KWARGS["max_tokens"], model=model
+    )
+
+    chunks: list[list[dict]] = []
+    chunk_tokens = 0
+
+    for article in articles_with_ids:
+        article_tokens = count_tokens(json.dumps(article, indent=2), model)
+
+        if (
+            not chunks
+            or len(chunks[-1]) >= MAX_ARTICLES_PER_SCORING
+            or chunk_tokens + article_tokens > remaining_tokens
+        ):
+            chunks.append([])
+            chunk_tokens = 0
+
+        chunks[-1].append(article)
+        chunk_tokens += article_tokens
+
+    return chunks
+
+
 async def _chunk_of_articles(
     scope: str,
     openai_api_key: str,
@@ -183,6 +220,7 @@ async def _chunk_of_articles(
 
     response = await get_completion_only(
         scope=scope,
+        priority="background",
         prompt=prompt,
         api_key=openai_api_key,
         **MODEL_KWARGS,
@@ -15,13 +15,10 @@
 import asyncio
 import json
 import logging
-import pathlib
-import time
+from typing import AsyncIterator
 
-import aiofiles
+import numpy as np
 import openai
-from asyncache import cached
-from cachetools import LRUCache
 from tenacity import (
     retry,
     retry_all,
@@ -33,10 +30,21 @@ from tenacity import (
 
 from assistance import _ctx
 from assistance._logging import log_info
-
-from ._paths import COMPLETIONS, get_completion_cache_path
+from assistance._scheduler import Priority, get_scheduler
+from assistance._singleflight import SingleFlight
+from assistance._tokens import count_tokens
+
+from ._completion_cache import (
+    get_cached_embedding,
+    get_cached_response,
+    store_cached_embedding,
+    store_cached_response,
+)
 from ._utilities import get_hash_digest
 
+_completion_single_flight = SingleFlight("openai.completions")
+_embedding_single_flight = SingleFlight("openai.embeddings")
+
 
 async def get_completion_only(**kwargs) -> str:
     response = await _completion_with_back_off(**kwargs)
@@ -48,37 +56,114 @@ async def get_completion_only(**kwargs) -> str:
     return stripped_response
 
 
-# Cache this with an LRU cache as well
+async def stream_completion_only(**kwargs) -> AsyncIterator[str]:
+    """Yield the completion content as it is generated.
+
+    A cached completion is yielded as a single delta. A completion that
+    is streamed through to its end is written to the same completion
+    cache as `get_completion_only`. Closing the iterator early, for
+    example via `contextlib.aclosing`, abandons the request and nothing
+    is cached.
+    """
+    scope: str = kwargs.pop("scope")
+    priority: Priority = kwargs.pop("priority", "interactive")
+
+    kwargs_for_cache_hash, completion_request_hash = _get_completion_request_hash(
+        kwargs
+    )
+
+    cached_response = await get_cached_response(completion_request_hash)
+    if cached_response is not None:
+        yield cached_response["choices"][0]["message"]["content"]
+        return
+
+    log_info(scope, _ctx.pp.pformat(kwargs_for_cache_hash))
+
+    chat_kwargs = _get_chat_kwargs(kwargs)
+    stream = await _start_chat_completion_stream(priority, chat_kwargs)
+
+    content_parts = []
+    finish_reason = None
+
+    try:
+        async for chunk in stream:
+            choice = chunk["choices"][0]
+            finish_reason = choice.get("finish_reason") or finish_reason
+
+            delta = choice["delta"].get("content")
+            if delta:
+                content_parts.append(delta)
+                yield delta
+    finally:
+        await stream.aclose()
+
+    response = {
+        "object": "chat.completion",
+        "model": chat_kwargs["model"],
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(content_parts)},
+                "finish_reason": finish_reason,
+            }
+        ],
+    }
+
+    log_info(scope, f"Completion result: {response}")
+
+    await store_cached_response(completion_request_hash, response)
+
+
 async def _completion_with_back_off(**kwargs):
     scope: str = kwargs["scope"]
     del kwargs["scope"]
 
+    priority: Priority = kwargs.pop("priority", "interactive")
+
     assert "scope" not in kwargs
 
+    kwargs_for_cache_hash, completion_request_hash = _get_completion_request_hash(
+        kwargs
+    )
+
+    cached_response = await get_cached_response(completion_request_hash)
+    if cached_response is not None:
+        return cached_response
+
+    return await _completion_single_flight.run(
+        completion_request_hash,
+        lambda: _run_and_cache_completion(
+            scope, priority, kwargs, kwargs_for_cache_hash, completion_request_hash
+        ),
+    )
+
+
+def _get_completion_request_hash(kwargs):
     kwargs_for_cache_hash = kwargs.copy()
     del kwargs_for_cache_hash["api_key"]
 
     completion_request = json.dumps(kwargs_for_cache_hash, indent=2, sort_keys=True)
     completion_request_hash = get_hash_digest(completion_request)
-    completion_cache_path = get_completion_cache_path(
-        completion_request_hash, create_parent=True
-    )
 
-    try:
-        async with aiofiles.open(completion_cache_path, "r") as f:
-            return json.loads(await f.read())
-    except (FileNotFoundError, json.JSONDecodeError):
-        pass
+    return kwargs_for_cache_hash, completion_request_hash
 
-    log_info(scope, _ctx.pp.pformat(kwargs_for_cache_hash))
 
-    query_timestamp = time.time_ns()
+async def _run_and_cache_completion(
+    scope: str,
+    priority: Priority,
+    kwargs,
+    kwargs_for_cache_hash,
+    completion_request_hash: str,
+):
+    log_info(scope, _ctx.pp.pformat(kwargs_for_cache_hash))
 
-    response = await _run_completion(kwargs)
+    response = await _run_completion(kwargs, priority)
 
     log_info(scope, f"Completion result: {response}")
 
-    asyncio.create_task(_store_cache(completion_cache_path, response))
+    # Stored before leaving the single flight so that a request arriving
+    # just after this one finishes reads the cache instead of missing it.
+    await store_cached_response(completion_request_hash, response)
 
     return response
 
@@ -91,65 +176,189 @@ async def _completion_with_back_off(**kwargs):
     wait=wait_random_exponential(min=1, max=60),
     stop=stop_after_attempt(12),
 )
-async def _run_completion(kwargs):
-    response = await _chat_completion_wrapper(**kwargs)
+async def _run_completion(kwargs, priority: Priority = "interactive"):
+    response = await _chat_completion_wrapper(priority, _get_chat_kwargs(kwargs))
 
     return response
 
 
-async def _chat_completion_wrapper(**kwargs):
-    prompt = kwargs["prompt"]
-    messages = [{"role": "user", "content": prompt}]
+@retry(
+    retry=retry_all(
+        retry_if_not_exception_message("Model maximum reached"),
+        retry_if_exception_type(),
+    ),
+    wait=wait_random_exponential(min=1, max=60),
+    stop=stop_after_attempt(12),
+)
+async def _start_chat_completion_stream(priority: Priority, chat_kwargs):
+    return await _chat_completion_wrapper(priority, {**chat_kwargs, "stream": True})
+
+
+def _get_chat_kwargs(kwargs):
+    chat_kwargs = kwargs.copy()
+
+    prompt = chat_kwargs.pop("prompt")
+    chat_kwargs["messages"] = [{"role": "user", "content": prompt}]
 
-    del kwargs["prompt"]
-    kwargs["messages"] = messages
+    chat_kwargs["model"] = chat_kwargs.pop("engine")
 
-    kwargs["model"] = kwargs["engine"]
-    del kwargs["engine"]
+    return chat_kwargs
+
+
+async def _chat_completion_wrapper(priority: Priority, chat_kwargs):
+    prompt = chat_kwargs["messages"][0]["content"]
+
+    # The rate limit counts max_tokens against the budget up front
+    estimated_tokens = count_tokens(prompt, chat_kwargs["model"]) + chat_kwargs.get(
+        "max_tokens", 0
+    )
+
+    scheduler = get_scheduler(chat_kwargs["model"])
+    await scheduler.acquire(estimated_tokens, priority)
 
     try:
-        response = await openai.ChatCompletion.acreate(**kwargs)
+        response = await openai.ChatCompletion.acreate(**chat_kwargs)
+    except openai.error.RateLimitError:
+        scheduler.back_off()
+        raise
     except Exception as e:
         if "This model's maximum context length is" in str(e):
             raise ValueError("Model maximum reached")
 
         raise
 
-    return response
+    try:
+        used_tokens = response["usage"]["total_tokens"]
+    except (KeyError, TypeError):
+        # Streamed responses do not report their usage
+        pass
+    else:
+        scheduler.release_unused(max(0, estimated_tokens - used_tokens))
 
+    return response
 
-async def _store_cache(completion_cache_path: pathlib.Path, response):
-    async with aiofiles.open(completion_cache_path, "w") as f:
-        await f.write(json.dumps(response, indent=2))
 
+EMBEDDING_MODEL = "text-embedding-ada-002"
 
-async def get_embedding(block: str, api_key) -> list[float]:
-    result = await _get_embedding_with_cache(block, api_key)
-    return result["data"][0]["embedding"]  # type: ignore
+# Concurrent embedding requests that arrive within this window (in
+# seconds) of each other are sent to OpenAI as a single request.
+EMBEDDING_BATCH_WINDOW = 0.05
+EMBEDDING_MAX_BATCH_SIZE = 256
 
 
-async def _get_embedding_with_cache(block: str, api_key):
+async def get_embedding(block: str, api_key) -> np.ndarray:
     block_hash = get_hash_digest(block)
-    cache_path = get_completion_cache_path(block_hash, create_parent=True)
 
-    try:
-        async with aiofiles.open(cache_path, "r") as f:
-            return json.loads(await f.read())
-    except (FileNotFoundError, json.JSONDecodeError):
-        pass
+    cached_embedding = await get_cached_embedding(block_hash)
+    if cached_embedding is not None:
+        return cached_embedding
+
+    return await _embedding_single_flight.run(
+        block_hash, lambda: _run_and_cache_embedding(block, api_key, block_hash)
+    )
+
 
+async def _run_and_cache_embedding(block: str, api_key, block_hash: str):
     logging.info("A new embedding: %s", block)
 
-    result = await _get_embedding(block, api_key)
+    result = await _embedding_batcher.embed(block, api_key)
+    embedding = np.array(result["data"][0]["embedding"], dtype=np.float32)
 
-    asyncio.create_task(_store_cache(cache_path, result))
+    await store_cached_embedding(block_hash, embedding)
 
-    return result
+    return embedding
+
+
+class _EmbeddingBatcher:
+    """Coalesces concurrent embedding requests into multi-input requests.
+
+    Each awaiter receives a response shaped as if its block had been
+    embedded by itself, so that it can be cached per block.
+    """
+
+    def __init__(self, window: float, max_batch_size: int):
+        self.window = window
+        self.max_batch_size = max_batch_size
+
+        self._pending: dict[str, dict[str, asyncio.Future]] = {}
+        self._flush_handles: dict[str, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def embed(self, block: str, api_key: str):
+        loop = asyncio.get_running_loop()
+        pending = self._pending.setdefault(api_key, {})
+
+        try:
+            future = pending[block]
+        except KeyError:
+            future = loop.create_future()
+            pending[block] = future
+
+            if len(pending) >= self.max_batch_size:
+                self._flush(api_key)
+            elif len(pending) == 1:
+                self._flush_handles[api_key] = loop.call_later(
+                    self.window, self._flush, api_key
+                )
+
+        return await asyncio.shield(future)
+
+    def _flush(self, api_key: str):
+        handle = self._flush_handles.pop(api_key, None)
+        if handle is not None:
+            handle.cancel()
+
+        pending = self._pending.pop(api_key, {})
+        if not pending:
+            return
+
+        task = asyncio.create_task(self._run_batch(pending, api_key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, pending: dict[str, asyncio.Future], api_key: str):
+        blocks = list(pending.keys())
+
+        try:
+            result = await _get_embeddings(blocks, api_key)
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+
+            return
+
+        for item in result["data"]:
+            future = pending[blocks[item["index"]]]
+
+            if not future.done():
+                future.set_result(
+                    {
+                        "object": "list",
+                        "data": [{**item, "index": 0}],
+                        "model": result["model"],
+                    }
+                )
+
+
+_embedding_batcher = _EmbeddingBatcher(
+    window=EMBEDDING_BATCH_WINDOW, max_batch_size=EMBEDDING_MAX_BATCH_SIZE
+)
 
 
 @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(12))
-async def _get_embedding(block: str, api_key):
-    result = await openai.Embedding.acreate(
-        input=block, api_key=api_key, model="text-embedding-ada-002"
+async def _get_embeddings(blocks: list[str], api_key):
+    scheduler = get_scheduler(EMBEDDING_MODEL)
+    await scheduler.acquire(
+        sum(count_tokens(block, EMBEDDING_MODEL) for block in blocks)
     )
+
+    try:
+        result = await openai.Embedding.acreate(
+            input=blocks, api_key=api_key, model=EMBEDDING_MODEL
+        )
+    except openai.error.RateLimitError:
+        scheduler.back_off()
+        raise
+
     return result
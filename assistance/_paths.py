@@ -41,10 +41,17 @@ PROMPTS = RECORDS.joinpath("prompts")
 COMPLETIONS = RECORDS.joinpath("completions")
 ARTICLE_METADATA = RECORDS.joinpath("article-metadata")
 DOWNLOADED_ARTICLES = RECORDS.joinpath("downloaded-articles")
+DOWNLOADED_ARTICLE_METADATA = RECORDS.joinpath("downloaded-article-metadata")
+EXTRACTED_ARTICLE_TEXT = RECORDS.joinpath("extracted-article-text")
 EMAILS = RECORDS.joinpath("emails")
 POSTAL = RECORDS.joinpath("postal")
 CONTACT_FORM = RECORDS.joinpath("contact-form")
 COMPLETION_CACHE = RECORDS.joinpath("completion-cache")
+COMPLETION_CACHE_DATABASE = RECORDS.joinpath("completion-cache.sqlite3")
+EMBEDDING_STORE = RECORDS.joinpath("embedding-store")
+THREAD_SUMMARIES = RECORDS.joinpath("thread-summaries")
+ANSWER_CACHE = RECORDS.joinpath("answer-cache")
+TIKTOKEN_CACHE = RECORDS.joinpath("tiktoken-cache")
 
 PIPELINES = STORE.joinpath("pipelines")
 
@@ -79,6 +86,18 @@ def get_downloaded_article_path(hash_digest: str, create_parent: bool = False):
     return path
 
 
+def get_downloaded_article_metadata_path(hash_digest: str, create_parent: bool = False):
+    path = _get_record_path(DOWNLOADED_ARTICLE_METADATA, hash_digest, create_parent)
+
+    return path
+
+
+def get_extracted_article_text_path(hash_digest: str, create_parent: bool = False):
+    path = _get_record_path(EXTRACTED_ARTICLE_TEXT, hash_digest, create_parent)
+
+    return path
+
+
 def get_emails_path(hash_digest: str, create_parent: bool = False):
     path = _get_record_path(EMAILS, hash_digest, create_parent)
 
@@ -97,14 +116,24 @@ def get_contact_form_path(hash_digest: str, create_parent: bool = False):
     return path
 
 
-def get_completion_cache_path(hash_digest: str, create_parent: bool = False):
-    path = _get_record_path(COMPLETION_CACHE, hash_digest, create_parent)
+def get_completion_cache_path(
+    hash_digest: str, create_parent: bool = False, suffix: str = ".json"
+):
+    path = _get_record_path(COMPLETION_CACHE, hash_digest, create_parent, suffix)
+
+    return path
+
+
+def get_thread_summary_path(hash_digest: str, create_parent: bool = False):
+    path = _get_record_path(THREAD_SUMMARIES, hash_digest, create_parent)
 
     return path
 
 
-def _get_record_path(root: pathlib.Path, hash_digest: str, create_parent: bool):
-    path = root / _get_relative_json_path(hash_digest)
+def _get_record_path(
+    root: pathlib.Path, hash_digest: str, create_parent: bool, suffix: str = ".json"
+):
+    path = root / _get_relative_path(hash_digest, suffix)
 
     if create_parent:
         path.parent.mkdir(parents=True, exist_ok=True)
@@ -112,5 +141,5 @@ def _get_record_path(root: pathlib.Path, hash_digest: str, create_parent: bool):
     return path
 
 
-def _get_relative_json_path(hash_digest: str):
-    return pathlib.Path(hash_digest[0:4]) / hash_digest[4:8] / f"{hash_digest}.json"
+def _get_relative_path(hash_digest: str, suffix: str):
+    return pathlib.Path(hash_digest[0:4]) / hash_digest[4:8] / f"{hash_digest}{suffix}"
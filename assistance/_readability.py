@@ -0,0 +1,175 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Finds the main content of a page, such as the body of a news article,
+# so that navigation, cookie banners, sidebars, and footers are not
+# summarised along with it. In the manner of Readability, each paragraph
+# scores its parent and grandparent by its length and number of commas,
+# and the container with the highest score, discounted by how much of
+# its text sits within links, is taken to be the content. Its siblings
+# that score nearly as well are kept with it.
+
+import re
+
+import bs4
+
+UNLIKELY_TAGS = frozenset(
+    {"aside", "button", "footer", "form", "header", "iframe", "nav", "noscript"}
+)
+UNLIKELY_PATTERN = re.compile(
+    r"advert|banner|breadcrumb|comment|consent|cookie|footer|header|menu|"
+    r"modal|nav|newsletter|popup|promo|related|share|sidebar|social|"
+    r"subscribe|tags",
+    re.IGNORECASE,
+)
+LIKELY_PATTERN = re.compile(
+    r"article|body|content|entry|main|post|story|text", re.IGNORECASE
+)
+
+PARAGRAPH_TAGS = ["p", "pre", "td"]
+MIN_PARAGRAPH_CHARACTERS = 25
+
+CLASS_WEIGHT = 25
+
+# Siblings scoring at least this fraction of the best candidate are kept
+SIBLING_SCORE_FRACTION = 0.2
+MIN_SIBLING_SCORE = 10
+
+# Anything shorter is more likely to be a listing than an article, and
+# the whole page is used instead.
+MIN_CONTENT_CHARACTERS = 250
+
+# Each candidate and its score, keyed by the candidate's id. A Tag hashes
+# and compares by its markup, which is slow to compute for large subtrees
+# and would merge candidates that happen to have identical markup.
+Scores = dict[int, tuple[bs4.Tag, float]]
+
+
+def get_main_content(html: bytes, features: str = "html.parser") -> str | None:
+    """The HTML of the page's main content, or None when it has none."""
+    soup = bs4.BeautifulSoup(html, features=features)
+
+    # The headline usually sits outside of the article's body
+    headline = soup.find("h1")
+    if headline is not None:
+        headline = headline.extract()
+
+    for element in soup(["script", "style"]):
+        element.decompose()
+
+    for element in soup.find_all(_is_unlikely):
+        element.decompose()
+
+    scores = _score_candidates(soup)
+    if not scores:
+        return None
+
+    best, best_score = max(scores.values(), key=lambda item: item[1])
+    content = _with_similar_siblings(best, best_score, scores)
+
+    if sum(len(element.get_text(strip=True)) for element in content) < (
+        MIN_CONTENT_CHARACTERS
+    ):
+        return None
+
+    if headline is not None:
+        content.insert(0, headline)
+
+    return "\n".join(str(element) for element in content)
+
+
+def _is_unlikely(element: bs4.Tag) -> bool:
+    if element.name in UNLIKELY_TAGS:
+        return True
+
+    if element.name in ("html", "body", "main", "article"):
+        return False
+
+    identifiers = " ".join([*element.get("class", []), element.get("id", "")])
+
+    return bool(
+        UNLIKELY_PATTERN.search(identifiers) and not LIKELY_PATTERN.search(identifiers)
+    )
+
+
+def _score_candidates(soup: bs4.BeautifulSoup) -> Scores:
+    scores: Scores = {}
+
+    for paragraph in soup.find_all(PARAGRAPH_TAGS):
+        text = paragraph.get_text(" ", strip=True)
+        if len(text) < MIN_PARAGRAPH_CHARACTERS:
+            continue
+
+        score = 1 + text.count(",") + min(len(text) // 100, 3)
+
+        parent = paragraph.parent
+        grandparent = parent.parent if parent is not None else None
+
+        for ancestor, share in ((parent, 1), (grandparent, 0.5)):
+            if not isinstance(ancestor, bs4.Tag) or ancestor.name is None:
+                continue
+
+            key = id(ancestor)
+            if key not in scores:
+                scores[key] = (ancestor, _get_class_weight(ancestor))
+
+            candidate, candidate_score = scores[key]
+            scores[key] = (candidate, candidate_score + score * share)
+
+    return {
+        key: (candidate, score * (1 - _get_link_density(candidate)))
+        for key, (candidate, score) in scores.items()
+    }
+
+
+def _get_class_weight(element: bs4.Tag) -> float:
+    identifiers = " ".join([*element.get("class", []), element.get("id", "")])
+
+    weight = 0
+    if LIKELY_PATTERN.search(identifiers):
+        weight += CLASS_WEIGHT
+    if UNLIKELY_PATTERN.search(identifiers):
+        weight -= CLASS_WEIGHT
+
+    return weight
+
+
+def _get_link_density(element: bs4.Tag) -> float:
+    text_length = len(element.get_text(strip=True))
+    if text_length == 0:
+        return 0
+
+    link_length = sum(len(link.get_text(strip=True)) for link in element("a"))
+
+    return link_length / text_length
+
+
+def _with_similar_siblings(
+    best: bs4.Tag, best_score: float, scores: Scores
+) -> list[bs4.Tag]:
+    if best.parent is None:
+        return [best]
+
+    threshold = max(MIN_SIBLING_SCORE, best_score * SIBLING_SCORE_FRACTION)
+
+    content = []
+    for sibling in best.parent.children:
+        if not isinstance(sibling, bs4.Tag):
+            continue
+
+        _candidate, score = scores.get(id(sibling), (sibling, 0))
+        if sibling is best or score >= threshold:
+            content.append(sibling)
+
+    return content
@@ -0,0 +1,177 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Admission control for OpenAI requests. Each model has a token bucket
+# for requests per minute and another for tokens per minute, and a
+# request waits until both buckets can cover it. Waiting requests are
+# admitted strictly by priority and then in arrival order, so that
+# interactive email replies are not stuck behind the nightly news
+# digest.
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Literal, TypedDict
+
+from assistance._metrics import increment
+
+Priority = Literal["interactive", "background"]
+
+PRIORITY_ORDER: dict[Priority, int] = {
+    "interactive": 0,
+    "background": 1,
+}
+
+
+class RateLimits(TypedDict):
+    requests_per_minute: int
+    tokens_per_minute: int
+
+
+RATE_LIMITS: dict[str, RateLimits] = {
+    "gpt-3.5-turbo": {"requests_per_minute": 3_500, "tokens_per_minute": 90_000},
+    "gpt-4": {"requests_per_minute": 200, "tokens_per_minute": 40_000},
+    "text-embedding-ada-002": {
+        "requests_per_minute": 3_000,
+        "tokens_per_minute": 1_000_000,
+    },
+}
+
+DEFAULT_RATE_LIMITS: RateLimits = {
+    "requests_per_minute": 200,
+    "tokens_per_minute": 40_000,
+}
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.refill_per_second = per_minute / 60
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(
+            self.capacity,
+            self.available + (now - self.updated) * self.refill_per_second,
+        )
+        self.updated = now
+
+    def seconds_until_available(self, amount: float) -> float:
+        self.refill()
+        missing = min(amount, self.capacity) - self.available
+
+        return max(0.0, missing / self.refill_per_second)
+
+    def take(self, amount: float):
+        self.refill()
+        self.available -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        self.refill()
+        self.available = min(self.capacity, self.available + amount)
+
+    def empty(self):
+        self.refill()
+        self.available = min(self.available, 0.0)
+
+
+class ModelScheduler:
+    def __init__(self, rate_limits: RateLimits):
+        self.requests = TokenBucket(rate_limits["requests_per_minute"])
+        self.tokens = TokenBucket(rate_limits["tokens_per_minute"])
+
+        self._waiting: list[tuple[int, int, float, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._wake_up = asyncio.Event()
+        self._dispatcher: asyncio.Task | None = None
+
+    async def acquire(self, tokens: int, priority: Priority = "interactive"):
+        if not self._waiting and self._seconds_until_admitted(tokens) == 0:
+            self._admit(tokens)
+            return
+
+        increment(f"scheduler.{priority}.queued")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._waiting,
+            (PRIORITY_ORDER[priority], next(self._counter), tokens, future),
+        )
+
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wake_up = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        else:
+            self._wake_up.set()
+
+        await future
+
+    def release_unused(self, tokens: int):
+        self.tokens.give_back(tokens)
+
+    def back_off(self):
+        """Hold every request back after the API reports a rate limit."""
+        self.requests.empty()
+        self.tokens.empty()
+
+    def _seconds_until_admitted(self, tokens: float) -> float:
+        return max(
+            self.requests.seconds_until_available(1),
+            self.tokens.seconds_until_available(tokens),
+        )
+
+    def _admit(self, tokens: float):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    async def _dispatch(self):
+        while self._waiting:
+            _priority, _count, tokens, future = self._waiting[0]
+
+            if future.cancelled():
+                heapq.heappop(self._waiting)
+                continue
+
+            wait = self._seconds_until_admitted(tokens)
+            if wait == 0:
+                heapq.heappop(self._waiting)
+                self._admit(tokens)
+                future.set_result(None)
+                continue
+
+            # Woken early if a higher priority request arrives
+            self._wake_up.clear()
+            try:
+                await asyncio.wait_for(self._wake_up.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+
+_schedulers: dict[str, ModelScheduler] = {}
+
+
+def get_scheduler(model: str) -> ModelScheduler:
+    try:
+        return _schedulers[model]
+    except KeyError:
+        pass
+
+    scheduler = ModelScheduler(RATE_LIMITS.get(model, DEFAULT_RATE_LIMITS))
+    _schedulers[model] = scheduler
+
+    return scheduler
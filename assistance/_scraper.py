@@ -0,0 +1,231 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The engine that articles are downloaded with. It has its own pooled
+# session, so that slow news hosts do not hold up the connections used
+# for sending emails. Each host gets only a few requests at a time, every
+# request has connect and read timeouts, bodies over a size limit are
+# refused, and failed requests are retried with a jittered exponential
+# backoff. A crawl queue lets URLs be fed in faster than they are
+# fetched, with a fixed number of workers draining it.
+
+import asyncio
+import collections
+import logging
+import random
+import urllib.parse
+from typing import Any, Awaitable, Callable, TypedDict
+
+import aiohttp
+from multidict import CIMultiDict
+
+from assistance._metrics import increment
+
+MAX_CONNECTIONS = 32
+MAX_REQUESTS_PER_HOST = 2
+DNS_CACHE_SECONDS = 300
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 20
+TOTAL_TIMEOUT = 60
+
+MAX_BODY_BYTES = 5 * 1024 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+
+MAX_ATTEMPTS = 3
+BACKOFF_SECONDS = 1
+
+# Statuses worth trying again, everything else is returned as is
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+CRAWL_WORKERS = 8
+
+
+class FetchedPage(TypedDict):
+    url: str
+    status: int
+    headers: CIMultiDict[str]
+    body: bytes
+
+
+_session: aiohttp.ClientSession | None = None
+_host_semaphores: collections.defaultdict[
+    str, asyncio.Semaphore
+] = collections.defaultdict(lambda: asyncio.Semaphore(MAX_REQUESTS_PER_HOST))
+
+
+async def fetch(url: str, headers: dict[str, str] | None = None) -> FetchedPage:
+    """Download the url, retrying connection errors, timeouts, and 5xx.
+
+    The final attempt's timeout is raised as `asyncio.TimeoutError`, and
+    its connection error as `aiohttp.ClientError`. A body larger than
+    `MAX_BODY_BYTES` raises a `ValueError` without being retried.
+    """
+    host = urllib.parse.urlsplit(url).hostname or ""
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        retry_after = None
+
+        try:
+            async with _host_semaphores[host]:
+                page = await _fetch_once(url, headers)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt == MAX_ATTEMPTS:
+                increment("scraper.failed")
+                raise
+
+            logging.info(f"Retrying {url} after {type(e).__name__}: {e}")
+        else:
+            if page["status"] not in RETRY_STATUSES or attempt == MAX_ATTEMPTS:
+                increment("scraper.fetched")
+                return page
+
+            logging.info(f"Retrying {url} after a {page['status']} response")
+            retry_after = _get_retry_after(page["headers"])
+
+        increment("scraper.retries")
+
+        # Slept outside of the host's semaphore, so that the other
+        # requests to that host can carry on in the meantime.
+        backoff = BACKOFF_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+        await asyncio.sleep(max(backoff, retry_after or 0))
+
+    raise AssertionError("unreachable")
+
+
+async def close_session():
+    global _session
+
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+async def _fetch_once(url: str, headers: dict[str, str] | None) -> FetchedPage:
+    session = _get_session()
+
+    async with session.get(url, headers=headers) as response:
+        if (response.content_length or 0) > MAX_BODY_BYTES:
+            increment("scraper.too_large")
+            raise ValueError(
+                f"{url} is {response.content_length} bytes, "
+                f"over the limit of {MAX_BODY_BYTES}"
+            )
+
+        # The Content-Length can be missing or wrong, so the body is
+        # also counted as it arrives.
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(READ_CHUNK_BYTES):
+            body.extend(chunk)
+
+            if len(body) > MAX_BODY_BYTES:
+                increment("scraper.too_large")
+                raise ValueError(f"{url} is over the limit of {MAX_BODY_BYTES} bytes")
+
+        return {
+            "url": str(response.url),
+            "status": response.status,
+            "headers": CIMultiDict(response.headers),
+            "body": bytes(body),
+        }
+
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=MAX_CONNECTIONS,
+                limit_per_host=MAX_REQUESTS_PER_HOST,
+                ttl_dns_cache=DNS_CACHE_SECONDS,
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=TOTAL_TIMEOUT,
+                sock_connect=CONNECT_TIMEOUT,
+                sock_read=READ_TIMEOUT,
+            ),
+        )
+
+    return _session
+
+
+def _get_retry_after(headers: CIMultiDict[str]) -> float | None:
+    try:
+        return float(headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+class CrawlQueue:
+    """Runs the handler over each url put onto the queue, a few at a time.
+
+    A url already waiting on the queue, or being handled, is not added
+    again. Handler errors are logged and counted within the
+    `{name}.failed` metric rather than stopping the workers.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[str], Awaitable[Any]],
+        num_workers: int = CRAWL_WORKERS,
+    ):
+        self.name = name
+        self.handler = handler
+        self.num_workers = num_workers
+
+        self._queue: asyncio.Queue[str] | None = None
+        self._pending: set[str] = set()
+        self._workers: list[asyncio.Task] = []
+
+    def put(self, url: str):
+        if url in self._pending:
+            increment(f"{self.name}.duplicates")
+            return
+
+        queue = self._get_queue()
+
+        self._pending.add(url)
+        queue.put_nowait(url)
+        increment(f"{self.name}.queued")
+
+    async def join(self):
+        await self._get_queue().join()
+
+    def _get_queue(self) -> asyncio.Queue[str]:
+        # Started on first use, so that the queue and its workers belong
+        # to the event loop that is running at the time.
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._workers = [
+                asyncio.create_task(self._work()) for _ in range(self.num_workers)
+            ]
+
+        return self._queue
+
+    async def _work(self):
+        assert self._queue is not None
+
+        while True:
+            url = await self._queue.get()
+
+            try:
+                await self.handler(url)
+            except Exception as e:
+                logging.warning(f"{self.name}: {url} failed with {e!r}")
+                increment(f"{self.name}.failed")
+            finally:
+                self._pending.discard(url)
+                self._queue.task_done()
@@ -0,0 +1,163 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+from typing import Callable, Literal
+
+import numpy as np
+
+SimilarityBackendName = Literal["numpy", "torch"]
+
+# Either "numpy", "torch", or None to pick torch only when a CUDA device
+# is available.
+SIMILARITY_BACKEND: SimilarityBackendName | None = None
+
+# Embeddings stored with a smaller dtype are converted to float32 this
+# many rows at a time, rather than all at once.
+UPCAST_BLOCK_ROWS = 8192
+
+
+def top_k_embeddings(
+    queries: np.ndarray,
+    embeddings: np.ndarray,
+    k: int,
+    index=None,
+    normalised=False,
+) -> tuple[list[list[int]], list[list[float]]]:
+    """Find the k most cosine-similar embeddings for each of the queries.
+
+    Returns the indices and scores for each query, ordered from the
+    most to the least similar. When an `_ann.IVFIndex` over the
+    embeddings is provided the search is approximate. Embeddings that
+    are already unit-normalised, such as those from the embedding
+    store, skip having their norms computed again.
+    """
+    k = min(k, len(embeddings))
+
+    if index is not None:
+        return index.search(embeddings, queries, k)
+
+    backend = SIMILARITY_BACKENDS[get_similarity_backend_name()]
+    indices, scores = backend(queries, embeddings, k, normalised)
+
+    return indices, scores
+
+
+def get_similarity_backend_name() -> SimilarityBackendName:
+    if SIMILARITY_BACKEND is not None:
+        return SIMILARITY_BACKEND
+
+    return _get_default_backend_name()
+
+
+# Only whether torch and CUDA are available is cached, so that changing
+# `SIMILARITY_BACKEND` takes effect on the next search.
+@functools.cache
+def _get_default_backend_name() -> SimilarityBackendName:
+    try:
+        import torch
+    except ImportError:
+        return "numpy"
+
+    if torch.cuda.is_available():
+        return "torch"
+
+    return "numpy"
+
+
+def normalise_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+
+    return matrix / norms
+
+
+def _numpy_top_k(queries, embeddings, k, normalised):
+    normalised_queries = normalise_rows(queries)
+
+    # One matmul for all of the queries at once, shape (queries, embeddings)
+    if not normalised:
+        cosine_similarity = normalised_queries @ normalise_rows(embeddings).T
+    elif embeddings.dtype == np.float32:
+        cosine_similarity = normalised_queries @ embeddings.T
+    else:
+        cosine_similarity = np.concatenate(
+            [
+                normalised_queries
+                @ np.asarray(
+                    embeddings[start : start + UPCAST_BLOCK_ROWS], dtype=np.float32
+                ).T
+                for start in range(0, len(embeddings), UPCAST_BLOCK_ROWS)
+            ],
+            axis=1,
+        )
+
+    if k < cosine_similarity.shape[1]:
+        unsorted_top_k = np.argpartition(-cosine_similarity, k - 1, axis=1)[:, :k]
+    else:
+        unsorted_top_k = np.broadcast_to(
+            np.arange(cosine_similarity.shape[1]), cosine_similarity.shape
+        )
+
+    unsorted_scores = np.take_along_axis(cosine_similarity, unsorted_top_k, axis=1)
+    order = np.argsort(-unsorted_scores, axis=1, kind="stable")
+
+    indices = np.take_along_axis(unsorted_top_k, order, axis=1)
+    scores = np.take_along_axis(unsorted_scores, order, axis=1)
+
+    return indices.tolist(), scores.astype(float).tolist()
+
+
+def _torch_top_k(queries, embeddings, k, normalised):
+    import torch
+
+    kernel = _get_torch_kernel()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    cosine_similarity, index = kernel(
+        torch.as_tensor(np.asarray(queries, dtype=np.float32), device=device),
+        torch.as_tensor(np.asarray(embeddings, dtype=np.float32), device=device),
+        torch.tensor(k, device=device),
+    )
+
+    return index.tolist(), cosine_similarity.tolist()
+
+
+@functools.cache
+def _get_torch_kernel():
+    import torch
+
+    @torch.jit.script  # type: ignore
+    def _top_k_embeddings(queries, embeddings, k):
+        transpose_queries = queries.T
+        embeddings_norm = torch.linalg.norm(embeddings, dim=1, keepdim=True)
+        query_norm = torch.linalg.norm(transpose_queries, dim=0, keepdim=True)
+
+        cosine_similarity = (
+            (embeddings @ transpose_queries) / (embeddings_norm @ query_norm)
+        ).T
+
+        return torch.topk(cosine_similarity, k)
+
+    return _top_k_embeddings
+
+
+SIMILARITY_BACKENDS: dict[
+    SimilarityBackendName,
+    Callable[[np.ndarray, np.ndarray, int, bool], tuple[list, list]],
+] = {
+    "numpy": _numpy_top_k,
+    "torch": _torch_top_k,
+}
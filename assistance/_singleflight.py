@@ -0,0 +1,72 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import collections
+from typing import Any, Awaitable, Callable
+
+from assistance._metrics import increment
+
+
+class SingleFlight:
+    """Shares one in-flight call between concurrent callers of the same key.
+
+    The first caller for a key starts the call, every other caller that
+    arrives before it finishes awaits that same call instead of making
+    their own. The number of joined callers is counted within the
+    `{name}.coalesced` metric. The call is only cancelled once every
+    caller waiting on it has been cancelled.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self._waiters: collections.Counter[str] = collections.Counter()
+
+    async def run(self, key: str, coroutine_function: Callable[[], Awaitable[Any]]):
+        try:
+            task = self._in_flight[key]
+        except KeyError:
+            task = asyncio.create_task(coroutine_function())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            increment(f"{self.name}.coalesced")
+
+        self._waiters[key] += 1
+        try:
+            # Shielded so that a cancelled caller does not cancel the
+            # call for everyone else that is waiting on it.
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1:
+                # Forgotten before cancelling, the task may take a while
+                # to wind down and a new caller must not join it.
+                self._forget(key, task)
+                task.cancel()
+                increment(f"{self.name}.cancelled")
+
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if self._waiters[key] <= 0:
+                del self._waiters[key]
+
+    def is_in_flight(self, key: str) -> bool:
+        return key in self._in_flight
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
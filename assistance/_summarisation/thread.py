@@ -16,10 +16,20 @@
 # https://github.com/hwchase17/langchain/blob/ae1b589f60a/langchain/agents/conversational/prompt.py#L1-L36
 
 
+import asyncio
+import json
 import textwrap
 
+import aiofiles
+
 from assistance._config import SIMPLER_OPENAI_MODEL
+from assistance._logging import log_info
+from assistance._metrics import increment
 from assistance._openai import get_completion_only
+from assistance._paths import get_thread_summary_path
+from assistance._singleflight import SingleFlight
+from assistance._tokens import count_tokens, get_remaining_tokens, split_by_tokens
+from assistance._utilities import get_hash_digest
 
 SUMMARY_KWARGS = {
     "engine": SIMPLER_OPENAI_MODEL,
@@ -61,9 +71,12 @@ SUMMARY_PROMPT_WITHOUT_INSTRUCTIONS = textwrap.dedent(
 ).strip()
 
 
-MAX_MODEL_TOKENS = 4096
+SUMMARY_ITEM = "Summary of omitted emails:\n{summary}\n\n"
+
+# Tokens used by the "\n\n" that joins the emails of a transcript
+EMAIL_SEPARATOR_TOKENS = 1
 
-SUMMARY_BATCH_SIZE = 2
+_thread_summary_single_flight = SingleFlight("thread_summary")
 
 
 async def run_with_summary_fallback(
@@ -74,8 +87,33 @@ async def run_with_summary_fallback(
     instructions: str | None = None,
     **kwargs,
 ):
+    """Run the prompt, summarising the oldest emails that do not fit.
+
+    The number of emails to summarise is worked out from the token
+    budget up front, and they are then summarised in a single parallel
+    map-reduce pass. See `get_thread_summary` for how that summary is
+    shared.
+    """
+    num_emails_to_summarise = _get_number_of_emails_to_summarise(
+        prompt=prompt, email_thread=email_thread, kwargs=kwargs
+    )
+
     while True:
-        transcript = "\n\n".join(email_thread)
+        if num_emails_to_summarise == 0:
+            compacted_thread = email_thread
+        else:
+            summary = await get_thread_summary(
+                scope=scope,
+                api_key=api_key,
+                emails=email_thread[:num_emails_to_summarise],
+                instructions=instructions,
+            )
+            compacted_thread = [
+                SUMMARY_ITEM.format(summary=summary),
+                *email_thread[num_emails_to_summarise:],
+            ]
+
+        transcript = "\n\n".join(compacted_thread)
         prompt_with_transcript = prompt.replace("{transcript}", transcript)
 
         try:
@@ -89,29 +127,213 @@ async def run_with_summary_fallback(
             if "Model maximum reached" not in str(e):
                 raise e
 
-            transcript_to_summarise = "\n\n".join(email_thread[0:SUMMARY_BATCH_SIZE])
+            # The token count was slightly out, fold in one more email
+            if num_emails_to_summarise >= len(email_thread):
+                raise e
 
-            if instructions:
-                summary_prompt = SUMMARY_PROMPT_WITH_INSTRUCTIONS.format(
-                    transcript=transcript_to_summarise, instructions=instructions
-                )
-            else:
-                summary_prompt = SUMMARY_PROMPT_WITHOUT_INSTRUCTIONS.format(
-                    transcript=transcript_to_summarise
-                )
+            num_emails_to_summarise += 1
+            continue
 
-            summary = await get_completion_only(
-                scope=scope,
-                prompt=summary_prompt,
-                api_key=api_key,
-                **SUMMARY_KWARGS,
+        return response, transcript
+
+
+async def get_thread_summary(
+    scope: str, api_key: str, emails: list[str], instructions: str | None = None
+) -> str:
+    """Summarise the emails, reusing what is already known about the thread.
+
+    Summaries are stored against a rolling hash of the thread prefix
+    that they cover. When a thread grows by a reply only the newly added
+    emails are summarised, on top of the summary of the longest prefix
+    that is already stored or currently being summarised. That way the
+    handlers that each process the same email share their summaries.
+    """
+    prefix_hashes = _get_prefix_hashes(emails, instructions)
+
+    return await _thread_summary_single_flight.run(
+        prefix_hashes[-1],
+        lambda: _get_or_create_thread_summary(
+            scope, api_key, emails, instructions, prefix_hashes
+        ),
+    )
+
+
+async def _get_or_create_thread_summary(
+    scope: str,
+    api_key: str,
+    emails: list[str],
+    instructions: str | None,
+    prefix_hashes: list[str],
+) -> str:
+    summary = await _load_thread_summary(prefix_hashes[-1])
+    if summary is not None:
+        increment("thread_summary.hit")
+        log_info(scope, f"Reusing the summary of {len(emails)} emails")
+
+        return summary
+
+    increment("thread_summary.miss")
+
+    emails_to_summarise = emails
+    for num_emails in range(len(emails) - 1, 0, -1):
+        prefix_hash = prefix_hashes[num_emails - 1]
+
+        if _thread_summary_single_flight.is_in_flight(prefix_hash):
+            previous_summary = await get_thread_summary(
+                scope, api_key, emails[:num_emails], instructions
             )
+        else:
+            previous_summary = await _load_thread_summary(prefix_hash)
+
+        if previous_summary is not None:
+            increment("thread_summary.extended")
+            emails_to_summarise = [
+                SUMMARY_ITEM.format(summary=previous_summary),
+                *emails[num_emails:],
+            ]
+            break
+
+    log_info(
+        scope,
+        f"Summarising {len(emails_to_summarise)} of a thread's {len(emails)} emails",
+    )
+    summary = await _summarise_emails(scope, api_key, emails_to_summarise, instructions)
+
+    path = get_thread_summary_path(prefix_hashes[-1], create_parent=True)
+    async with aiofiles.open(path, "w") as f:
+        await f.write(json.dumps({"summary": summary}))
 
-            summary_item = f"Summary of omitted emails:\n{summary}\n\n"
-            email_thread = [summary_item] + email_thread[SUMMARY_BATCH_SIZE:]
+    return summary
 
+
+async def _load_thread_summary(prefix_hash: str) -> str | None:
+    try:
+        async with aiofiles.open(get_thread_summary_path(prefix_hash), "r") as f:
+            return json.loads(await f.read())["summary"]
+    except FileNotFoundError:
+        return None
+
+
+def _get_number_of_emails_to_summarise(prompt: str, email_thread: list[str], kwargs):
+    model = kwargs["engine"]
+
+    remaining_tokens = get_remaining_tokens(
+        prompt=prompt.replace("{transcript}", ""),
+        max_tokens=kwargs["max_tokens"],
+        model=model,
+    )
+
+    email_tokens = [
+        count_tokens(email, model) + EMAIL_SEPARATOR_TOKENS for email in email_thread
+    ]
+    if sum(email_tokens) <= remaining_tokens:
+        return 0
+
+    summary_tokens = SUMMARY_KWARGS["max_tokens"] + count_tokens(
+        SUMMARY_ITEM.format(summary=""), model
+    )
+
+    tail_tokens = sum(email_tokens)
+    for num_emails_to_summarise, tokens in enumerate(email_tokens, start=1):
+        tail_tokens -= tokens
+
+        if tail_tokens + summary_tokens <= remaining_tokens:
+            return num_emails_to_summarise
+
+    return len(email_thread)
+
+
+async def _summarise_emails(
+    scope: str, api_key: str, emails: list[str], instructions: str | None
+) -> str:
+    groups = _group_emails_by_tokens(emails, instructions)
+
+    summaries = await asyncio.gather(
+        *[
+            _summarise_transcript(
+                scope, api_key, "\n\n".join(group), instructions=instructions
+            )
+            for group in groups
+        ]
+    )
+
+    if len(summaries) == 1:
+        return summaries[0]
+
+    # Reduce, the summaries are much shorter than the emails were
+    return await _summarise_emails(scope, api_key, list(summaries), instructions)
+
+
+def _group_emails_by_tokens(
+    emails: list[str], instructions: str | None
+) -> list[list[str]]:
+    model = SUMMARY_KWARGS["engine"]
+
+    remaining_tokens = get_remaining_tokens(
+        prompt=_get_summary_prompt(transcript="", instructions=instructions),
+        max_tokens=SUMMARY_KWARGS["max_tokens"],
+        model=model,
+    )
+
+    groups: list[list[str]] = []
+    group_tokens = 0
+
+    for email in emails:
+        email_tokens = count_tokens(email, model) + EMAIL_SEPARATOR_TOKENS
+
+        if email_tokens > remaining_tokens:
+            # An email too long for one summary is split up on its own
+            groups.extend(
+                [piece]
+                for piece in split_by_tokens(
+                    email,
+                    chunk_tokens=remaining_tokens - EMAIL_SEPARATOR_TOKENS,
+                    overlap_tokens=0,
+                    model=model,
+                )
+            )
+            group_tokens = remaining_tokens
             continue
 
-        break
+        if not groups or group_tokens + email_tokens > remaining_tokens:
+            groups.append([])
+            group_tokens = 0
+
+        groups[-1].append(email)
+        group_tokens += email_tokens
+
+    return groups
+
+
+async def _summarise_transcript(
+    scope: str, api_key: str, transcript: str, instructions: str | None
+) -> str:
+    summary = await get_completion_only(
+        scope=scope,
+        prompt=_get_summary_prompt(transcript=transcript, instructions=instructions),
+        api_key=api_key,
+        **SUMMARY_KWARGS,
+    )
+
+    return summary
+
+
+def _get_summary_prompt(transcript: str, instructions: str | None):
+    if instructions:
+        return SUMMARY_PROMPT_WITH_INSTRUCTIONS.format(
+            transcript=transcript, instructions=instructions
+        )
+
+    return SUMMARY_PROMPT_WITHOUT_INSTRUCTIONS.format(transcript=transcript)
+
+
+def _get_prefix_hashes(emails: list[str], instructions: str | None) -> list[str]:
+    """The hash of each prefix of the thread, built up one email at a time."""
+    prefix_hash = get_hash_digest(instructions or "")
+
+    prefix_hashes = []
+    for email in emails:
+        prefix_hash = get_hash_digest(prefix_hash + get_hash_digest(email))
+        prefix_hashes.append(prefix_hash)
 
-    return response, transcript
+    return prefix_hashes
@@ -17,14 +17,12 @@ import logging
 import textwrap
 
 from assistance import _ctx
+from assistance._article_cache import scrape
 from assistance._config import SIMPLER_OPENAI_MODEL
 from assistance._logging import log_info
 from assistance._openai import get_completion_only
-from assistance._utilities import (
-    get_approximate_allowed_remaining_words,
-    items_to_list_string,
-)
-from assistance._vendor.stackoverflow.web_scraping import scrape
+from assistance._tokens import get_remaining_tokens, split_by_tokens
+from assistance._utilities import items_to_list_string
 
 MAX_NUMBER_OF_TEXT_SECTIONS = 20
 
@@ -121,8 +119,7 @@ NEWS_PROMPT = textwrap.dedent(
 # ).strip()
 
 
-WORD_COUNT_SCALING_BUFFER = 0.7
-WORDS_OVERLAP = 40
+TOKENS_OVERLAP = 50
 
 
 async def summarise_news_article_url_with_tasks(
@@ -133,7 +130,7 @@ async def summarise_news_article_url_with_tasks(
     target_audience: str,
     url: str,
 ):
-    page_contents = await scrape(session=_ctx.session, url=url)
+    page_contents = await scrape(url=url)
 
     summary = await summarise_text_with_tasks(
         scope=scope,
@@ -182,29 +179,19 @@ async def _summarise_piecewise(
     prompt: str,
     content_to_summarise: str,
 ):
-    split_page_contents_by_words = [
-        item for item in content_to_summarise.split(None) if item
-    ]
-
-    remaining_words = get_approximate_allowed_remaining_words(
-        prompt=prompt, max_tokens=MODEL_KWARGS["max_tokens"]
+    remaining_tokens = get_remaining_tokens(
+        prompt=prompt.format(text=""),
+        max_tokens=MODEL_KWARGS["max_tokens"],
+        model=MODEL_KWARGS["engine"],
     )
 
-    max_words_per_summary_section = int(
-        remaining_words * WORD_COUNT_SCALING_BUFFER - WORDS_OVERLAP
+    all_text_sections = split_by_tokens(
+        content_to_summarise.strip(),
+        chunk_tokens=remaining_tokens,
+        overlap_tokens=TOKENS_OVERLAP,
+        model=MODEL_KWARGS["engine"],
     )
 
-    all_text_sections = [
-        " ".join(
-            split_page_contents_by_words[
-                i : i + max_words_per_summary_section + WORDS_OVERLAP
-            ]
-        )
-        for i in range(
-            0, len(split_page_contents_by_words), max_words_per_summary_section
-        )
-    ]
-
     if len(all_text_sections) > MAX_NUMBER_OF_TEXT_SECTIONS:
         log_info(scope, "Too many text sections, truncating...")
 
@@ -262,6 +249,7 @@ async def _evaluate_prompt(
 ):
     response = await get_completion_only(
         scope=scope,
+        priority="background",
         prompt=prompt.format(text=text),
         api_key=openai_api_key,
         **MODEL_KWARGS,
@@ -15,12 +15,15 @@
 import asyncio
 import logging
 
-from assistance import _ctx
+from assistance import _ctx, _tokens
 
 
 def main():
     _ctx.open_session()
 
+    # Before the loop starts, as loading can download the BPE ranks
+    _tokens.load_encodings()
+
     from assistance._faq import tasker as _faq_tasker
     from assistance._campaign import tasker as _campaign_tasker
 
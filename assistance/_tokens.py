@@ -0,0 +1,236 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Token budgets for prompts. When `tiktoken` is installed and its BPE
+# ranks are available (they are downloaded once, when the encodings are
+# loaded at startup, and then cached on disk within the records) tokens
+# are counted exactly. Otherwise, such as when offline on first run,
+# tokens are estimated from the same pre-tokenisation pattern that the cl100k BPE
+# uses. The estimate is biased towards over counting so that packed
+# prompts stay within the model limit. A failed load is retried in the
+# background, so that a passing network error does not leave the
+# process estimating for good.
+
+import logging
+import math
+import os
+import re
+import threading
+import time
+from typing import Any
+
+from assistance._config import SIMPLER_OPENAI_MODEL
+from assistance._paths import TIKTOKEN_CACHE
+
+MODEL_MAX_TOKENS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-4": 8192,
+    "text-embedding-ada-002": 8191,
+}
+
+DEFAULT_MODEL_MAX_TOKENS = 4096
+
+# Tokens used by the chat format around a single user message
+CHAT_MESSAGE_OVERHEAD = 8
+
+ESTIMATE_SAFETY_FACTOR = 1.1
+CHARACTERS_PER_WORD_TOKEN = 8
+
+# Seconds to wait before trying to load an encoding again after a failure
+ENCODING_RETRY_SECONDS = 5 * 60
+
+# The cl100k pre-tokenisation pattern, with the unicode classes that the
+# `re` module does not support swapped for their nearest equivalents.
+PRE_TOKEN_PATTERN = re.compile(
+    r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\w]?[^\W\d_]+|\d{1,3}| ?[^\s\w]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+)
+
+_encodings: dict[str, Any] = {}
+_next_load_attempts: dict[str, float] = {}
+_load_lock = threading.Lock()
+
+
+def count_tokens(text: str, model: str = SIMPLER_OPENAI_MODEL) -> int:
+    encoding = _get_encoding(model)
+
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    return _estimate_tokens(text)
+
+
+def get_model_max_tokens(model: str) -> int:
+    return MODEL_MAX_TOKENS.get(model, DEFAULT_MODEL_MAX_TOKENS)
+
+
+def get_remaining_tokens(prompt: str, max_tokens: int, model: str) -> int:
+    """The tokens left over for content once the prompt and reply fit."""
+    return (
+        get_model_max_tokens(model)
+        - CHAT_MESSAGE_OVERHEAD
+        - max_tokens
+        - count_tokens(prompt, model)
+    )
+
+
+def split_by_tokens(
+    text: str, chunk_tokens: int, overlap_tokens: int, model: str
+) -> list[str]:
+    """Split text into chunks of at most `chunk_tokens` tokens.
+
+    Each chunk after the first starts with the last `overlap_tokens`
+    tokens of the chunk before it.
+    """
+    if chunk_tokens <= overlap_tokens:
+        raise ValueError("Chunks need to be larger than their overlap")
+
+    encoding = _get_encoding(model)
+
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        piece_tokens = [1] * len(tokens)
+
+        # A multi-byte character can be spread over several byte-level
+        # tokens, so chunks only ever start at the token holding the
+        # first byte of a character, and are decoded whole.
+        def is_boundary(index: int) -> bool:
+            first_byte = encoding.decode_single_token_bytes(tokens[index])[0]
+            return first_byte & 0b1100_0000 != 0b1000_0000
+
+        def join(start: int, end: int) -> str:
+            return encoding.decode(tokens[start:end])
+
+    else:
+        pieces = PRE_TOKEN_PATTERN.findall(text)
+        piece_tokens = [_estimate_piece_tokens(piece) for piece in pieces]
+
+        # Leave the same headroom that `count_tokens` does
+        chunk_tokens = int(chunk_tokens / ESTIMATE_SAFETY_FACTOR)
+        overlap_tokens = int(overlap_tokens / ESTIMATE_SAFETY_FACTOR)
+
+        def is_boundary(index: int) -> bool:
+            return True
+
+        def join(start: int, end: int) -> str:
+            return "".join(pieces[start:end])
+
+    num_pieces = len(piece_tokens)
+    chunks = []
+    start = 0
+
+    while start < num_pieces:
+        end = start
+        used = 0
+
+        while end < num_pieces and (used + piece_tokens[end] <= chunk_tokens):
+            used += piece_tokens[end]
+            end += 1
+
+        while start + 1 < end < num_pieces and not is_boundary(end):
+            end -= 1
+
+        # A single piece larger than a whole chunk is given its own chunk
+        end = max(end, start + 1)
+        while end < num_pieces and not is_boundary(end):
+            end += 1
+
+        chunks.append(join(start, end))
+
+        if end == num_pieces:
+            break
+
+        overlap_start = end
+        overlap = 0
+        while overlap_start - 1 > start and (
+            overlap + piece_tokens[overlap_start - 1] <= overlap_tokens
+        ):
+            overlap_start -= 1
+            overlap += piece_tokens[overlap_start]
+
+        while overlap_start < end and not is_boundary(overlap_start):
+            overlap_start += 1
+
+        start = overlap_start
+
+    return chunks
+
+
+def load_encodings():
+    """Load the encoding of every known model ahead of time.
+
+    Loading can download the BPE ranks, so this is called at startup
+    (off of the event loop) rather than by the first count of tokens.
+    """
+    for model in MODEL_MAX_TOKENS:
+        _load_encoding(model)
+
+
+def _get_encoding(model: str):
+    try:
+        return _encodings[model]
+    except KeyError:
+        pass
+
+    # Never loaded on the caller's thread, which may be the event loop.
+    # Tokens are estimated until a background load succeeds.
+    with _load_lock:
+        if time.monotonic() >= _next_load_attempts.get(model, 0):
+            _next_load_attempts[model] = time.monotonic() + ENCODING_RETRY_SECONDS
+            threading.Thread(target=_load_encoding, args=(model,), daemon=True).start()
+
+    return None
+
+
+def _load_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        _next_load_attempts[model] = math.inf
+        return
+
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", str(TIKTOKEN_CACHE))
+
+    try:
+        _encodings[model] = tiktoken.encoding_for_model(model)
+    except Exception as e:  # pylint: disable = broad-except
+        logging.warning(f"Unable to load tiktoken encoding, estimating tokens: {e}")
+
+        with _load_lock:
+            _next_load_attempts[model] = time.monotonic() + ENCODING_RETRY_SECONDS
+
+
+def _estimate_tokens(text: str) -> int:
+    estimate = sum(
+        _estimate_piece_tokens(piece) for piece in PRE_TOKEN_PATTERN.findall(text)
+    )
+
+    return math.ceil(estimate * ESTIMATE_SAFETY_FACTOR)
+
+
+def _estimate_piece_tokens(piece: str) -> int:
+    stripped = piece.strip()
+
+    if not stripped:
+        return 1
+
+    if stripped[-1].isalpha():
+        # Common words are a single token, long or rare words get split
+        return math.ceil(len(stripped) / CHARACTERS_PER_WORD_TOKEN)
+
+    if stripped.isdigit():
+        return 1
+
+    # Runs of punctuation tend to merge in pairs
+    return math.ceil(len(stripped) / 2)
@@ -2,36 +2,28 @@
 # Attribution-ShareAlike 4.0 International License.
 # <http://creativecommons.org/licenses/by-sa/4.0/>.
 
-import logging
+from typing import Literal
 
-import aiofiles
-import aiohttp
 from bs4 import BeautifulSoup
 
-from assistance._logging import log_info
-from assistance._paths import get_article_metadata_path, get_downloaded_article_path
-from assistance._utilities import get_hash_digest
+HTMLParserName = Literal["html.parser", "lxml", "selectolax"]
 
 
 # https://stackoverflow.com/a/24618186
-async def scrape(session: aiohttp.ClientSession, url: str):
-    html = await _scrape_with_cache(session, url)
+def extract_text(html: bytes, parser: HTMLParserName = "html.parser") -> str:
+    if parser == "selectolax":
+        text = _get_text_with_selectolax(html)
+    else:
+        soup = BeautifulSoup(html, features=parser)
 
-    try:
-        html.decode(encoding="utf8")
-    except UnicodeDecodeError:
-        return "NOT_RELEVANT"
+        # log_info(soup)
 
-    soup = BeautifulSoup(html, features="html.parser")
+        # kill all script and style elements
+        for script in soup(["script", "style"]):
+            script.extract()  # rip it out
 
-    # log_info(soup)
-
-    # kill all script and style elements
-    for script in soup(["script", "style"]):
-        script.extract()  # rip it out
-
-    # get text
-    text = soup.get_text(separator="\n")
+        # get text
+        text = soup.get_text(separator="\n")
 
     # break into lines and remove leading and trailing space on each
     lines = (line.strip() for line in text.splitlines())
@@ -43,40 +35,15 @@ async def scrape(session: aiohttp.ClientSession, url: str):
     return text
 
 
-async def _scrape_with_cache(session: aiohttp.ClientSession, url: str):
-    url_hash_digest = get_hash_digest(url)
-    downloaded_article_path = get_downloaded_article_path(
-        url_hash_digest, create_parent=True
-    )
-
-    # TODO: Remove this
-    meta_data_path = get_article_metadata_path(url_hash_digest)
-
-    if meta_data_path.exists():
-        meta_data_path.rename(downloaded_article_path)
-    # Down to here
-
-    if downloaded_article_path.exists():
-        logging.info(f"Using cached version of {url}")
-
-        async with aiofiles.open(downloaded_article_path, "rb") as f:
-            cached_results = await f.read()
-
-        if b"Error 404" not in cached_results:
-            return cached_results
-
-    logging.info(f"Downloading {url}")
-
-    results = await session.get(url=url)
-    url_results = await results.read()
+def _get_text_with_selectolax(html: bytes) -> str:
+    from selectolax.parser import HTMLParser
 
-    if b"Our systems have detected unusual traffic" in url_results:
-        raise ValueError(url_results)
+    tree = HTMLParser(html)
 
-    async with aiofiles.open(downloaded_article_path, "wb") as f:
-        await f.write(url_results)
+    for node in tree.css("script, style"):
+        node.decompose()
 
-    if b"Error 404" not in url_results:
-        return url_results
+    if tree.root is None:
+        return ""
 
-    return b"NOT_RELEVANT"
+    return tree.root.text(separator="\n")
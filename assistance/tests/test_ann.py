@@ -0,0 +1,117 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import numpy as np
+
+from assistance import _embedding_store
+from assistance._ann import IVFIndex
+from assistance._similarity import top_k_embeddings
+
+
+def _clustered(rng, topics, size):
+    assignments = rng.integers(0, len(topics), size=size)
+    noise = rng.normal(scale=0.5, size=(size, topics.shape[1]))
+
+    return (topics[assignments] + noise).astype(np.float32)
+
+
+def test_ivf_search_matches_exact_search(tmp_path):
+    rng = np.random.default_rng(0)
+    topics = rng.normal(size=(20, 32))
+
+    embeddings = _clustered(rng, topics, 2000)
+    queries = _clustered(rng, topics, 20)
+
+    index = IVFIndex.build(embeddings)
+    index.save(tmp_path / "ivf.npz")
+    index = IVFIndex.load(tmp_path / "ivf.npz")
+
+    exact_indices, exact_scores = top_k_embeddings(queries, embeddings, 3)
+    ivf_indices, ivf_scores = top_k_embeddings(queries, embeddings, 3, index=index)
+
+    matches = sum(
+        len(set(exact) & set(approximate))
+        for exact, approximate in zip(exact_indices, ivf_indices)
+    )
+    assert matches / (3 * len(queries)) >= 0.9
+
+    assert np.allclose(exact_scores[0][0], ivf_scores[0][0], atol=1e-5)
+
+
+def test_stored_index_is_built_once(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    rows = {str(i): rng.normal(size=8).tolist() for i in range(64)}
+
+    async def mock_get_embedding(block, api_key):
+        return rows[block]
+
+    monkeypatch.setattr(_embedding_store, "EMBEDDING_STORE", tmp_path)
+    monkeypatch.setattr(_embedding_store, "get_embedding", mock_get_embedding)
+    monkeypatch.setattr(_embedding_store, "_loaded_stores", {})
+    monkeypatch.setattr(_embedding_store, "_loaded_indexes", {})
+    monkeypatch.setattr(_embedding_store, "MIN_ROWS_FOR_INDEX", 32)
+
+    async def get_index():
+        _matrix, index = await _embedding_store.get_stored_embeddings_and_index(
+            "key", "test", tuple(rows)
+        )
+        return index
+
+    index = asyncio.run(get_index())
+    assert index is not None
+    assert len(list((tmp_path / "test").glob("ivf-*.npz"))) == 1
+
+    # A fresh process loads the saved index rather than building one
+    monkeypatch.setattr(_embedding_store, "_loaded_stores", {})
+    monkeypatch.setattr(_embedding_store, "_loaded_indexes", {})
+
+    def fail_to_build(*args, **kwargs):
+        raise AssertionError("The saved index should have been loaded")
+
+    monkeypatch.setattr(IVFIndex, "build", fail_to_build)
+
+    reloaded = asyncio.run(get_index())
+    assert np.array_equal(reloaded.centroids, index.centroids)
+
+
+def test_index_belongs_to_the_returned_matrix(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    rows = {str(i): rng.normal(size=8).tolist() for i in range(96)}
+
+    async def mock_get_embedding(block, api_key):
+        return rows[block]
+
+    monkeypatch.setattr(_embedding_store, "EMBEDDING_STORE", tmp_path)
+    monkeypatch.setattr(_embedding_store, "get_embedding", mock_get_embedding)
+    monkeypatch.setattr(_embedding_store, "_loaded_stores", {})
+    monkeypatch.setattr(_embedding_store, "_loaded_indexes", {})
+    monkeypatch.setattr(_embedding_store, "MIN_ROWS_FOR_INDEX", 32)
+
+    blocks = tuple(rows)
+
+    async def run():
+        # The store is rebuilt for fewer blocks while the larger one is
+        # still being searched.
+        return await asyncio.gather(
+            _embedding_store.get_stored_embeddings_and_index("key", "test", blocks),
+            _embedding_store.get_stored_embeddings_and_index(
+                "key", "test", blocks[:48]
+            ),
+        )
+
+    for matrix, index in asyncio.run(run()):
+        assert index is not None
+        assert len(index.order) == len(matrix)
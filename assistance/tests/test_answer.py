@@ -0,0 +1,151 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+
+from assistance import _metrics
+from assistance._faq import answer
+
+FAQ_DATA = {"name": "test", "hash": "a", "items": []}
+
+QUESTION = {
+    "question": "How much are the fees?",
+    "context": "",
+    "answer": "",
+    "answer_again": False,
+}
+
+
+def _rank_response(passes):
+    checks = {
+        key: expected if passes else not expected
+        for key, expected in answer.VALIDATION_CHECKS.items()
+    }
+
+    return json.dumps({**checks, "id of the best answer": 0})
+
+
+def _mock_api(monkeypatch, candidates, rank_passes):
+    calls = {"stream": 0, "rank": 0}
+    stored = []
+
+    async def mock_get_cached_answer(scope, openai_api_key, faq_data, question):
+        return None
+
+    async def mock_get_sub_questions(scope, openai_api_key, question, context):
+        return [question]
+
+    async def mock_get_top_questions_and_answers(openai_api_key, faq_data, queries):
+        return ["Question: How much are the fees?\nAnswer: $100"]
+
+    async def mock_stream_completion_only(scope, prompt, api_key, **kwargs):
+        calls["stream"] += 1
+        async for delta in candidates(calls["stream"]):
+            yield delta
+
+    async def mock_get_completion_only(scope, prompt, api_key, **kwargs):
+        calls["rank"] += 1
+        return _rank_response(rank_passes[calls["rank"] - 1])
+
+    async def mock_store_validated_answer(openai_api_key, faq_data, question, answer):
+        stored.append(answer)
+
+    for name, mock in [
+        ("get_cached_answer", mock_get_cached_answer),
+        ("get_sub_questions", mock_get_sub_questions),
+        ("get_top_questions_and_answers", mock_get_top_questions_and_answers),
+        ("stream_completion_only", mock_stream_completion_only),
+        ("get_completion_only", mock_get_completion_only),
+        ("store_validated_answer", mock_store_validated_answer),
+    ]:
+        monkeypatch.setattr(answer, name, mock)
+
+    monkeypatch.setattr(_metrics, "_observations", {})
+
+    return calls, stored
+
+
+async def _candidate(number):
+    yield f"Candidate {number}"
+
+
+def _write_answer():
+    return asyncio.run(
+        answer.write_answer(
+            scope=None, faq_data=FAQ_DATA, question_and_context=QUESTION
+        )
+    )
+
+
+def _candidates_per_question():
+    return _metrics.get_observations()["faq.answer.candidates_per_question"]
+
+
+def test_validated_initial_candidates_are_used(monkeypatch):
+    calls, stored = _mock_api(monkeypatch, _candidate, rank_passes=[True])
+
+    assert _write_answer() == "Candidate 1"
+
+    assert calls == {"stream": answer.INITIAL_NUM_CANDIDATES, "rank": 1}
+    assert stored == ["Candidate 1"]
+    assert _candidates_per_question()["max"] == answer.INITIAL_NUM_CANDIDATES
+
+
+def test_candidates_are_added_only_after_failed_validation(monkeypatch):
+    calls, stored = _mock_api(monkeypatch, _candidate, rank_passes=[False] * 10)
+
+    assert _write_answer() == ""
+
+    # Two, then four, then capped at five
+    assert answer.INITIAL_NUM_CANDIDATES == answer.ADDITIONAL_NUM_CANDIDATES == 2
+    assert calls == {"stream": answer.MAX_NUM_CANDIDATES, "rank": 3}
+    assert stored == []
+    assert _candidates_per_question()["max"] == answer.MAX_NUM_CANDIDATES
+
+
+def test_an_empty_candidate_closes_the_other_streams(monkeypatch):
+    closed = []
+
+    async def candidates(number):
+        if number == 1:
+            yield ""
+            return
+
+        try:
+            yield "An answer that"
+            await asyncio.sleep(10)
+            yield " never finishes"
+        finally:
+            closed.append(number)
+
+    calls, stored = _mock_api(monkeypatch, candidates, rank_passes=[])
+
+    async def run():
+        result = await answer.write_answer(
+            scope=None, faq_data=FAQ_DATA, question_and_context=QUESTION
+        )
+
+        # Let the cancelled stream wind down, before asyncio.run would
+        # cancel it anyway on its way out
+        await asyncio.sleep(0.01)
+
+        return result, list(closed)
+
+    result, closed_before_exit = asyncio.run(asyncio.wait_for(run(), timeout=5))
+
+    assert result == ""
+    assert closed_before_exit == [2]
+    assert calls == {"stream": answer.INITIAL_NUM_CANDIDATES, "rank": 0}
+    assert stored == []
@@ -0,0 +1,136 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+
+from assistance import _embedding_store, _metrics, _paths
+from assistance._faq import answer_cache
+
+EMBEDDINGS = {
+    "How much are the fees?": [1.0, 0.0, 0.0],
+    "How much are the fees for the program?": [0.99, 0.05, 0.0],
+    "When does the program start?": [0.0, 1.0, 0.0],
+}
+
+
+def _mock(tmp_path, monkeypatch):
+    async def mock_get_embedding(block, api_key):
+        return EMBEDDINGS[block]
+
+    monkeypatch.setattr(_paths, "ANSWER_CACHE", tmp_path / "answers")
+    monkeypatch.setattr(_embedding_store, "EMBEDDING_STORE", tmp_path / "store")
+    monkeypatch.setattr(_embedding_store, "_loaded_stores", {})
+    monkeypatch.setattr(_embedding_store, "get_embedding", mock_get_embedding)
+    monkeypatch.setattr(answer_cache, "get_embedding", mock_get_embedding)
+
+
+def _lookup(faq_data, question):
+    return asyncio.run(
+        answer_cache.get_cached_answer(
+            scope=None,
+            openai_api_key="key",
+            faq_data=faq_data,
+            question=question,
+        )
+    )
+
+
+def _store(faq_data, question, answer):
+    asyncio.run(
+        answer_cache.store_validated_answer(
+            openai_api_key="key",
+            faq_data=faq_data,
+            question=question,
+            answer=answer,
+        )
+    )
+
+
+def test_similar_questions_reuse_validated_answers(tmp_path, monkeypatch):
+    _mock(tmp_path, monkeypatch)
+    faq_data = {"name": "test", "hash": "a", "items": []}
+
+    assert _lookup(faq_data, "How much are the fees?") is None
+
+    _store(faq_data, "How much are the fees?", "$100")
+
+    hits_before = _metrics.get_counters().get("faq.answer_cache.hit", 0)
+
+    assert _lookup(faq_data, "How much are the fees for the program?") == "$100"
+    assert _lookup(faq_data, "When does the program start?") is None
+
+    assert _metrics.get_counters()["faq.answer_cache.hit"] == hits_before + 1
+
+
+def test_changing_the_faq_invalidates_answers(tmp_path, monkeypatch):
+    _mock(tmp_path, monkeypatch)
+    faq_data = {"name": "test", "hash": "a", "items": []}
+
+    _store(faq_data, "How much are the fees?", "$100")
+    assert _lookup(faq_data, "How much are the fees?") == "$100"
+
+    edited_faq_data = {**faq_data, "hash": "b"}
+    assert _lookup(edited_faq_data, "How much are the fees?") is None
+
+
+def test_answers_are_reused_across_emails(tmp_path, monkeypatch):
+    _mock(tmp_path, monkeypatch)
+    faq_data = {"name": "test", "hash": "a", "items": []}
+
+    # Entries from before contexts were dropped from the cache still match
+    _paths.ANSWER_CACHE.mkdir(parents=True)
+    (_paths.ANSWER_CACHE / "test.json").write_text(
+        json.dumps(
+            {
+                "faq_hash": "a",
+                "entries": [
+                    {
+                        "question": "How much are the fees?",
+                        "context_hash": "of another email",
+                        "answer": "$100",
+                    }
+                ],
+            }
+        )
+    )
+    _store(faq_data, "When does the program start?", "May")
+
+    assert _lookup(faq_data, "How much are the fees for the program?") == "$100"
+    assert _lookup(faq_data, "When does the program start?") == "May"
+
+
+def test_the_store_is_rebuilt_once_per_batch(tmp_path, monkeypatch):
+    _mock(tmp_path, monkeypatch)
+    monkeypatch.setattr(answer_cache, "STORE_BATCH_SIZE", 2)
+    faq_data = {"name": "test", "hash": "a", "items": []}
+
+    saves = []
+    save_store = _embedding_store._save_store
+
+    def mock_save_store(store_name, hashes, matrix):
+        saves.append(len(hashes))
+        save_store(store_name, hashes, matrix)
+
+    monkeypatch.setattr(_embedding_store, "_save_store", mock_save_store)
+
+    for question, answer in [
+        ("How much are the fees?", "$100"),
+        ("When does the program start?", "May"),
+        ("How much are the fees for the program?", "$200"),
+    ]:
+        _store(faq_data, question, answer)
+        assert _lookup(faq_data, question) == answer
+
+    assert saves == [2]
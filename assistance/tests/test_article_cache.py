@@ -0,0 +1,293 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import collections
+import json
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from assistance import _article_cache, _cpu, _paths, _scraper
+from assistance._paths import TESTS_DATA
+from assistance._utilities import get_hash_digest
+from assistance._vendor.stackoverflow.web_scraping import extract_text
+
+ETAG = '"v1"'
+
+ARTICLE_HTML = (TESTS_DATA / "article-example.html").read_bytes()
+
+HTML_PARSER_MODULES = {"html.parser": None, "lxml": "lxml", "selectolax": "selectolax"}
+
+
+class StandInNewsHost:
+    def __init__(self):
+        self.requests: collections.Counter[str] = collections.Counter()
+        self.not_modified = 0
+        self.down = False
+
+        app = web.Application()
+        app.router.add_get("/article", self.article)
+        app.router.add_get("/missing", self.missing)
+        app.router.add_get("/soft-missing", self.soft_missing)
+        app.router.add_get("/blocked", self.blocked)
+
+        self.server = TestServer(app)
+
+    async def __aenter__(self):
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *args):
+        await _scraper.close_session()
+        await self.server.close()
+
+    def url(self, path: str) -> str:
+        return str(self.server.make_url(path))
+
+    async def article(self, request: web.Request):
+        self.requests[request.path] += 1
+
+        if self.down:
+            return web.Response(status=500)
+
+        if request.headers.get("If-None-Match") == ETAG:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": ETAG})
+
+        return web.Response(text="<p>The article</p>", headers={"ETag": ETAG})
+
+    async def missing(self, request: web.Request):
+        self.requests[request.path] += 1
+        return web.Response(status=404)
+
+    async def soft_missing(self, request: web.Request):
+        self.requests[request.path] += 1
+        return web.Response(text="<h1>Error 404</h1> This page could not be found")
+
+    async def blocked(self, request: web.Request):
+        self.requests[request.path] += 1
+        return web.Response(text="Our systems have detected unusual traffic")
+
+
+@pytest.fixture(autouse=True)
+def article_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(_paths, "DOWNLOADED_ARTICLES", tmp_path / "articles")
+    monkeypatch.setattr(_paths, "DOWNLOADED_ARTICLE_METADATA", tmp_path / "metadata")
+    monkeypatch.setattr(_paths, "EXTRACTED_ARTICLE_TEXT", tmp_path / "text")
+    monkeypatch.setattr(_article_cache, "_text_memory_tier", {})
+    monkeypatch.setattr(_scraper, "_session", None)
+    monkeypatch.setattr(
+        _scraper,
+        "_host_semaphores",
+        collections.defaultdict(lambda: asyncio.Semaphore(2)),
+    )
+    monkeypatch.setattr(_scraper, "MAX_ATTEMPTS", 1)
+
+    # Parsed inline, so that the parser can be watched
+    monkeypatch.setattr(_cpu, "get_cpu_workers", lambda: 0)
+    monkeypatch.setattr(_cpu, "_executor", None)
+
+
+def _load_metadata(url):
+    path = _paths.get_downloaded_article_metadata_path(get_hash_digest(url))
+
+    with open(path, encoding="utf8") as f:
+        return json.load(f)
+
+
+def _save_metadata(url, metadata):
+    path = _paths.get_downloaded_article_metadata_path(get_hash_digest(url))
+
+    with open(path, "w", encoding="utf8") as f:
+        json.dump(metadata, f)
+
+
+def test_articles_are_revalidated_after_their_ttl(monkeypatch):
+    async def run():
+        async with StandInNewsHost() as host:
+            url = host.url("/article")
+
+            first = await _article_cache.get_article(url)
+            cached = await _article_cache.get_article(url)
+            assert host.requests["/article"] == 1
+
+            monkeypatch.setattr(_article_cache, "ARTICLE_TTL_SECONDS", 0)
+            revalidated = await _article_cache.get_article(url)
+
+            host.down = True
+            stale = await _article_cache.get_article(url)
+
+        return host, url, [first, cached, revalidated, stale]
+
+    host, url, bodies = asyncio.run(run())
+
+    assert bodies == [b"<p>The article</p>"] * 4
+    assert host.requests["/article"] == 3
+    assert host.not_modified == 1
+
+    metadata = _load_metadata(url)
+    assert metadata["status"] == 200
+    assert metadata["etag"] == ETAG
+    assert metadata["failure"]["count"] == 1
+
+
+def test_missing_articles_back_off():
+    async def run():
+        async with StandInNewsHost() as host:
+            url = host.url("/missing")
+
+            bodies = [
+                await _article_cache.get_article(url),
+                await _article_cache.get_article(url),
+            ]
+            assert host.requests["/missing"] == 1
+
+            # Once the backoff has passed the url is tried again
+            metadata = _load_metadata(url)
+            metadata["failure"]["retry_at"] = 0
+            _save_metadata(url, metadata)
+
+            bodies.append(await _article_cache.get_article(url))
+
+        return host, url, bodies
+
+    host, url, bodies = asyncio.run(run())
+
+    assert bodies == [_article_cache.NOT_RELEVANT] * 3
+    assert host.requests["/missing"] == 2
+
+    failure = _load_metadata(url)["failure"]
+    assert failure["kind"] == "not_found"
+    assert failure["count"] == 2
+
+    # The backoff doubles with each consecutive failure
+    backoff = failure["retry_at"] - time.time()
+    assert _article_cache.FAILURE_BACKOFF_SECONDS < backoff
+    assert backoff <= 2 * _article_cache.FAILURE_BACKOFF_SECONDS
+
+
+def test_error_pages_served_as_found_are_not_cached():
+    async def run():
+        async with StandInNewsHost() as host:
+            url = host.url("/soft-missing")
+
+            bodies = [
+                await _article_cache.get_article(url),
+                await _article_cache.get_article(url),
+            ]
+
+        return host, url, bodies
+
+    host, url, bodies = asyncio.run(run())
+
+    assert bodies == [_article_cache.NOT_RELEVANT] * 2
+    assert host.requests["/soft-missing"] == 1
+
+    metadata = _load_metadata(url)
+    assert metadata["failure"]["kind"] == "not_found"
+    assert metadata["fetched_at"] is None
+
+
+def test_blocked_downloads_are_not_retried_while_backing_off():
+    async def run():
+        async with StandInNewsHost() as host:
+            url = host.url("/blocked")
+
+            for _ in range(3):
+                with pytest.raises(ValueError, match="Unusual traffic"):
+                    await _article_cache.get_article(url)
+
+        return host
+
+    host = asyncio.run(run())
+
+    assert host.requests["/blocked"] == 1
+
+
+def test_concurrent_requests_share_one_download():
+    async def run():
+        async with StandInNewsHost() as host:
+            url = host.url("/article")
+
+            bodies = await asyncio.gather(
+                *[_article_cache.get_article(url) for _ in range(5)]
+            )
+
+        return host, bodies
+
+    host, bodies = asyncio.run(run())
+
+    assert len(set(bodies)) == 1
+    assert host.requests["/article"] == 1
+
+
+@pytest.mark.parametrize("parser", HTML_PARSER_MODULES.keys())
+def test_extracted_text_drops_scripts_styles_and_blank_lines(parser):
+    module = HTML_PARSER_MODULES[parser]
+    if module is not None:
+        pytest.importorskip(module)
+
+    text = extract_text(ARTICLE_HTML, parser)
+
+    assert "Universities expand pathway programs" in text
+    assert "gtag" not in text
+    assert "font-family" not in text
+    assert "" not in text.splitlines()
+
+
+def test_article_text_is_extracted_once(monkeypatch):
+    calls = []
+
+    def counting_extract_text(html, parser):
+        calls.append(parser)
+        return extract_text(html, parser)
+
+    monkeypatch.setattr(_article_cache, "extract_text", counting_extract_text)
+
+    async def run():
+        texts = [
+            await _article_cache.get_article_text(ARTICLE_HTML, "html.parser"),
+            await _article_cache.get_article_text(ARTICLE_HTML, "html.parser"),
+        ]
+
+        # Still extracted once when only the on-disk records remain
+        monkeypatch.setattr(_article_cache, "_text_memory_tier", {})
+        texts.append(await _article_cache.get_article_text(ARTICLE_HTML, "html.parser"))
+
+        return texts
+
+    texts = asyncio.run(run())
+
+    assert len(set(texts)) == 1
+    assert calls == ["html.parser"]
+
+
+def test_changing_the_extraction_mode_extracts_again(monkeypatch):
+    async def run():
+        main_content = await _article_cache.get_article_text(
+            ARTICLE_HTML, "html.parser"
+        )
+
+        monkeypatch.setattr(_article_cache, "MAIN_CONTENT_ONLY", False)
+        whole_page = await _article_cache.get_article_text(ARTICLE_HTML, "html.parser")
+
+        return main_content, whole_page
+
+    main_content, whole_page = asyncio.run(run())
+
+    assert main_content != whole_page
+    assert whole_page == extract_text(ARTICLE_HTML, "html.parser")
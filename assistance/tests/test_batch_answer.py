@@ -0,0 +1,136 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+
+from assistance._faq import batch_answer
+
+FAQ_DATA = {"name": "test", "hash": "a", "items": []}
+
+FEES = {"question": "How much are the fees?", "answer": "$100"}
+START = {"question": "When does it start?", "answer": "In May"}
+
+
+def _question(question):
+    return {"question": question, "context": "", "answer": "", "answer_again": False}
+
+
+def _reply(*items):
+    return json.dumps(
+        [
+            {"id": question_id, "answer": answer, batch_answer.ANSWERED_KEY: answered}
+            for question_id, answer, answered in items
+        ]
+    )
+
+
+def _write_batch(monkeypatch, response, num_questions=2):
+    async def mock_get_completion_only(scope, prompt, api_key, **kwargs):
+        return response
+
+    monkeypatch.setattr(batch_answer, "get_completion_only", mock_get_completion_only)
+
+    return asyncio.run(
+        batch_answer._write_batch_of_answers(
+            scope=None,
+            questions_and_contexts=[
+                _question(f"Question {i}") for i in range(num_questions)
+            ],
+            faq_items=[[FEES]] * num_questions,
+        )
+    )
+
+
+def test_batch_replies_are_parsed_per_question(monkeypatch):
+    response = _reply((0, " $100 a year ", True), (1, "Not sure", False))
+
+    assert _write_batch(monkeypatch, response) == ["$100 a year", None]
+
+
+def test_non_string_answers_fall_back_to_that_question(monkeypatch):
+    response = _reply((0, None, True), (1, "$100", True))
+
+    assert _write_batch(monkeypatch, response) == [None, "$100"]
+
+
+def test_malformed_batch_replies_fall_back_to_every_question(monkeypatch):
+    for response in [
+        "[{",
+        json.dumps({"id": 0}),
+        json.dumps([{"id": 0, "answer": "$100"}]),
+        _reply((5, "$100", True)),
+    ]:
+        assert _write_batch(monkeypatch, response) == [None, None]
+
+
+def test_shared_faq_items_are_listed_once():
+    faq_responses, questions = batch_answer._get_prompt_sections(
+        [_question("What are the fees?"), _question("When can I start?")],
+        [[FEES, START], [START, {**FEES, "answer": " $100 "}]],
+    )
+
+    assert faq_responses.count("How much are the fees?") == 1
+    assert faq_responses.count("When does it start?") == 1
+    assert "Relevant FAQ responses: 0, 1" in questions
+    assert "Relevant FAQ responses: 1, 0" in questions
+
+
+def test_write_answers_falls_back_for_unanswered_questions(monkeypatch):
+    questions = [_question(f"Question {i}") for i in range(6)]
+    prompts = []
+    stored = []
+    fallbacks = []
+
+    async def mock_get_cached_answer(scope, openai_api_key, faq_data, question):
+        return "Cached" if question == "Question 0" else None
+
+    async def mock_get_top_faq_items(openai_api_key, faq_data, queries, k):
+        return [[FEES] for _ in queries]
+
+    async def mock_get_completion_only(scope, prompt, api_key, **kwargs):
+        prompts.append(prompt)
+
+        # Only the first question within each prompt is answered
+        return _reply((0, f"Answer {len(prompts)}", True))
+
+    async def mock_store_validated_answer(openai_api_key, faq_data, question, answer):
+        stored.append(question)
+
+    async def mock_write_answer(scope, faq_data, question_and_context):
+        fallbacks.append(question_and_context["question"])
+        return f"Fallback for {question_and_context['question']}"
+
+    for name, mock in [
+        ("get_cached_answer", mock_get_cached_answer),
+        ("get_top_faq_items", mock_get_top_faq_items),
+        ("get_completion_only", mock_get_completion_only),
+        ("store_validated_answer", mock_store_validated_answer),
+        ("write_answer", mock_write_answer),
+    ]:
+        monkeypatch.setattr(batch_answer, name, mock)
+
+    answers = asyncio.run(
+        batch_answer.write_answers(
+            scope=None, faq_data=FAQ_DATA, questions_and_contexts=questions
+        )
+    )
+
+    # The five uncached questions fit within two prompts
+    assert len(prompts) == 2
+    assert answers[0] == "Cached"
+    assert sorted(answers[i] for i in (1, 5)) == ["Answer 1", "Answer 2"]
+    assert sorted(stored) == ["Question 1", "Question 5"]
+    assert fallbacks == ["Question 2", "Question 3", "Question 4"]
+    assert answers[2:5] == [f"Fallback for Question {i}" for i in (2, 3, 4)]
@@ -0,0 +1,141 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import json
+import shutil
+
+import numpy as np
+
+from assistance import _completion_cache, _metrics, _paths
+
+
+def test_memory_tier_serves_hits_without_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(_paths, "COMPLETION_CACHE", tmp_path)
+    monkeypatch.setattr(
+        _completion_cache,
+        "_memory_tier",
+        _completion_cache.create_memory_tier("lru", max_bytes=2**20),
+    )
+
+    response = {"choices": [{"message": {"content": "Hello"}}]}
+
+    asyncio.run(_completion_cache.store_cached_response("a" * 56, response))
+    shutil.rmtree(tmp_path)
+
+    assert asyncio.run(_completion_cache.get_cached_response("a" * 56)) == response
+    assert asyncio.run(_completion_cache.get_cached_response("b" * 56)) is None
+
+
+def test_memory_tier_hits_are_copies(tmp_path, monkeypatch):
+    monkeypatch.setattr(_paths, "COMPLETION_CACHE", tmp_path)
+    monkeypatch.setattr(
+        _completion_cache,
+        "_memory_tier",
+        _completion_cache.create_memory_tier("lru", max_bytes=2**20),
+    )
+
+    response = {"choices": [{"message": {"content": "Hello"}}]}
+    asyncio.run(_completion_cache.store_cached_response("a" * 56, response))
+
+    first = asyncio.run(_completion_cache.get_cached_response("a" * 56))
+    first["choices"][0]["message"]["content"] = "Altered"
+
+    second = asyncio.run(_completion_cache.get_cached_response("a" * 56))
+    assert second == response
+
+    asyncio.run(
+        _completion_cache.store_cached_embedding("e" * 56, np.array([1.0, 2.0]))
+    )
+    embedding = asyncio.run(_completion_cache.get_cached_embedding("e" * 56))
+    assert not embedding.flags.writeable
+
+
+def test_memory_tier_evicts_by_size():
+    memory_tier = _completion_cache.create_memory_tier("lru", max_bytes=150)
+    evictions_before = _metrics.get_counters().get(
+        "completion_cache.memory.evictions", 0
+    )
+
+    # Sized by the memory the bytes take up, not only their length
+    memory_tier["first"] = b"x" * 60
+    memory_tier["second"] = b"y" * 60
+
+    assert "first" not in memory_tier
+    assert "second" in memory_tier
+
+    evictions = _metrics.get_counters()["completion_cache.memory.evictions"]
+    assert evictions - evictions_before == 1
+
+
+def test_migrate_files_to_sqlite(tmp_path):
+    files_root = tmp_path / "completion-cache"
+    files_store = _completion_cache.FilesDiskStore(files_root)
+    sqlite_store = _completion_cache.SQLiteDiskStore(tmp_path / "cache.sqlite3")
+
+    responses = {
+        f"{i:056x}": {"choices": [{"message": {"content": f"Answer {i}"}}]}
+        for i in range(4)
+    }
+    responses["e" * 56] = {"data": [{"embedding": [1, 0.5]}]}
+
+    async def fill_files_store():
+        for hash_digest, response in responses.items():
+            await files_store.put(hash_digest, json.dumps(response, indent=2).encode())
+
+    asyncio.run(fill_files_store())
+
+    assert _completion_cache.migrate_files_to_sqlite(files_root, sqlite_store) == 5
+    assert _completion_cache.migrate_files_to_sqlite(files_root, sqlite_store) == 0
+
+    for hash_digest, response in list(responses.items())[:4]:
+        assert json.loads(asyncio.run(sqlite_store.get(hash_digest))) == response
+
+    embedding_data = asyncio.run(sqlite_store.get("e" * 56))
+    assert _completion_cache.decode_embedding(embedding_data).tolist() == [1, 0.5]
+
+    assert asyncio.run(sqlite_store.get("f" * 56)) is None
+
+    sqlite_store.close()
+
+
+def test_legacy_json_embeddings_are_rewritten_as_binary(tmp_path, monkeypatch):
+    monkeypatch.setattr(_paths, "COMPLETION_CACHE", tmp_path)
+    monkeypatch.setattr(
+        _completion_cache,
+        "_memory_tier",
+        _completion_cache.create_memory_tier("lru", max_bytes=2**20),
+    )
+
+    hash_digest = "c" * 56
+    legacy_response = {
+        "object": "list",
+        "data": [{"object": "embedding", "index": 0, "embedding": [0.25, -1.5, 3]}],
+        "model": "text-embedding-ada-002",
+    }
+
+    path = _paths.get_completion_cache_path(hash_digest, create_parent=True)
+    path.write_text(json.dumps(legacy_response, indent=2))
+
+    embedding = asyncio.run(_completion_cache.get_cached_embedding(hash_digest))
+    assert embedding.dtype == np.float32
+    assert embedding.tolist() == [0.25, -1.5, 3]
+
+    assert not path.exists()
+
+    binary_path = _paths.get_completion_cache_path(hash_digest, suffix=".bin")
+    data = binary_path.read_bytes()
+    assert len(data) == _completion_cache.EMBEDDING_HEADER.size + 3 * 4
+    assert _completion_cache.decode_embedding(data).tolist() == [0.25, -1.5, 3]
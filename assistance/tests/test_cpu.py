@@ -0,0 +1,57 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+
+import pytest
+
+from assistance import _cpu
+from assistance._parsing.googlealerts import parse_alerts
+from assistance._paths import TESTS_DATA
+
+ALERTS_HTML = (TESTS_DATA / "google-alert-example.html").read_text()
+
+
+@pytest.fixture
+def cpu_workers(monkeypatch):
+    def use_workers(num_workers):
+        monkeypatch.setattr(_cpu, "get_cpu_workers", lambda: num_workers)
+
+    monkeypatch.setattr(_cpu, "_executor", None)
+    yield use_workers
+
+    _cpu.shutdown()
+
+
+def test_parsing_runs_on_a_worker_process(cpu_workers):
+    cpu_workers(1)
+
+    async def run():
+        return await asyncio.gather(
+            _cpu.run_cpu_bound(parse_alerts, ALERTS_HTML),
+            _cpu.run_cpu_bound(os.getpid),
+        )
+
+    article_details, worker_pid = asyncio.run(run())
+
+    assert article_details == parse_alerts(ALERTS_HTML)
+    assert worker_pid != os.getpid()
+
+
+def test_no_workers_runs_inline(cpu_workers):
+    cpu_workers(0)
+
+    assert asyncio.run(_cpu.run_cpu_bound(os.getpid)) == os.getpid()
+    assert _cpu._executor is None
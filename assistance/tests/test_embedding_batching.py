@@ -0,0 +1,93 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import numpy as np
+import openai
+from aiohttp import web
+
+from assistance import _openai, _paths
+
+NUMBER_OF_BLOCKS = 300
+
+
+async def _run_with_stub_server(coroutine_function):
+    received_inputs = []
+
+    async def embeddings(request: web.Request):
+        data = await request.json()
+        received_inputs.append(data["input"])
+
+        return web.json_response(
+            {
+                "object": "list",
+                "model": data["model"],
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": [len(block), i]}
+                    for i, block in enumerate(data["input"])
+                ],
+            }
+        )
+
+    app = web.Application()
+    app.router.add_post("/v1/embeddings", embeddings)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+
+    port = runner.addresses[0][1]
+    openai.api_base = f"http://127.0.0.1:{port}/v1"
+
+    try:
+        return await coroutine_function(), received_inputs
+    finally:
+        await runner.cleanup()
+
+
+def test_concurrent_embeddings_are_batched(tmp_path, monkeypatch):
+    monkeypatch.setattr(_paths, "COMPLETION_CACHE", tmp_path)
+    monkeypatch.setattr(openai, "api_base", openai.api_base)
+
+    blocks = [f"block {'x' * i}" for i in range(NUMBER_OF_BLOCKS)]
+
+    async def get_all_embeddings():
+        embeddings = await asyncio.gather(
+            *[_openai.get_embedding(block, api_key="stub") for block in blocks]
+        )
+
+        # Let the cache writes complete
+        await asyncio.sleep(0.1)
+
+        return embeddings
+
+    embeddings, received_inputs = asyncio.run(_run_with_stub_server(get_all_embeddings))
+
+    assert len(received_inputs) == 2
+    assert [len(item) for item in received_inputs] == [
+        _openai.EMBEDDING_MAX_BATCH_SIZE,
+        NUMBER_OF_BLOCKS - _openai.EMBEDDING_MAX_BATCH_SIZE,
+    ]
+    assert [embedding[0] for embedding in embeddings] == [len(b) for b in blocks]
+
+    assert len(list(tmp_path.glob("*/*/*.bin"))) == NUMBER_OF_BLOCKS
+
+    cached_embeddings, received_inputs = asyncio.run(
+        _run_with_stub_server(get_all_embeddings)
+    )
+
+    assert len(received_inputs) == 0
+    assert np.array_equal(cached_embeddings, embeddings)
@@ -0,0 +1,127 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import numpy as np
+
+from assistance import _embedding_store
+from assistance._similarity import top_k_embeddings
+
+
+def _unit(rows):
+    rows = np.array(rows, dtype=np.float32)
+
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def test_only_new_blocks_are_embedded(tmp_path, monkeypatch):
+    embedded_blocks = []
+
+    async def mock_get_embedding(block, api_key):
+        embedded_blocks.append(block)
+        return [float(len(block)), 1.0]
+
+    monkeypatch.setattr(_embedding_store, "EMBEDDING_STORE", tmp_path)
+    monkeypatch.setattr(_embedding_store, "get_embedding", mock_get_embedding)
+    monkeypatch.setattr(_embedding_store, "_loaded_stores", {})
+
+    first = asyncio.run(
+        _embedding_store.get_stored_embeddings("key", "faq-test", ("a", "bb"))
+    )
+    assert embedded_blocks == ["a", "bb"]
+    assert np.allclose(first, _unit([[1, 1], [2, 1]]))
+
+    # A fresh process only has the files on disk to go by
+    monkeypatch.setattr(_embedding_store, "_loaded_stores", {})
+
+    second = asyncio.run(
+        _embedding_store.get_stored_embeddings("key", "faq-test", ("ccc", "a", "bb"))
+    )
+    assert embedded_blocks == ["a", "bb", "ccc"]
+    assert np.allclose(second, _unit([[3, 1], [1, 1], [2, 1]]))
+    assert isinstance(second, np.memmap)
+
+    assert len(list((tmp_path / "faq-test").glob("*.npy"))) == 1
+
+
+def _mock_store(tmp_path, monkeypatch, rows, dtype):
+    async def mock_get_embedding(block, api_key):
+        return rows[block]
+
+    monkeypatch.setattr(_embedding_store, "EMBEDDING_STORE", tmp_path)
+    monkeypatch.setattr(_embedding_store, "get_embedding", mock_get_embedding)
+    monkeypatch.setattr(_embedding_store, "_loaded_stores", {})
+    monkeypatch.setattr(_embedding_store, "get_embedding_store_dtype", lambda: dtype)
+
+
+def test_normalised_store_ranks_the_same_as_raw_embeddings(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    raw = rng.normal(size=(500, 64)).astype(np.float32)
+    raw *= rng.uniform(0.5, 2, size=(500, 1)).astype(np.float32)
+    queries = rng.normal(size=(20, 64)).astype(np.float32)
+
+    rows = {str(i): row.tolist() for i, row in enumerate(raw)}
+    expected_indices, expected_scores = top_k_embeddings(queries, raw, 10)
+
+    for dtype, tolerance in [("float32", 1e-5), ("float16", 1e-3)]:
+        _mock_store(tmp_path / dtype, monkeypatch, rows, dtype)
+
+        stored = asyncio.run(
+            _embedding_store.get_stored_embeddings("key", "test", tuple(rows))
+        )
+        assert stored.dtype == np.dtype(dtype)
+
+        indices, scores = top_k_embeddings(queries, stored, 10, normalised=True)
+
+        assert np.allclose(scores, expected_scores, atol=tolerance)
+
+        # Any reordering is only between near ties
+        true_scores = _unit(queries) @ _unit(raw).T
+        for query, (query_indices, query_expected) in enumerate(
+            zip(indices, expected_indices)
+        ):
+            for index, expected in zip(query_indices, query_expected):
+                assert (
+                    abs(true_scores[query, index] - true_scores[query, expected])
+                    <= 2 * tolerance
+                )
+
+
+def test_stores_are_upgraded_to_the_configured_format(tmp_path, monkeypatch):
+    rows = {"a": [3.0, 4.0], "b": [0.0, 2.0]}
+
+    _mock_store(tmp_path, monkeypatch, rows, "float32")
+    asyncio.run(_embedding_store.get_stored_embeddings("key", "test", ("a", "b")))
+
+    embedded = []
+
+    async def mock_get_embedding(block, api_key):
+        embedded.append(block)
+        return rows[block]
+
+    monkeypatch.setattr(_embedding_store, "_loaded_stores", {})
+    monkeypatch.setattr(_embedding_store, "get_embedding", mock_get_embedding)
+    monkeypatch.setattr(
+        _embedding_store, "get_embedding_store_dtype", lambda: "float16"
+    )
+
+    upgraded = asyncio.run(
+        _embedding_store.get_stored_embeddings("key", "test", ("a", "b"))
+    )
+
+    # The existing rows are reused rather than embedded again
+    assert embedded == []
+    assert upgraded.dtype == np.float16
+    assert np.allclose(upgraded, [[0.6, 0.8], [0, 1]], atol=1e-3)
@@ -0,0 +1,64 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+from assistance import _embedding_store, _embeddings
+
+EMBEDDINGS = {
+    "How much are the fees?": [1.0, 0.0, 0.0],
+    "When does the program start?": [0.0, 1.0, 0.0],
+    "Can I bring my family?": [0.0, 0.0, 1.0],
+    "What does it cost?": [0.9, 0.1, 0.0],
+    "Is there a start date?": [0.1, 0.9, 0.0],
+}
+
+FAQ_DATA = {
+    "name": "test",
+    "hash": "a",
+    "items": [
+        {"question": "How much are the fees?", "answer": "A"},
+        {"question": "When does the program start?", "answer": "B"},
+        {"question": "Can I bring my family?", "answer": "C"},
+    ],
+}
+
+
+def test_top_faq_items_for_each_query(tmp_path, monkeypatch):
+    async def mock_get_embedding(block, api_key):
+        return EMBEDDINGS[block]
+
+    monkeypatch.setattr(_embedding_store, "EMBEDDING_STORE", tmp_path)
+    monkeypatch.setattr(_embedding_store, "get_embedding", mock_get_embedding)
+    monkeypatch.setattr(_embedding_store, "_loaded_stores", {})
+    monkeypatch.setattr(_embeddings, "get_embedding", mock_get_embedding)
+
+    results = asyncio.run(
+        _embeddings.get_top_faq_items(
+            "key",
+            FAQ_DATA,
+            queries=["What does it cost?", "Is there a start date?"],
+            k=2,
+        )
+    )
+
+    assert [[item["answer"] for item in items] for items in results] == [
+        ["A", "B"],
+        ["B", "A"],
+    ]
+    assert results[0][0]["score"] > results[0][1]["score"]
+
+    # Each query gets its own scores, the FAQ data itself is untouched
+    assert results[0][0]["score"] != results[1][1]["score"]
+    assert all("score" not in item for item in FAQ_DATA["items"])
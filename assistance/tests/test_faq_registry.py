@@ -0,0 +1,105 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+
+import numpy as np
+
+from assistance import _config
+from assistance._faq import registry
+
+FAQ = """
+[[items]]
+question = "How much are the fees?"
+answer = "$100"
+"""
+
+EDITED_FAQ = FAQ.replace("$100", "$200")
+
+
+def _write(path, contents, mtime_ns):
+    path.write_text(contents)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def _setup(tmp_path, monkeypatch):
+    monkeypatch.setattr(_config, "FAQ_DATA", tmp_path)
+    monkeypatch.setattr(registry, "_datasets", {})
+
+    path = tmp_path / "test.toml"
+    _write(path, FAQ, 10**18)
+
+    return path
+
+
+def test_datasets_are_parsed_once_and_shared(tmp_path, monkeypatch):
+    _setup(tmp_path, monkeypatch)
+
+    async def run():
+        return await asyncio.gather(*[registry.get_faq_data("test") for _ in range(5)])
+
+    datasets = asyncio.run(run())
+
+    assert all(dataset is datasets[0] for dataset in datasets)
+    assert datasets[0]["items"][0]["answer"] == "$100"
+
+
+def test_changed_files_are_reloaded(tmp_path, monkeypatch):
+    path = _setup(tmp_path, monkeypatch)
+
+    before = asyncio.run(registry.get_faq_data("test"))
+
+    _write(path, EDITED_FAQ, 2 * 10**18)
+    after = asyncio.run(registry.get_faq_data("test"))
+
+    assert after["items"][0]["answer"] == "$200"
+    assert after["hash"] != before["hash"]
+
+    # Anything still holding the previous version sees it unchanged
+    assert before["items"][0]["answer"] == "$100"
+
+
+def test_unparsable_files_keep_the_previous_version(tmp_path, monkeypatch):
+    path = _setup(tmp_path, monkeypatch)
+
+    before = asyncio.run(registry.get_faq_data("test"))
+
+    _write(path, "[[items]\nquestion = ", 2 * 10**18)
+    assert asyncio.run(registry.get_faq_data("test")) is before
+
+
+def test_embeddings_are_held_per_version(tmp_path, monkeypatch):
+    path = _setup(tmp_path, monkeypatch)
+
+    loads = []
+
+    async def mock_load_embeddings(openai_api_key, faq_data):
+        loads.append(faq_data["hash"])
+        return np.zeros((1, 2), dtype=np.float32), None
+
+    monkeypatch.setattr(registry, "_load_embeddings", mock_load_embeddings)
+
+    async def get_embeddings():
+        faq_data = await registry.get_faq_data("test")
+        return await registry.get_faq_embeddings("key", faq_data)
+
+    asyncio.run(get_embeddings())
+    asyncio.run(get_embeddings())
+    assert len(loads) == 1
+
+    _write(path, EDITED_FAQ, 2 * 10**18)
+    asyncio.run(get_embeddings())
+    assert len(loads) == 2
+    assert loads[0] != loads[1]
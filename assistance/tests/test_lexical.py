@@ -0,0 +1,118 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+from assistance import _embedding_store, _embeddings
+from assistance._faq import registry
+from assistance._lexical import BM25Index, tokenise
+
+DOCUMENTS = [
+    "How much are the tuition fees? The fees are $10,000 a year.",
+    "When does the program start? Intakes start in February and July.",
+    "Can I bring my family? Yes, family can come on a dependent visa.",
+    "Are there scholarships for the fees? A few scholarships are offered.",
+]
+
+FAQ_DATA = {
+    "name": "test",
+    "hash": "lexical",
+    "items": [
+        {"question": "How much are the tuition fees?", "answer": "A"},
+        {"question": "Are there scholarships to cover fees?", "answer": "B"},
+        {"question": "When does the program start?", "answer": "C"},
+    ],
+}
+
+EMBEDDINGS = {
+    "How much are the tuition fees?": [1.0, 0.0, 0.0],
+    "Are there scholarships to cover fees?": [0.0, 1.0, 0.0],
+    "When does the program start?": [0.0, 0.0, 1.0],
+    "Is financial help available with fees?": [0.1, 0.9, 0.0],
+}
+
+
+def test_tokenise_drops_stop_words_and_punctuation():
+    assert tokenise("When does the Program start?") == ["program", "start"]
+
+
+def test_bm25_ranks_by_matching_terms():
+    index = BM25Index(DOCUMENTS)
+
+    indices, scores = index.search("scholarships for fees", 10)
+
+    assert indices[:2] == [3, 0]
+    assert scores[0] > scores[1] > 0
+
+    # Documents without any of the terms are left out
+    assert 1 not in indices and 2 not in indices
+    assert index.search("visa", 10)[0] == [2]
+    assert index.search("unrelated", 10) == ([], [])
+
+
+def _use_mock_embeddings(tmp_path, monkeypatch, delay=0.0):
+    async def mock_get_embedding(block, api_key):
+        await asyncio.sleep(delay)
+        return EMBEDDINGS[block]
+
+    monkeypatch.setattr(_embedding_store, "EMBEDDING_STORE", tmp_path)
+    monkeypatch.setattr(_embedding_store, "get_embedding", mock_get_embedding)
+    monkeypatch.setattr(_embedding_store, "_loaded_stores", {})
+    monkeypatch.setattr(_embeddings, "get_embedding", mock_get_embedding)
+    monkeypatch.setattr(registry, "_datasets", {})
+
+
+def test_embeddings_rank_the_faq_items(tmp_path, monkeypatch):
+    _use_mock_embeddings(tmp_path, monkeypatch)
+
+    results = asyncio.run(
+        _embeddings.get_top_faq_items(
+            "key", FAQ_DATA, ["Is financial help available with fees?"], k=2
+        )
+    )
+
+    # BM25 would prefer the shorter tuition question
+    assert [item["answer"] for item in results[0]] == ["B", "A"]
+    assert results[0][0]["score"] > 0.9
+
+
+def test_slow_embeddings_fall_back_to_lexical(tmp_path, monkeypatch):
+    _use_mock_embeddings(tmp_path, monkeypatch, delay=0.5)
+    monkeypatch.setattr(_embeddings, "EMBEDDING_TIMEOUT", 0.05)
+
+    async def search():
+        results = await _embeddings.get_top_faq_items(
+            "key", FAQ_DATA, ["Is financial help available with fees?"], k=2
+        )
+        responses = await _embeddings.get_top_questions_and_answers(
+            "key", FAQ_DATA, ["Is financial help available with fees?"], k=2
+        )
+
+        # The embeddings keep loading so that they are ready next time
+        await asyncio.sleep(1)
+        return results, responses
+
+    results, responses = asyncio.run(search())
+
+    # BM25 scores are not similarities, so none are given, and the
+    # importance of each item comes from its rank instead
+    assert [item["answer"] for item in results[0]] == ["A", "B"]
+    assert all("score" not in item for item in results[0])
+    assert responses == [
+        "Importance Score: 1.00\n"
+        "Question: How much are the tuition fees?\nAnswer: A",
+        "Importance Score: 0.50\n"
+        "Question: Are there scholarships to cover fees?\nAnswer: B",
+    ]
+    assert "faq-test" in _embedding_store._loaded_stores
@@ -0,0 +1,26 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from assistance import _metrics
+
+
+def test_observations_are_summarised(monkeypatch):
+    monkeypatch.setattr(_metrics, "_observations", {})
+
+    for value in [2, 4, 3]:
+        _metrics.observe("test.candidates", value)
+
+    observations = _metrics.get_observations()["test.candidates"]
+
+    assert observations == {"count": 3, "total": 9, "min": 2, "max": 4}
@@ -0,0 +1,90 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from assistance._paths import TESTS_DATA
+from assistance._readability import get_main_content
+from assistance._vendor.stackoverflow.web_scraping import extract_text
+
+ARTICLE_HTML = (TESTS_DATA / "article-example.html").read_bytes()
+
+
+def test_main_content_keeps_only_the_article():
+    main_content = get_main_content(ARTICLE_HTML)
+    assert main_content is not None
+
+    text = extract_text(main_content.encode())
+    whole_page = extract_text(ARTICLE_HTML)
+
+    assert text.startswith("Universities expand pathway programs")
+    assert "completion data broken down by provider" in text
+
+    for boilerplate in [
+        "Accept all cookies",
+        "Subscribe",
+        "Most read",
+        "Related stories",
+        "Share on Facebook",
+        "Terms of use",
+    ]:
+        assert boilerplate in whole_page
+        assert boilerplate not in text
+
+
+def test_pages_without_an_article_have_no_main_content():
+    html = b"""
+        <html><body>
+            <nav><a href="/">Home</a> <a href="/news">News</a></nav>
+            <ul><li><a href="/a">First story</a></li><li><a href="/b">Second</a></li></ul>
+            <p>A single short paragraph, which is not an article.</p>
+        </body></html>
+    """
+
+    assert get_main_content(html) is None
+
+
+def test_long_articles_are_scored_quickly():
+    paragraph = "<p>A sentence of the article, with a comma or two, and more.</p>"
+    html = (
+        "<html><body><nav><a href='/'>Home</a></nav><div class='story'>"
+        + "".join(f"<div>{paragraph * 3}</div>" for _ in range(200))
+        + "</div></body></html>"
+    ).encode()
+
+    start = time.perf_counter()
+    main_content = get_main_content(html)
+    duration = time.perf_counter() - start
+
+    assert main_content is not None
+    assert main_content.count("<p>") == 600
+    assert "Home" not in main_content
+    assert duration < 2
+
+
+def test_candidates_with_identical_markup_are_scored_apart():
+    paragraph = "<p>A sentence of the article, with a comma or two, and more.</p>"
+    html = (
+        "<html><body>"
+        f"<section><div>{paragraph * 3}</div></section>"
+        "<section>" + f"<div>{paragraph * 3}</div>" * 3 + "</section>"
+        "</body></html>"
+    ).encode()
+
+    main_content = get_main_content(html)
+    assert main_content is not None
+
+    # The second section's divs, none of them merged with the first's
+    assert main_content.startswith("<section>")
+    assert main_content.count("<div>") == 3
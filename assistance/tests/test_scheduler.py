@@ -0,0 +1,63 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+
+from assistance._scheduler import ModelScheduler
+
+
+def test_interactive_requests_are_admitted_before_background_ones():
+    scheduler = ModelScheduler(
+        {"requests_per_minute": 600, "tokens_per_minute": 10**6}
+    )
+    scheduler.requests.available = 0
+
+    admitted = []
+
+    async def request(name, priority):
+        await scheduler.acquire(tokens=10, priority=priority)
+        admitted.append(name)
+
+    async def run():
+        background = [
+            asyncio.create_task(request(f"background {i}", "background"))
+            for i in range(3)
+        ]
+        await asyncio.sleep(0)
+
+        interactive = asyncio.create_task(request("interactive", "interactive"))
+
+        await asyncio.gather(*background, interactive)
+
+    asyncio.run(run())
+
+    assert admitted == ["interactive", "background 0", "background 1", "background 2"]
+
+
+def test_requests_wait_for_the_token_budget():
+    scheduler = ModelScheduler(
+        {"requests_per_minute": 10**6, "tokens_per_minute": 6000}
+    )
+    scheduler.tokens.available = 0
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await scheduler.acquire(tokens=20)
+
+        return loop.time() - start
+
+    # 6000 tokens per minute refills 100 tokens per second
+    assert 0.15 < asyncio.run(run()) < 1
@@ -0,0 +1,197 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import collections
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from assistance import _scraper
+
+
+class StandInServer:
+    """A local stand-in for a news host, with a route per behaviour."""
+
+    def __init__(self):
+        self.requests: collections.Counter[str] = collections.Counter()
+        self.active = 0
+        self.max_active = 0
+
+        app = web.Application()
+        app.router.add_get("/article/{id}", self.article)
+        app.router.add_get("/flaky", self.flaky)
+        app.router.add_get("/slow", self.slow)
+        app.router.add_get("/huge", self.huge)
+        app.router.add_get("/missing", self.missing)
+
+        self.server = TestServer(app)
+
+    async def __aenter__(self):
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *args):
+        await _scraper.close_session()
+        await self.server.close()
+
+    def url(self, path: str) -> str:
+        return str(self.server.make_url(path))
+
+    async def article(self, request: web.Request):
+        self.requests[request.path] += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            self.active -= 1
+
+        return web.Response(text=f"<p>Article {request.match_info['id']}</p>")
+
+    async def flaky(self, request: web.Request):
+        self.requests[request.path] += 1
+
+        if self.requests[request.path] < 3:
+            return web.Response(status=503)
+
+        return web.Response(text="Finally")
+
+    async def slow(self, request: web.Request):
+        self.requests[request.path] += 1
+        await asyncio.sleep(1)
+
+        return web.Response(text="Too late")
+
+    async def huge(self, request: web.Request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+
+        for _ in range(4):
+            await response.write(b"x" * 1024)
+
+        await response.write_eof()
+        return response
+
+    async def missing(self, request: web.Request):
+        self.requests[request.path] += 1
+        return web.Response(status=404, text="Error 404")
+
+
+@pytest.fixture(autouse=True)
+def fresh_scraper(monkeypatch):
+    monkeypatch.setattr(_scraper, "_session", None)
+    monkeypatch.setattr(
+        _scraper,
+        "_host_semaphores",
+        collections.defaultdict(lambda: asyncio.Semaphore(2)),
+    )
+    monkeypatch.setattr(_scraper, "BACKOFF_SECONDS", 0.01)
+
+
+def test_requests_per_host_are_capped():
+    async def run():
+        async with StandInServer() as server:
+            pages = await asyncio.gather(
+                *[_scraper.fetch(server.url(f"/article/{i}")) for i in range(8)]
+            )
+
+        return server, pages
+
+    server, pages = asyncio.run(run())
+
+    assert [page["body"] for page in pages] == [
+        f"<p>Article {i}</p>".encode() for i in range(8)
+    ]
+    assert server.max_active == 2
+
+
+def test_server_errors_are_retried():
+    async def run():
+        async with StandInServer() as server:
+            return server, await _scraper.fetch(server.url("/flaky"))
+
+    server, page = asyncio.run(run())
+
+    assert page["status"] == 200
+    assert page["body"] == b"Finally"
+    assert server.requests["/flaky"] == 3
+
+
+def test_client_errors_are_not_retried():
+    async def run():
+        async with StandInServer() as server:
+            return server, await _scraper.fetch(server.url("/missing"))
+
+    server, page = asyncio.run(run())
+
+    assert page["status"] == 404
+    assert server.requests["/missing"] == 1
+
+
+def test_read_timeouts_are_retried_then_raised(monkeypatch):
+    monkeypatch.setattr(_scraper, "READ_TIMEOUT", 0.1)
+
+    async def run():
+        async with StandInServer() as server:
+            with pytest.raises(asyncio.TimeoutError):
+                await _scraper.fetch(server.url("/slow"))
+
+        return server
+
+    server = asyncio.run(run())
+
+    assert server.requests["/slow"] == _scraper.MAX_ATTEMPTS
+
+
+def test_bodies_over_the_limit_are_refused(monkeypatch):
+    monkeypatch.setattr(_scraper, "MAX_BODY_BYTES", 2048)
+
+    async def run():
+        async with StandInServer() as server:
+            with pytest.raises(ValueError):
+                await _scraper.fetch(server.url("/huge"))
+
+    asyncio.run(run())
+
+
+def test_crawl_queue_fetches_each_url_once():
+    fetched = []
+
+    async def handler(url):
+        page = await _scraper.fetch(url)
+        fetched.append(page["body"])
+
+        if url.endswith("/missing"):
+            raise ValueError(url)
+
+    async def run():
+        async with StandInServer() as server:
+            queue = _scraper.CrawlQueue("test_crawl", handler, num_workers=3)
+
+            for i in [0, 1, 2, 1, 0]:
+                queue.put(server.url(f"/article/{i}"))
+            queue.put(server.url("/missing"))
+
+            await queue.join()
+
+        return server
+
+    server = asyncio.run(run())
+
+    assert sorted(fetched)[:3] == [f"<p>Article {i}</p>".encode() for i in range(3)]
+    assert len(fetched) == 4
+    assert server.requests["/missing"] == 1
@@ -0,0 +1,53 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from assistance import _similarity
+from assistance._similarity import SIMILARITY_BACKENDS
+
+
+def test_numpy_top_k_matches_brute_force():
+    rng = np.random.default_rng(42)
+    queries = rng.normal(size=(4, 64)).astype(np.float32)
+    embeddings = rng.normal(size=(300, 64)).astype(np.float32)
+
+    indices, scores = SIMILARITY_BACKENDS["numpy"](queries, embeddings, 5, False)
+
+    for query, query_indices, query_scores in zip(queries, indices, scores):
+        expected_scores = (embeddings @ query) / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query)
+        )
+        expected_indices = np.argsort(-expected_scores)[:5]
+
+        assert query_indices == expected_indices.tolist()
+        assert np.allclose(query_scores, expected_scores[expected_indices], atol=1e-5)
+
+
+def test_numpy_top_k_with_k_equal_to_number_of_embeddings():
+    queries = np.array([[1, 0]], dtype=np.float32)
+    embeddings = np.array([[0, 1], [1, 0], [1, 1]], dtype=np.float32)
+
+    indices, scores = SIMILARITY_BACKENDS["numpy"](queries, embeddings, 3, False)
+
+    assert indices == [[1, 2, 0]]
+    assert np.allclose(scores, [[1, 2**-0.5, 0]])
+
+
+def test_backend_setting_is_read_on_each_call(monkeypatch):
+    monkeypatch.setattr(_similarity, "SIMILARITY_BACKEND", "torch")
+    assert _similarity.get_similarity_backend_name() == "torch"
+
+    monkeypatch.setattr(_similarity, "SIMILARITY_BACKEND", "numpy")
+    assert _similarity.get_similarity_backend_name() == "numpy"
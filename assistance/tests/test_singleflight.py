@@ -0,0 +1,112 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+
+from assistance import _metrics, _openai, _paths
+from assistance._singleflight import SingleFlight
+
+
+def test_concurrent_identical_completions_share_one_call(tmp_path, monkeypatch):
+    monkeypatch.setattr(_paths, "COMPLETION_CACHE", tmp_path)
+
+    calls = []
+
+    async def mock_run_completion(kwargs, priority):
+        calls.append(kwargs)
+        await asyncio.sleep(0.05)
+
+        return {"choices": [{"message": {"content": f" {kwargs['prompt']} "}}]}
+
+    monkeypatch.setattr(_openai, "_run_completion", mock_run_completion)
+
+    coalesced_before = _metrics.get_counters().get("openai.completions.coalesced", 0)
+
+    async def run():
+        return await asyncio.gather(
+            *[
+                _openai.get_completion_only(
+                    scope=None, prompt=prompt, api_key="stub", engine="stub"
+                )
+                for prompt in ["a", "a", "b", "a"]
+            ]
+        )
+
+    assert asyncio.run(run()) == ["a", "a", "b", "a"]
+    assert sorted(call["prompt"] for call in calls) == ["a", "b"]
+
+    coalesced = _metrics.get_counters()["openai.completions.coalesced"]
+    assert coalesced - coalesced_before == 2
+
+
+def test_call_is_cancelled_once_every_caller_is():
+    single_flight = SingleFlight("test")
+    cancelled = []
+
+    async def call():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+        return "done"
+
+    async def run():
+        first = asyncio.create_task(single_flight.run("key", call))
+        second = asyncio.create_task(single_flight.run("key", call))
+        await asyncio.sleep(0.01)
+
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled
+        assert single_flight.is_in_flight("key")
+
+        second.cancel()
+        await asyncio.sleep(0.01)
+        assert cancelled
+        assert not single_flight.is_in_flight("key")
+
+    asyncio.run(run())
+
+
+def test_callers_after_a_cancel_start_a_new_call():
+    single_flight = SingleFlight("test")
+    calls = []
+
+    async def call():
+        calls.append(True)
+        if len(calls) > 1:
+            return "done"
+
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            # Winds down slowly, such as when closing a connection.
+            await asyncio.sleep(0.05)
+            raise
+
+    async def run():
+        first = asyncio.create_task(single_flight.run("key", call))
+        await asyncio.sleep(0.01)
+
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not single_flight.is_in_flight("key")
+
+        return await single_flight.run("key", call)
+
+    assert asyncio.run(run()) == "done"
+    assert len(calls) == 2
@@ -0,0 +1,92 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import contextlib
+
+from assistance import _completion_cache, _openai, _paths
+
+DELTAS = ['{"id', '": 1,', ' "ok": true}']
+
+
+def _mock_stream(monkeypatch, calls):
+    async def mock_start_chat_completion_stream(priority, chat_kwargs):
+        calls.append(chat_kwargs)
+
+        async def stream():
+            for delta in DELTAS:
+                yield {
+                    "choices": [{"delta": {"content": delta}, "finish_reason": None}]
+                }
+
+            yield {"choices": [{"delta": {}, "finish_reason": "stop"}]}
+
+        return stream()
+
+    monkeypatch.setattr(
+        _openai, "_start_chat_completion_stream", mock_start_chat_completion_stream
+    )
+
+
+def test_streamed_completion_is_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(_paths, "COMPLETION_CACHE", tmp_path)
+    monkeypatch.setattr(
+        _completion_cache,
+        "_memory_tier",
+        _completion_cache.create_memory_tier("lru", max_bytes=2**20),
+    )
+
+    calls = []
+    _mock_stream(monkeypatch, calls)
+
+    async def collect(prompt):
+        return [
+            delta
+            async for delta in _openai.stream_completion_only(
+                scope=None, prompt=prompt, api_key="stub", engine="stub"
+            )
+        ]
+
+    assert asyncio.run(collect("streamed")) == DELTAS
+    assert len(calls) == 1
+
+    # Also served to the non-streaming API from the cache
+    completion = asyncio.run(
+        _openai.get_completion_only(
+            scope=None, prompt="streamed", api_key="stub", engine="stub"
+        )
+    )
+    assert completion == "".join(DELTAS)
+    assert asyncio.run(collect("streamed")) == ["".join(DELTAS)]
+    assert len(calls) == 1
+
+
+def test_abandoned_stream_is_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(_paths, "COMPLETION_CACHE", tmp_path)
+
+    calls = []
+    _mock_stream(monkeypatch, calls)
+
+    async def take_first_delta():
+        async with contextlib.aclosing(
+            _openai.stream_completion_only(
+                scope=None, prompt="abandoned", api_key="stub", engine="stub"
+            )
+        ) as deltas:
+            async for delta in deltas:
+                return delta
+
+    assert asyncio.run(take_first_delta()) == DELTAS[0]
+    assert list(tmp_path.glob("**/*.json")) == []
@@ -0,0 +1,123 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import json
+
+import numpy as np
+
+from assistance._faq import sub_questions
+
+
+def _mock_api(monkeypatch, prompts, duplicates=None):
+    duplicates = duplicates or {}
+
+    async def mock_get_completion_only(scope, prompt, api_key, **kwargs):
+        prompts.append(prompt)
+
+        questions = json.loads(
+            prompt.split("## The current questions, by id")[1].split("##")[0]
+        )
+
+        return json.dumps(
+            {
+                question_id: [
+                    {"think step by step": "", "question": f"{question} / part {i}"}
+                    for i in range(2)
+                ]
+                for question_id, question in questions.items()
+            }
+        )
+
+    async def mock_get_embedding(block, api_key):
+        block = duplicates.get(block, block)
+        rng = np.random.default_rng(abs(hash(block)) % 2**32)
+
+        return rng.normal(size=16).astype(np.float32)
+
+    monkeypatch.setattr(sub_questions, "get_completion_only", mock_get_completion_only)
+    monkeypatch.setattr(sub_questions, "get_embedding", mock_get_embedding)
+
+
+def _get_sub_questions(**kwargs):
+    return asyncio.run(
+        sub_questions.get_sub_questions(
+            scope=None,
+            openai_api_key="stub",
+            question="Q",
+            context="",
+            **kwargs,
+        )
+    )
+
+
+def test_small_levels_are_a_single_prompt(monkeypatch):
+    prompts = []
+    _mock_api(monkeypatch, prompts)
+
+    tree = _get_sub_questions(max_depth=3, max_nodes=100)
+
+    assert len(prompts) == 3
+    assert len(tree) == 1 + 2 + 4 + 8
+    assert tree[-1] == "Q"
+
+
+def test_large_levels_are_split_across_prompts(monkeypatch):
+    prompts = []
+    _mock_api(monkeypatch, prompts)
+
+    tree = _get_sub_questions(max_depth=4, max_nodes=100)
+
+    # The fourth level holds 8 questions, twice MAX_QUESTIONS_PER_PROMPT.
+    assert len(prompts) == 1 + 1 + 1 + 2
+    assert len(tree) == 1 + 2 + 4 + 8 + 16
+    assert tree[-1] == "Q"
+
+
+def test_unparseable_replies_stop_the_expansion(monkeypatch):
+    prompts = []
+    _mock_api(monkeypatch, prompts)
+
+    async def mock_get_completion_only(scope, prompt, api_key, **kwargs):
+        prompts.append(prompt)
+
+        return '{"1": [{"think step by step": "", "question": "cut o'
+
+    monkeypatch.setattr(sub_questions, "get_completion_only", mock_get_completion_only)
+
+    tree = _get_sub_questions(max_depth=3, max_nodes=100)
+
+    assert tree == ["Q"]
+    assert len(prompts) == 1
+
+
+def test_node_budget_limits_the_tree(monkeypatch):
+    prompts = []
+    _mock_api(monkeypatch, prompts)
+
+    tree = _get_sub_questions(max_depth=10, max_nodes=5)
+
+    assert len(tree) == 5
+    assert len(prompts) == 2
+
+
+def test_semantic_duplicates_are_not_expanded(monkeypatch):
+    prompts = []
+    _mock_api(monkeypatch, prompts, duplicates={"Q / part 1": "Q"})
+
+    tree = _get_sub_questions(max_depth=2, max_nodes=100)
+
+    assert "Q / part 1" not in tree
+    assert tree == ["Q / part 0", "Q / part 0 / part 0", "Q / part 0 / part 1", "Q"]
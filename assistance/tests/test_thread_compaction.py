@@ -0,0 +1,146 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+
+from assistance import _paths, _tokens
+from assistance._summarisation import thread
+
+EMAIL = " ".join(f"This is line {i} of a fairly long email." for i in range(60))
+
+
+def _mock_completions(monkeypatch, tmp_path):
+    monkeypatch.setattr(_tokens, "_get_encoding", lambda model: None)
+    monkeypatch.setattr(_paths, "THREAD_SUMMARIES", tmp_path)
+
+    prompts = []
+
+    async def mock_get_completion_only(scope, prompt, api_key, **kwargs):
+        prompts.append(prompt)
+        await asyncio.sleep(0)
+
+        if prompt.startswith("Write a summary"):
+            return "A summary"
+
+        return "The reply"
+
+    monkeypatch.setattr(thread, "get_completion_only", mock_get_completion_only)
+
+    return prompts
+
+
+def _reply(email_thread):
+    return asyncio.run(_reply_with_prompt("Reply to this:", email_thread))
+
+
+async def _reply_with_prompt(prompt, email_thread):
+    return await thread.run_with_summary_fallback(
+        scope=None,
+        prompt=f"{prompt}\n\n{{transcript}}",
+        email_thread=email_thread,
+        api_key="stub",
+        engine="gpt-3.5-turbo",
+        max_tokens=512,
+    )
+
+
+def test_excess_emails_are_summarised_in_one_pass(tmp_path, monkeypatch):
+    prompts = _mock_completions(monkeypatch, tmp_path)
+
+    email_thread = [EMAIL] * 30 + ["The latest email"]
+    response, transcript = _reply(email_thread)
+
+    assert response == "The reply"
+    assert transcript.startswith("Summary of omitted emails:\nA summary")
+    assert transcript.endswith("The latest email")
+
+    summary_prompts = [p for p in prompts if p.startswith("Write a summary")]
+    reply_prompts = [p for p in prompts if p.startswith("Reply to this")]
+
+    assert len(reply_prompts) == 1
+
+    # Several emails are summarised within each map call, rather than
+    # two at a time with a retry between each
+    assert 1 < len(summary_prompts) < len(email_thread) / 2
+
+    # The kept tail is as long as the budget allows
+    kept_emails = transcript.count(EMAIL)
+    assert kept_emails > 0
+    assert (
+        _tokens.count_tokens(reply_prompts[0].replace("A summary", "x " * 512))
+        <= 4096 - 512
+    )
+
+
+def test_thread_summary_is_reused(tmp_path, monkeypatch):
+    prompts = _mock_completions(monkeypatch, tmp_path)
+
+    email_thread = [EMAIL] * 30 + ["The latest email"]
+    _reply(email_thread)
+
+    prompts.clear()
+    _reply(email_thread)
+
+    assert len(prompts) == 1
+    assert prompts[0].startswith("Reply to this")
+
+
+def test_short_threads_are_not_summarised(tmp_path, monkeypatch):
+    prompts = _mock_completions(monkeypatch, tmp_path)
+
+    response, transcript = _reply(["Hello", "Hi there"])
+
+    assert len(prompts) == 1
+    assert transcript == "Hello\n\nHi there"
+
+
+def test_only_the_new_tail_is_summarised(tmp_path, monkeypatch):
+    prompts = _mock_completions(monkeypatch, tmp_path)
+
+    email_thread = [EMAIL] * 30 + ["The latest email"]
+    _reply(email_thread)
+
+    prompts.clear()
+    _reply(email_thread + [EMAIL, EMAIL, "A newer email"])
+
+    summary_prompts = [p for p in prompts if p.startswith("Write a summary")]
+
+    assert len(summary_prompts) == 1
+    assert "Summary of omitted emails:\nA summary" in summary_prompts[0]
+    assert summary_prompts[0].count(EMAIL) < 6
+
+
+def test_concurrent_handlers_share_thread_summaries(tmp_path, monkeypatch):
+    prompts = _mock_completions(monkeypatch, tmp_path)
+
+    email_thread = [EMAIL] * 30 + ["The latest email"]
+    longer_prompt = "Reply to this: " + " ".join(["with more instructions"] * 200)
+
+    async def run():
+        return await asyncio.gather(
+            _reply_with_prompt("Reply to this:", email_thread),
+            _reply_with_prompt(longer_prompt, email_thread),
+        )
+
+    asyncio.run(run())
+
+    summary_prompts = [p for p in prompts if p.startswith("Write a summary")]
+    extending_prompts = [
+        p for p in summary_prompts if "Summary of omitted emails:" in p
+    ]
+
+    # The second handler only summarised on top of the first's summary
+    assert len(extending_prompts) == 1
+    assert extending_prompts[0].count(EMAIL) < 6
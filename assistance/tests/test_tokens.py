@@ -0,0 +1,192 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import time
+
+import pytest
+
+from assistance import _paths, _tokens
+from assistance._news import relevance
+from assistance._summarisation import thread
+
+TEXT = " ".join(
+    f"Sentence number {i} talks about Jim's International Pathway Program."
+    for i in range(200)
+)
+
+
+def _use_estimator(monkeypatch):
+    monkeypatch.setattr(_tokens, "_get_encoding", lambda model: None)
+
+
+def test_split_by_tokens_fits_within_the_budget(monkeypatch):
+    _use_estimator(monkeypatch)
+
+    chunks = _tokens.split_by_tokens(
+        TEXT, chunk_tokens=100, overlap_tokens=0, model="gpt-3.5-turbo"
+    )
+
+    assert len(chunks) > 1
+    assert "".join(chunks) == TEXT
+
+    for chunk in chunks:
+        assert _tokens.count_tokens(chunk) <= 100
+
+
+def test_split_by_tokens_overlaps_chunks(monkeypatch):
+    _use_estimator(monkeypatch)
+
+    chunks = _tokens.split_by_tokens(
+        TEXT, chunk_tokens=100, overlap_tokens=20, model="gpt-3.5-turbo"
+    )
+
+    for previous, chunk in zip(chunks, chunks[1:]):
+        overlap = chunk[:20]
+        assert overlap in previous
+
+
+class ByteEncoding:
+    """Stands in for a byte-level BPE, with a token per UTF-8 byte."""
+
+    def encode(self, text, disallowed_special=()):
+        return list(text.encode("utf8"))
+
+    def decode(self, tokens):
+        return bytes(tokens).decode("utf8", errors="replace")
+
+    def decode_single_token_bytes(self, token):
+        return bytes([token])
+
+
+def test_split_by_tokens_keeps_multi_byte_characters_whole(monkeypatch):
+    monkeypatch.setattr(_tokens, "_get_encoding", lambda model: ByteEncoding())
+
+    text = "Café crème, naïve piñata, 日本語のテキスト. " * 20
+
+    for chunk_tokens, overlap_tokens in [(7, 0), (10, 3), (64, 16)]:
+        chunks = _tokens.split_by_tokens(
+            text,
+            chunk_tokens=chunk_tokens,
+            overlap_tokens=overlap_tokens,
+            model="gpt-3.5-turbo",
+        )
+
+        assert all("\ufffd" not in chunk for chunk in chunks)
+        assert all(chunk in text for chunk in chunks)
+
+        if overlap_tokens == 0:
+            assert "".join(chunks) == text
+
+
+def test_remaining_tokens_accounts_for_prompt_and_reply(monkeypatch):
+    _use_estimator(monkeypatch)
+
+    remaining = _tokens.get_remaining_tokens(
+        prompt=TEXT[:1000], max_tokens=512, model="gpt-3.5-turbo"
+    )
+
+    assert remaining == (
+        4096 - _tokens.CHAT_MESSAGE_OVERHEAD - 512 - _tokens.count_tokens(TEXT[:1000])
+    )
+
+
+def test_articles_are_packed_by_token_budget(monkeypatch):
+    _use_estimator(monkeypatch)
+
+    articles = [{"id": i, "title": TEXT[:200]} for i in range(30)]
+    chunks = relevance._pack_articles_into_chunks(
+        tasks=["a", "b", "c"],
+        goals=["d", "e"],
+        target_audience="f",
+        articles_with_ids=articles,
+    )
+
+    assert [len(chunk) for chunk in chunks] == [20, 10]
+
+    long_articles = [{"id": i, "title": TEXT[:2000]} for i in range(6)]
+    chunks = relevance._pack_articles_into_chunks(
+        tasks=["a", "b", "c"],
+        goals=["d", "e"],
+        target_audience="f",
+        articles_with_ids=long_articles,
+    )
+
+    assert len(chunks) > 1
+    assert sum(len(chunk) for chunk in chunks) == 6
+
+
+def test_overflowing_thread_is_summarised_before_sending(tmp_path, monkeypatch):
+    _use_estimator(monkeypatch)
+    monkeypatch.setattr(_paths, "THREAD_SUMMARIES", tmp_path)
+
+    prompts = []
+
+    async def mock_get_completion_only(scope, prompt, api_key, **kwargs):
+        prompts.append(prompt)
+        return "A short summary"
+
+    monkeypatch.setattr(thread, "get_completion_only", mock_get_completion_only)
+
+    email_thread = [TEXT, TEXT, "The latest email"]
+
+    response, transcript = asyncio.run(
+        thread.run_with_summary_fallback(
+            scope=None,
+            prompt="Reply to this:\n\n{transcript}",
+            email_thread=email_thread,
+            api_key="stub",
+            engine="gpt-3.5-turbo",
+            max_tokens=512,
+        )
+    )
+
+    # Only the summary and then the reply, no round trip that overflowed
+    assert len(prompts) == 2
+    assert prompts[0].startswith("Write a summary")
+    assert transcript.startswith("Summary of omitted emails:\nA short summary")
+    assert transcript.endswith("The latest email")
+
+
+def test_failed_encoding_loads_are_retried(tmp_path, monkeypatch):
+    tiktoken = pytest.importorskip("tiktoken")
+    attempts = []
+
+    def flaky_encoding_for_model(model):
+        attempts.append(model)
+        if len(attempts) == 1:
+            raise ConnectionError("Offline")
+
+        return ByteEncoding()
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", flaky_encoding_for_model)
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(_tokens, "_encodings", {})
+    monkeypatch.setattr(_tokens, "_next_load_attempts", {})
+    monkeypatch.setattr(_tokens, "ENCODING_RETRY_SECONDS", 0)
+
+    _tokens.load_encodings()
+    assert attempts == ["gpt-3.5-turbo", "gpt-4", "text-embedding-ada-002"]
+
+    # Estimated while the failed load is retried in the background
+    assert _tokens._get_encoding("gpt-3.5-turbo") is None
+
+    for _ in range(100):
+        if "gpt-3.5-turbo" in _tokens._encodings:
+            break
+        time.sleep(0.01)
+
+    assert isinstance(_tokens._get_encoding("gpt-3.5-turbo"), ByteEncoding)
+    assert attempts.count("gpt-3.5-turbo") == 2
@@ -0,0 +1,101 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare the recall and latency of the IVF index to the exact search.
+
+The embeddings are drawn around a number of topics, as real FAQ
+questions cluster by topic, since an IVF index relies on that structure.
+
+Run with:
+
+    poetry run python dev/benchmarks/ann_index.py [number of rows ...]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from assistance._ann import IVFIndex
+from assistance._similarity import top_k_embeddings
+
+EMBEDDING_DIMENSION = 1536
+NUM_QUERIES = 40
+K = 3
+REPEATS = 5
+
+NUM_PROBES = [1, 4, 16, 32]
+
+DEFAULT_SIZES = [10_000, 30_000, 100_000]
+
+
+def clustered_embeddings(rng, topics, size):
+    assignments = rng.integers(0, len(topics), size=size)
+    noise = rng.normal(scale=1.5, size=(size, topics.shape[1]))
+
+    return (topics[assignments] + noise).astype(np.float32)
+
+
+def recall(approximate_indices, exact_indices):
+    found = [
+        len(set(approximate) & set(exact)) / len(exact)
+        for approximate, exact in zip(approximate_indices, exact_indices)
+    ]
+
+    return float(np.mean(found))
+
+
+def time_per_call(function):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        result = function()
+
+    return (time.perf_counter() - start) / REPEATS * 1000, result
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or DEFAULT_SIZES
+    rng = np.random.default_rng(0)
+
+    for size in sizes:
+        topics = rng.normal(size=(max(8, size // 100), EMBEDDING_DIMENSION))
+        embeddings = clustered_embeddings(rng, topics, size)
+        queries = clustered_embeddings(rng, topics, NUM_QUERIES)
+
+        start = time.perf_counter()
+        index = IVFIndex.build(embeddings)
+        build_seconds = time.perf_counter() - start
+
+        exact_ms, (exact_indices, _) = time_per_call(
+            lambda: top_k_embeddings(queries, embeddings, K)
+        )
+
+        print(
+            f"rows: {size:>7} | lists: {len(index.centroids):>4} | "
+            f"build: {build_seconds:6.2f} s | exact: {exact_ms:8.2f} ms"
+        )
+
+        for num_probes in NUM_PROBES:
+            ivf_ms, (ivf_indices, _) = time_per_call(
+                lambda: index.search(embeddings, queries, K, num_probes=num_probes)
+            )
+
+            print(
+                f"    probes: {num_probes:>3} | {ivf_ms:8.2f} ms | "
+                f"recall@{K}: {recall(ivf_indices, exact_indices):.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
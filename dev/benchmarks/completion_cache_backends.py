@@ -0,0 +1,106 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Compare lookup latency and disk footprint of the completion cache stores.
+
+Run with:
+
+    poetry run python dev/benchmarks/completion_cache_backends.py
+"""
+
+import asyncio
+import json
+import pathlib
+import random
+import tempfile
+import time
+
+from assistance._completion_cache import FilesDiskStore, SQLiteDiskStore
+from assistance._utilities import get_hash_digest
+
+NUMBER_OF_COMPLETIONS = 5_000
+NUMBER_OF_EMBEDDINGS = 5_000
+NUMBER_OF_LOOKUPS = 2_000
+EMBEDDING_DIMENSION = 1536
+
+
+def main():
+    rng = random.Random(0)
+    entries = _create_entries(rng)
+    lookups = rng.sample(list(entries.keys()), NUMBER_OF_LOOKUPS)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = pathlib.Path(temp_dir)
+
+        files_store = FilesDiskStore(root / "completion-cache")
+        sqlite_store = SQLiteDiskStore(root / "completion-cache.sqlite3")
+
+        for name, store in [("files", files_store), ("sqlite", sqlite_store)]:
+            asyncio.run(_fill(store, entries))
+            seconds = asyncio.run(_time_lookups(store, lookups))
+
+            if name == "files":
+                footprint = _get_disk_usage(root / "completion-cache")
+            else:
+                footprint = _get_disk_usage(root, "completion-cache.sqlite3*")
+
+            print(
+                f"{name:>6} | {seconds / NUMBER_OF_LOOKUPS * 1e6:8.1f} us per lookup "
+                f"| {footprint / 2**20:8.1f} MiB on disk"
+            )
+
+        sqlite_store.close()
+
+
+def _create_entries(rng: random.Random):
+    entries = {}
+
+    for i in range(NUMBER_OF_COMPLETIONS):
+        content = " ".join(rng.choice(["lorem", "ipsum", "dolor"]) for _ in range(200))
+        response = {"choices": [{"message": {"role": "assistant", "content": content}}]}
+        entries[get_hash_digest(f"completion {i}")] = response
+
+    for i in range(NUMBER_OF_EMBEDDINGS):
+        embedding = [rng.uniform(-0.1, 0.1) for _ in range(EMBEDDING_DIMENSION)]
+        response = {"data": [{"index": 0, "embedding": embedding}]}
+        entries[get_hash_digest(f"embedding {i}")] = response
+
+    return {
+        key: json.dumps(value, separators=(",", ":")).encode()
+        for key, value in entries.items()
+    }
+
+
+async def _fill(store, entries: dict[str, bytes]):
+    for hash_digest, data in entries.items():
+        await store.put(hash_digest, data)
+
+
+async def _time_lookups(store, lookups: list[str]):
+    start = time.perf_counter()
+
+    for hash_digest in lookups:
+        assert await store.get(hash_digest) is not None
+
+    return time.perf_counter() - start
+
+
+def _get_disk_usage(root: pathlib.Path, pattern="**/*"):
+    # Allocated blocks, so that per file overhead is accounted for
+    return sum(path.stat().st_blocks * 512 for path in root.glob(pattern))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure event loop lag while a burst of alert emails is parsed.
+
+A ticker sleeps for TICK_SECONDS at a time and records how late it
+wakes, which is how long any other webhook or completion callback would
+have been held up. The burst parses the saved Google Alert email and
+extracts the text of the saved article, once inline on the event loop
+and once on the CPU pool.
+
+Run with:
+
+    poetry run python dev/benchmarks/event_loop_lag.py [number of emails] [workers]
+"""
+
+import asyncio
+import sys
+import time
+
+import numpy as np
+
+from assistance import _article_cache, _cpu
+from assistance._parsing.googlealerts import parse_alerts
+from assistance._paths import TESTS_DATA
+
+TICK_SECONDS = 0.005
+DEFAULT_NUM_EMAILS = 50
+
+ALERTS_HTML = (TESTS_DATA / "google-alert-example.html").read_text()
+ARTICLE_HTML = (TESTS_DATA / "article-example.html").read_bytes()
+
+
+async def ticker(lags: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(time.perf_counter() - start - TICK_SECONDS)
+
+
+async def handle_alert_email():
+    await _cpu.run_cpu_bound(parse_alerts, ALERTS_HTML)
+    await _cpu.run_cpu_bound(
+        _article_cache._extract_text, ARTICLE_HTML, "html.parser", True
+    )
+
+
+async def burst(num_emails: int):
+    # Started ahead of time, so that spawning the workers is not counted
+    await _cpu.run_cpu_bound(parse_alerts, ALERTS_HTML)
+
+    lags: list[float] = []
+    stop = asyncio.Event()
+    ticker_task = asyncio.create_task(ticker(lags, stop))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[handle_alert_email() for _ in range(num_emails)])
+    seconds = time.perf_counter() - start
+
+    stop.set()
+    await ticker_task
+
+    return seconds, np.array(lags) * 1000
+
+
+def main():
+    num_emails = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUM_EMAILS
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+
+    for name, workers in [("inline", 0), (f"{num_workers} workers", num_workers)]:
+        _cpu.get_cpu_workers = lambda workers=workers: workers
+        seconds, lags = asyncio.run(burst(num_emails))
+        _cpu.shutdown()
+
+        print(
+            f"{name:>10} | {num_emails} emails in {seconds:6.2f} s | "
+            f"loop lag p50: {np.percentile(lags, 50):7.1f} ms, "
+            f"p95: {np.percentile(lags, 95):7.1f} ms, max: {lags.max():7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
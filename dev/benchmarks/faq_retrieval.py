@@ -0,0 +1,183 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare the exact and IVF embedding searches, and the BM25 fallback.
+
+FAQ items are found by embedding, through the IVF index once the FAQ is
+large enough to have one, and BM25 is only used when the embeddings time
+out. Recall is measured against the exact embedding search. Each query is an
+FAQ question with some of its words dropped, to stand in for a student
+asking it in their own words. With an FAQ name, the FAQ's questions and
+answers are used along with its stored embeddings, a query's embedding
+being that of its question plus noise, so that no API calls are made.
+Without one, a synthetic FAQ is made whose embeddings are the mean of
+per-word vectors.
+
+The times are of the local work alone. The embedding searches
+additionally wait on an embedding API call per query, which BM25 does
+not.
+
+Run with:
+
+    poetry run python dev/benchmarks/faq_retrieval.py [FAQ name]
+"""
+
+import asyncio
+import sys
+import time
+
+import numpy as np
+
+from assistance import _embedding_store
+from assistance._ann import IVFIndex
+from assistance._config import load_faq_data
+from assistance._embeddings import _lexical_top_k
+from assistance._faq.registry import _build_lexical_index
+from assistance._similarity import normalise_rows, top_k_embeddings
+
+EMBEDDING_DIMENSION = 1536
+NUM_TOPICS = 40
+WORDS_PER_TOPIC = 60
+NUM_QUERIES = 200
+QUERY_NOISE = 0.02
+K = 5
+REPEATS = 5
+
+SYNTHETIC_SIZES = [300, 3_000, 30_000]
+
+
+def synthetic_faq(rng, size):
+    vocabulary = [
+        [f"t{topic}w{word}" for word in range(WORDS_PER_TOPIC)]
+        for topic in range(NUM_TOPICS)
+    ]
+    topic_vectors = rng.normal(size=(NUM_TOPICS, EMBEDDING_DIMENSION))
+    word_vectors = {
+        word: topic_vectors[topic] + rng.normal(size=EMBEDDING_DIMENSION)
+        for topic, words in enumerate(vocabulary)
+        for word in words
+    }
+
+    items = []
+    for _ in range(size):
+        topic = rng.integers(NUM_TOPICS)
+        question = " ".join(rng.choice(vocabulary[topic], size=8))
+        answer = " ".join(rng.choice(vocabulary[topic], size=30))
+        items.append({"question": question, "answer": answer})
+
+    def embed(text):
+        return np.mean([word_vectors[word] for word in text.split()], axis=0)
+
+    embeddings = normalise_rows(np.array([embed(item["question"]) for item in items]))
+
+    faq_data = {"name": f"synthetic-{size}", "hash": str(size), "items": items}
+
+    return faq_data, embeddings, embed
+
+
+def stored_faq(name):
+    faq_data = asyncio.run(load_faq_data(name))
+
+    loaded = _embedding_store._load_store(f"faq-{name}")
+    if loaded is None:
+        raise SystemExit(
+            f"No stored embeddings for `{name}`, answer a question with it first"
+        )
+
+    return faq_data, np.asarray(loaded[1], dtype=np.float32)
+
+
+def make_queries(rng, faq_data, embeddings, embed=None):
+    query_rows = rng.choice(len(faq_data["items"]), size=NUM_QUERIES)
+
+    queries = []
+    queries_embedding = []
+    for row in query_rows:
+        words = faq_data["items"][row]["question"].split()
+        kept = [word for word in words if rng.random() > 0.5] or words[:1]
+        queries.append(" ".join(kept))
+
+        if embed is None:
+            noise = rng.normal(scale=QUERY_NOISE, size=embeddings.shape[1])
+            queries_embedding.append(embeddings[row] + noise)
+        else:
+            queries_embedding.append(embed(" ".join(kept)))
+
+    return queries, np.array(queries_embedding, dtype=np.float32)
+
+
+def recall(found_indices, exact_indices):
+    found = [
+        len(set(found) & set(exact)) / len(exact)
+        for found, exact in zip(found_indices, exact_indices)
+        if exact
+    ]
+
+    return float(np.mean(found))
+
+
+def time_per_call(function):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        result = function()
+
+    return (time.perf_counter() - start) / REPEATS * 1000, result
+
+
+def report(faq_data, embeddings, queries, queries_embedding):
+    lexical_index = _build_lexical_index(faq_data)
+
+    exact_ms, (exact_indices, _) = time_per_call(
+        lambda: top_k_embeddings(queries_embedding, embeddings, K, normalised=True)
+    )
+    index = IVFIndex.build(embeddings)
+    ivf_ms, (ivf_indices, _) = time_per_call(
+        lambda: top_k_embeddings(
+            queries_embedding, embeddings, K, index=index, normalised=True
+        )
+    )
+    lexical_ms, lexical_indices = time_per_call(
+        lambda: _lexical_top_k(lexical_index, queries, K)
+    )
+
+    print(f"{faq_data['name']}: {len(embeddings)} items, {len(queries)} queries")
+    for name, milliseconds, indices in [
+        ("exact", exact_ms, exact_indices),
+        ("ivf", ivf_ms, ivf_indices),
+        ("bm25", lexical_ms, lexical_indices),
+    ]:
+        print(
+            f"    {name:>6} | {milliseconds:8.2f} ms | "
+            f"recall@{K}: {recall(indices, exact_indices):.3f}"
+        )
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    if len(sys.argv) > 1:
+        faq_data, embeddings = stored_faq(sys.argv[1])
+        queries, queries_embedding = make_queries(rng, faq_data, embeddings)
+        report(faq_data, embeddings, queries, queries_embedding)
+
+        return
+
+    for size in SYNTHETIC_SIZES:
+        faq_data, embeddings, embed = synthetic_faq(rng, size)
+        queries, queries_embedding = make_queries(rng, faq_data, embeddings, embed)
+        report(faq_data, embeddings, queries, queries_embedding)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time extracting the text of the saved pages with each HTML parser.
+
+Parsers that are not installed are skipped. A cached lookup is timed as
+well, which is what every scrape of an already parsed article costs.
+
+Run with:
+
+    poetry run python dev/benchmarks/html_parsing.py
+"""
+
+import asyncio
+import importlib.util
+import pathlib
+import tempfile
+import time
+
+from assistance import _article_cache, _paths
+from assistance._paths import TESTS_DATA
+from assistance._vendor.stackoverflow.web_scraping import extract_text
+
+PARSERS = {"html.parser": None, "lxml": "lxml", "selectolax": "selectolax"}
+REPEATS = 20
+
+
+def time_per_call(function):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        result = function()
+
+    return (time.perf_counter() - start) / REPEATS * 1000, result
+
+
+def main():
+    installed = [
+        name
+        for name, module in PARSERS.items()
+        if module is None or importlib.util.find_spec(module) is not None
+    ]
+    print(f"Installed parsers: {', '.join(installed)}")
+
+    for path in sorted(TESTS_DATA.glob("*.html")):
+        html = path.read_bytes()
+        print(f"{path.name}: {len(html) / 1024:.0f} KiB")
+
+        for parser in installed:
+            milliseconds, text = time_per_call(lambda: extract_text(html, parser))
+            print(
+                f"    {parser:>11} | {milliseconds:8.2f} ms | "
+                f"{len(text):>6} characters"
+            )
+
+        with tempfile.TemporaryDirectory() as directory:
+            _paths.EXTRACTED_ARTICLE_TEXT = pathlib.Path(directory)
+
+            asyncio.run(_article_cache.get_article_text(html, "html.parser"))
+            milliseconds, _ = time_per_call(
+                lambda: asyncio.run(
+                    _article_cache.get_article_text(html, "html.parser")
+                )
+            )
+
+        print(f"    {'cached':>11} | {milliseconds:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
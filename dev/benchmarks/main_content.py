@@ -0,0 +1,106 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Report the tokens saved by keeping only each page's main content.
+
+The saved pages in tests/data are used, along with any directories of
+saved pages that are passed in, such as the downloaded-articles records.
+Each page is counted as the whole page's text and as its main content's
+text, along with the number of sections, each a completion, that
+`_summarise_piecewise` would split it into.
+
+Run with:
+
+    poetry run python dev/benchmarks/main_content.py [directory ...]
+"""
+
+import pathlib
+import sys
+
+from assistance._paths import TESTS_DATA
+from assistance._readability import get_main_content
+from assistance._summarisation.with_tasks import (
+    MODEL_KWARGS,
+    NEWS_PROMPT,
+    TOKENS_OVERLAP,
+)
+from assistance._tokens import count_tokens, get_remaining_tokens, split_by_tokens
+from assistance._vendor.stackoverflow.web_scraping import extract_text
+
+
+def get_pages(directories):
+    yield from sorted(TESTS_DATA.glob("*.html"))
+
+    for directory in directories:
+        yield from sorted(
+            path for path in pathlib.Path(directory).rglob("*") if path.is_file()
+        )
+
+
+def count_sections(text, chunk_tokens):
+    return len(
+        split_by_tokens(
+            text,
+            chunk_tokens=chunk_tokens,
+            overlap_tokens=TOKENS_OVERLAP,
+            model=MODEL_KWARGS["engine"],
+        )
+    )
+
+
+def main():
+    prompt = NEWS_PROMPT.format(tasks="", goals="", target_audience="", text="")
+    chunk_tokens = get_remaining_tokens(
+        prompt=prompt,
+        max_tokens=MODEL_KWARGS["max_tokens"],
+        model=MODEL_KWARGS["engine"],
+    )
+
+    total_whole = 0
+    total_main = 0
+
+    for path in get_pages(sys.argv[1:]):
+        html = path.read_bytes()
+
+        try:
+            html.decode(encoding="utf8")
+        except UnicodeDecodeError:
+            continue
+
+        whole = extract_text(html)
+        main_content = get_main_content(html)
+        main = whole if main_content is None else extract_text(main_content.encode())
+
+        whole_tokens = count_tokens(whole, MODEL_KWARGS["engine"])
+        main_tokens = count_tokens(main, MODEL_KWARGS["engine"])
+
+        total_whole += whole_tokens
+        total_main += main_tokens
+
+        print(
+            f"{path.name[:40]:>40} | tokens: {whole_tokens:>6} -> {main_tokens:>6} "
+            f"({1 - main_tokens / max(whole_tokens, 1):6.1%} saved) | sections: "
+            f"{count_sections(whole, chunk_tokens)} -> "
+            f"{count_sections(main, chunk_tokens)}"
+            + ("" if main_content is not None else " | no main content found")
+        )
+
+    print(
+        f"{'total':>40} | tokens: {total_whole:>6} -> {total_main:>6} "
+        f"({1 - total_main / max(total_whole, 1):6.1%} saved)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Count the summarisation API calls made by the old and new budgets.
+
+The old budget split articles by words, assuming 0.75 words per token
+with a 0.7 safety buffer. The new budget counts tokens. Each summary is
+stood in for by a block of filler text of a typical summary length, so
+that the recursive map-reduce can be counted without calling the API.
+
+Run with:
+
+    poetry run python dev/benchmarks/summary_token_budget.py
+"""
+
+import pathlib
+
+from bs4 import BeautifulSoup
+
+from assistance._summarisation.with_tasks import (
+    MAX_NUMBER_OF_TEXT_SECTIONS,
+    MODEL_KWARGS,
+    NEWS_PROMPT,
+    TOKENS_OVERLAP,
+)
+from assistance._tokens import count_tokens, get_remaining_tokens, split_by_tokens
+from assistance._utilities import get_approximate_allowed_remaining_words
+
+DATA = pathlib.Path(__file__).parents[2] / "assistance" / "tests" / "data"
+
+SUMMARY_WORDS = 250
+
+# The test corpus article, and longer articles made by repeating it
+REPEATS = [1, 5, 10, 20, 40]
+
+PROMPT = NEWS_PROMPT.format(
+    tasks="- Write a weekly newsletter\n- Find new leads\n- Track competitors",
+    goals="- Keep students informed\n- Grow the program",
+    target_audience="Prospective international students",
+    text="{text}",
+)
+
+
+def old_sections(text: str) -> list[str]:
+    words = text.split(None)
+    remaining_words = get_approximate_allowed_remaining_words(
+        prompt=PROMPT, max_tokens=MODEL_KWARGS["max_tokens"]
+    )
+    step = int(remaining_words * 0.7 - 40)
+
+    return [" ".join(words[i : i + step + 40]) for i in range(0, len(words), step)]
+
+
+def new_sections(text: str) -> list[str]:
+    remaining_tokens = get_remaining_tokens(
+        prompt=PROMPT.format(text=""),
+        max_tokens=MODEL_KWARGS["max_tokens"],
+        model=MODEL_KWARGS["engine"],
+    )
+
+    return split_by_tokens(
+        text.strip(),
+        chunk_tokens=remaining_tokens,
+        overlap_tokens=TOKENS_OVERLAP,
+        model=MODEL_KWARGS["engine"],
+    )
+
+
+def count_calls(text: str, get_sections) -> int:
+    sections = get_sections(text)[:MAX_NUMBER_OF_TEXT_SECTIONS]
+
+    if len(sections) <= 1:
+        return len(sections)
+
+    combined = "\n\n".join(" ".join(["summary"] * SUMMARY_WORDS) for _ in sections)
+
+    return len(sections) + count_calls(combined, get_sections)
+
+
+def main():
+    html = (DATA / "google-alert-example.html").read_text(encoding="utf8")
+    # Collapse the whitespace left over from the layout, as scraping does
+    article = " ".join(BeautifulSoup(html, "html.parser").get_text(" ").split())
+
+    total_old = 0
+    total_new = 0
+
+    for repeats in REPEATS:
+        text = " ".join([article] * repeats)
+
+        old_calls = count_calls(text, old_sections)
+        new_calls = count_calls(text, new_sections)
+        total_old += old_calls
+        total_new += new_calls
+
+        print(
+            f"{count_tokens(text):>7} tokens | "
+            f"sections old: {len(old_sections(text)):>3} "
+            f"new: {len(new_sections(text)):>3} | "
+            f"API calls old: {old_calls:>3} new: {new_calls:>3}"
+        )
+
+    print(f"Total API calls, old: {total_old}, new: {total_new}")
+
+
+if __name__ == "__main__":
+    main()
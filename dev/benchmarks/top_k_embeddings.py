@@ -0,0 +1,71 @@
+# Copyright (C) 2023 Assistance.Chat contributors
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare the numpy and torch top-k similarity backends.
+
+Run with:
+
+    poetry run python dev/benchmarks/top_k_embeddings.py
+"""
+
+import timeit
+
+import numpy as np
+
+from assistance._similarity import SIMILARITY_BACKENDS
+
+EMBEDDING_DIMENSION = 1536
+K = 3
+REPEATS = 20
+
+# (number of sub-questions, number of FAQ items)
+SIZES = [(1, 300), (40, 300), (40, 3_000), (40, 30_000)]
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    backends = ["numpy"]
+    try:
+        import torch  # pylint: disable = unused-import
+    except ImportError:
+        print("torch is not installed, only benchmarking the numpy backend")
+    else:
+        backends.append("torch")
+
+    for num_queries, num_embeddings in SIZES:
+        queries = rng.normal(size=(num_queries, EMBEDDING_DIMENSION)).astype(np.float32)
+        embeddings = rng.normal(size=(num_embeddings, EMBEDDING_DIMENSION)).astype(
+            np.float32
+        )
+
+        for name in backends:
+            backend = SIMILARITY_BACKENDS[name]
+
+            # Warm up, the torch backend compiles its kernel on first use
+            backend(queries, embeddings, K, False)
+
+            seconds = timeit.timeit(
+                lambda: backend(queries, embeddings, K, False), number=REPEATS
+            )
+
+            print(
+                f"{name:>6} | queries: {num_queries:>3} | "
+                f"embeddings: {num_embeddings:>6} | "
+                f"{seconds / REPEATS * 1000:8.2f} ms per call"
+            )
+
+
+if __name__ == "__main__":
+    main()